@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
 import os
+from importlib.util import find_spec
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -50,6 +51,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'crm.middleware.SlowQueryMiddleware',
+    'crm.middleware.CompressionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -97,9 +100,120 @@ DATABASES = {
         'OPTIONS': {
             'connect_timeout': 10,  # Timeout de conexión en segundos
             'options': '-c statement_timeout=30000'  # Timeout de queries en ms (30 segundos)
-        } if os.getenv('DB_ENGINE') == 'django.db.backends.postgresql' else {},
+        } if os.getenv('DB_ENGINE') == 'django.db.backends.postgresql' else {
+            # SQLite: take the write lock when the transaction starts, so concurrent
+            # writers (gunicorn workers, job workers) wait for it instead of failing
+            # with "database is locked" when upgrading a read lock
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+    }
+}
+
+# Cache
+# Local memory per worker by default; set CACHE_BACKEND/CACHE_LOCATION to share it
+# between workers, e.g. django.core.cache.backends.redis.RedisCache + redis://127.0.0.1:6379/1
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv('CACHE_LOCATION', 'hol-crm'),
     }
 }
+if CACHE_BACKEND.endswith('LocMemCache'):
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '200000'))}
+
+# Serialized order/item fragments (crm.fragments), invalidated by version on save
+FRAGMENT_CACHE_ENABLED = os.getenv('FRAGMENT_CACHE_ENABLED', 'True') == 'True'
+FRAGMENT_CACHE_ALIAS = 'default'
+FRAGMENT_CACHE_TIMEOUT = int(os.getenv('FRAGMENT_CACHE_TIMEOUT', '86400'))
+
+# Broadcast of fragment version bumps to the other workers' local caches
+# (crm.invalidation): auto = LISTEN/NOTIFY on PostgreSQL, Unix sockets otherwise.
+# Not needed with a shared cache backend.
+INVALIDATION_BUS = os.getenv('INVALIDATION_BUS', 'auto' if CACHE_BACKEND.endswith('LocMemCache') else 'none')
+INVALIDATION_BUS_SOCKET_DIR = os.getenv('INVALIDATION_BUS_SOCKET_DIR', '/tmp/hol-crm-bus')
+
+# Single-flight for polled GET endpoints (crm.coalescing): identical requests share
+# one computation, and its result for the window below (seconds)
+COALESCE_ENABLED = os.getenv('COALESCE_ENABLED', 'True') == 'True'
+COALESCE_WINDOW_SECONDS = float(os.getenv('COALESCE_WINDOW_SECONDS', '1.0'))
+COALESCE_WAIT_SECONDS = float(os.getenv('COALESCE_WAIT_SECONDS', '10'))
+
+# Django REST Framework
+# orjson-backed JSON (same output as the stock renderer) and optional MessagePack
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'crm.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ] + (['crm.renderers.MessagePackRenderer'] if find_spec('msgpack') else []),
+    'DEFAULT_PARSER_CLASSES': [
+        'crm.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ] + (['crm.parsers.MessagePackParser'] if find_spec('msgpack') else []),
+}
+
+# Response compression (crm.middleware.CompressionMiddleware): brotli or gzip
+# according to Accept-Encoding, for bodies above the threshold (bytes)
+RESPONSE_COMPRESSION_MIN_SIZE = int(os.getenv('RESPONSE_COMPRESSION_MIN_SIZE', '1024'))
+RESPONSE_COMPRESSION_GZIP_LEVEL = int(os.getenv('RESPONSE_COMPRESSION_GZIP_LEVEL', '6'))
+RESPONSE_COMPRESSION_BROTLI_QUALITY = int(os.getenv('RESPONSE_COMPRESSION_BROTLI_QUALITY', '4'))
+
+# Slow query log (crm.slow_queries)
+# Queries above the threshold are stored with their EXPLAIN plan; list them with
+# `python manage.py slow_queries`. Keep the threshold well below statement_timeout.
+SLOW_QUERY_LOG_ENABLED = os.getenv('SLOW_QUERY_LOG_ENABLED', 'True') == 'True'
+SLOW_QUERY_THRESHOLD_MS = int(os.getenv('SLOW_QUERY_THRESHOLD_MS', '1000'))
+SLOW_QUERY_EXPLAIN_ANALYZE = os.getenv('SLOW_QUERY_EXPLAIN_ANALYZE', 'False') == 'True'  # Re-ejecuta el SELECT
+SLOW_QUERY_MAX_ENTRIES = int(os.getenv('SLOW_QUERY_MAX_ENTRIES', '500'))
+
+# Smart Queue keyset pagination (?limit=, ?cursor=)
+SMART_QUEUE_PAGE_SIZE = int(os.getenv('SMART_QUEUE_PAGE_SIZE', '100'))
+SMART_QUEUE_MAX_PAGE_SIZE = int(os.getenv('SMART_QUEUE_MAX_PAGE_SIZE', '500'))
+
+# Hot/cold split (crm.archive): `python manage.py archive_orders` moves orders
+# CLOSED for this many days out of the operational tables, this many per transaction
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '365'))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '200'))
+
+# Currency that order and payment amounts are also stored in (crm.fx, *_base
+# columns) for reports across currencies; rates are entered in the admin
+FX_BASE_CURRENCY = os.getenv('FX_BASE_CURRENCY', 'EUR')
+
+# Accounts receivable aging report (crm.receivables, /api/reports/aging/): seconds a
+# report is cached at most (any write to the orders replaces it sooner)
+AGING_REPORT_CACHE_SECONDS = int(os.getenv('AGING_REPORT_CACHE_SECONDS', '3600'))
+
+# Columnar analytics snapshots (crm.analytics, /api/analytics/): where
+# `python manage.py snapshot_analytics` writes them, and how many are kept
+ANALYTICS_SNAPSHOT_DIR = os.getenv('ANALYTICS_SNAPSHOT_DIR', str(BASE_DIR / 'analytics'))
+ANALYTICS_SNAPSHOTS_KEPT = int(os.getenv('ANALYTICS_SNAPSHOTS_KEPT', '3'))
+
+# Multi-get endpoints (/api/orders/multi/, /api/service-items/multi/): ids per request
+MULTI_GET_MAX_IDS = int(os.getenv('MULTI_GET_MAX_IDS', '100'))
+
+# Auto-assignment (crm.assignment): tramitadores are the active members of
+# this group; effort per legalization type and how close a deadline must be
+# for an item to be assigned first
+TRAMITADOR_GROUP = os.getenv('TRAMITADOR_GROUP', 'Tramitadores')
+ASSIGNMENT_EFFORT = {}  # e.g. {'MINJUS_CONSULADO': 3.0}, on top of crm.assignment.DEFAULT_EFFORT
+ASSIGNMENT_NEAR_DEADLINE_HOURS = int(os.getenv('ASSIGNMENT_NEAR_DEADLINE_HOURS', '48'))
+
+# Background jobs (crm.jobs, `python manage.py run_workers`)
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '1.0'))
+JOB_TIMEOUT_SECONDS = int(os.getenv('JOB_TIMEOUT_SECONDS', '900'))  # RUNNING longer: worker presumed dead
+JOB_MAX_BACKOFF_SECONDS = int(os.getenv('JOB_MAX_BACKOFF_SECONDS', '3600'))
+JOB_RETENTION_DAYS = int(os.getenv('JOB_RETENTION_DAYS', '7'))
+
+# Email (payment requests are sent by the job workers)
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+EMAIL_HOST = os.getenv('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.getenv('EMAIL_PORT', '25'))
+EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'False') == 'True'
+DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'no-reply@hol-crm.local')
 
 # CORS Configuration
 CORS_ALLOWED_ORIGINS = os.getenv('CORS_ALLOWED_ORIGINS', 'http://localhost:3000,http://localhost:3001').split(',')
@@ -121,6 +235,21 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'range',
+    'if-range',
+    'upload-offset',
+    'x-chunk-sha256',
+    'idempotency-key',
+]
+
+# Response headers readable by the frontend
+CORS_EXPOSE_HEADERS = [
+    'link',
+    'x-next-cursor',
+    'upload-offset',
+    'content-range',
+    'accept-ranges',
+    'idempotent-replayed',
 ]
 
 
@@ -161,5 +290,40 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# Uploaded files and generated documents (invoices)
+MEDIA_URL = '/media/'
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', str(BASE_DIR / 'media'))
+
+# Idempotency-Key header on mutating endpoints (crm.idempotency): hours a
+# response is kept for replay; `python manage.py purge_idempotency_keys` deletes the expired ones
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv('IDEMPOTENCY_KEY_TTL_HOURS', '24'))
+
+# Transactional batches of desk operations (crm.batch, /api/batch/): operations per request
+BATCH_MAX_OPERATIONS = int(os.getenv('BATCH_MAX_OPERATIONS', '50'))
+
+# Offline sync for branch offices (crm.sync, /api/sync/): overlap between
+# consecutive pulls, cursor age that forces a full resync, queue length sent
+# and mutations accepted per push
+SYNC_OVERLAP_SECONDS = int(os.getenv('SYNC_OVERLAP_SECONDS', '120'))
+SYNC_MAX_CURSOR_AGE_DAYS = int(os.getenv('SYNC_MAX_CURSOR_AGE_DAYS', '30'))
+SYNC_QUEUE_SIZE = int(os.getenv('SYNC_QUEUE_SIZE', '200'))
+SYNC_MAX_MUTATIONS = int(os.getenv('SYNC_MAX_MUTATIONS', '500'))
+
+# Resumable uploads (crm.files, /api/uploads/): suggested and maximum chunk
+# size, largest file accepted and hours before an abandoned upload is purged
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', str(4 * 1024 * 1024)))
+UPLOAD_MAX_CHUNK_SIZE = int(os.getenv('UPLOAD_MAX_CHUNK_SIZE', str(16 * 1024 * 1024)))
+UPLOAD_MAX_SIZE = int(os.getenv('UPLOAD_MAX_SIZE', str(500 * 1024 * 1024)))
+UPLOAD_EXPIRY_HOURS = int(os.getenv('UPLOAD_EXPIRY_HOURS', '48'))
+
+# Document downloads: '' streams from Django (with Range), 'nginx' answers with
+# X-Accel-Redirect to FILE_DOWNLOAD_ACCEL_PREFIX (an `internal` location with
+# `alias` MEDIA_ROOT), 'sendfile' with X-Sendfile (Apache mod_xsendfile, lighttpd)
+FILE_DOWNLOAD_OFFLOAD = os.getenv('FILE_DOWNLOAD_OFFLOAD', '')
+FILE_DOWNLOAD_ACCEL_PREFIX = os.getenv('FILE_DOWNLOAD_ACCEL_PREFIX', '/protected-media/')
+
+# Invoice header (crm.invoices), one line per '|'
+INVOICE_ISSUER = os.getenv('INVOICE_ISSUER', 'HOL Gestión de Trámites').split('|')
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Client, Order, ServiceItem, Payment, ActivityLog
+from .models import Client, Order, ServiceItem, Payment, ActivityLog, SlowQuery, Job, Upload, SyncMutation, IdempotencyKey, ArchivedOrder, ExchangeRate
 
 class ServiceItemInline(admin.TabularInline):
     model = ServiceItem
@@ -43,3 +43,49 @@ class ActivityLogAdmin(admin.ModelAdmin):
     list_filter = ('action_type', 'timestamp')
     search_fields = ('order__order_friendly_id', 'description')
     readonly_fields = ('timestamp',)
+
+@admin.register(SlowQuery)
+class SlowQueryAdmin(admin.ModelAdmin):
+    list_display = ('normalized_sql', 'calls', 'max_duration_ms', 'total_duration_ms', 'origin', 'view_name', 'last_seen')
+    search_fields = ('normalized_sql', 'origin', 'view_name')
+    readonly_fields = [f.name for f in SlowQuery._meta.fields]
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('task', 'status', 'attempts', 'max_attempts', 'run_at', 'worker', 'created_at', 'finished_at')
+    list_filter = ('status', 'task')
+    search_fields = ('task', 'dedupe_key', 'last_error')
+    readonly_fields = ('worker', 'started_at', 'finished_at', 'result', 'last_error', 'created_at')
+
+@admin.register(Upload)
+class UploadAdmin(admin.ModelAdmin):
+    list_display = ('filename', 'target', 'object_id', 'status', 'received', 'size', 'created_by', 'updated_at')
+    list_filter = ('status', 'target')
+    search_fields = ('filename', 'sha256', 'stored_name')
+    readonly_fields = ('received', 'stored_name', 'created_at', 'updated_at')
+
+@admin.register(SyncMutation)
+class SyncMutationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'device', 'user', 'created_at')
+    list_filter = ('status', 'kind')
+    search_fields = ('id', 'device')
+    readonly_fields = ('id', 'device', 'kind', 'status', 'result', 'user', 'created_at')
+
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = ('key', 'scope', 'status_code', 'created_at', 'expires_at')
+    search_fields = ('key', 'scope')
+    readonly_fields = ('key', 'scope', 'fingerprint', 'status_code', 'response', 'created_at', 'expires_at')
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ('order_friendly_id', 'client', 'currency', 'total_amount', 'closed_at', 'archived_at')
+    search_fields = ('order_friendly_id', 'client__full_name', 'client__email')
+    readonly_fields = ('id', 'order_friendly_id', 'client', 'currency', 'total_amount', 'total_paid', 'created_at',
+                       'closed_at', 'archived_at', 'rows', 'detail', 'portal')
+
+@admin.register(ExchangeRate)
+class ExchangeRateAdmin(admin.ModelAdmin):
+    list_display = ('currency', 'rate', 'effective_date', 'created_at')
+    list_filter = ('currency',)
+    date_hierarchy = 'effective_date'
@@ -0,0 +1,406 @@
+"""
+Columnar snapshots for margin and volume reporting (/api/analytics/).
+
+`python manage.py snapshot_analytics`, run nightly, exports one fact row
+per service item (archived orders included) into ANALYTICS_SNAPSHOT_DIR:
+a directory per snapshot with one NumPy .npy file per column and a
+manifest.json with the dictionaries of the coded columns. Dimensions are
+the order month, tramitador, service type, document type, legalization
+type, destination, currency and status; measures are the item count and
+the price, cost and margin in FX_BASE_CURRENCY cents (crm.fx, at the rate
+of the day the order was created; items without one count with 0).
+
+The snapshot is written to a temporary directory and published by
+replacing the CURRENT file, so readers never see a partial one. Each
+process memory-maps the current snapshot (np.load(mmap_mode='r'): the
+workers share the page cache) and answers pivots and time series with
+vectorized group-bys over the columns, without querying the database.
+
+numpy is optional: the files are written with the standard library, and
+without numpy the columns are read into memory and grouped in Python,
+which gives the same results more slowly.
+"""
+import ast
+import json
+import os
+import shutil
+import struct
+import sys
+import threading
+from array import array
+from decimal import ROUND_HALF_UP, Decimal
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from . import fx
+from .models import ArchivedOrder, ServiceItem
+from .projections import decimal_string
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+CHUNK_SIZE = 10000
+CURRENT = 'CURRENT'
+MANIFEST = 'manifest.json'
+
+# Column: (array typecode, ServiceItem field or None when derived)
+COLUMNS = {
+    'item': ('q', 'pk'),
+    'order': ('q', 'order_id'),
+    'month': ('i', None),
+    'tramitador': ('i', 'assigned_tramitador_id'),
+    'service_type': ('h', 'service_type'),
+    'document_type': ('h', 'document_type'),
+    'legalization_type': ('h', 'legalization_type'),
+    'destination': ('h', 'delivery_destination'),
+    'currency': ('h', None),
+    'status': ('h', 'status'),
+    'price': ('q', 'price'),
+    'cost': ('q', 'cost'),
+    'margin': ('q', 'margin'),
+}
+DIMENSIONS = ('month', 'tramitador', 'service_type', 'document_type', 'legalization_type', 'destination',
+              'currency', 'status')
+# Dimensions stored as indexes into the manifest dictionaries
+CODED = DIMENSIONS[2:]
+MEASURES = ('price', 'cost', 'margin')
+_DESCR = {'q': '<i8', 'i': '<i4', 'h': '<i2'}
+_TYPECODES = {descr: typecode for typecode, descr in _DESCR.items()}
+_MAGIC = b'\x93NUMPY\x01\x00'
+
+_lock = threading.Lock()
+_loaded = {'name': None, 'snapshot': None}
+
+
+class NoSnapshot(LookupError):
+    """No analytics snapshot has been taken yet"""
+
+
+def snapshot_dir():
+    return str(settings.ANALYTICS_SNAPSHOT_DIR)
+
+
+# .npy files (format 1.0), https://numpy.org/doc/stable/reference/generated/numpy.lib.format.html
+
+def _write_column(path, values):
+    header = f"{{'descr': '{_DESCR[values.typecode]}', 'fortran_order': False, 'shape': ({len(values)},), }}"
+    # The data starts on a 64-byte boundary
+    header += ' ' * (-(len(_MAGIC) + 2 + len(header) + 1) % 64) + '\n'
+    if sys.byteorder != 'little':  # pragma: no cover - big-endian hosts
+        values = array(values.typecode, values)
+        values.byteswap()
+    with open(path, 'wb') as column:
+        column.write(_MAGIC + struct.pack('<H', len(header)) + header.encode('latin1'))
+        values.tofile(column)
+
+
+def _read_column(path):
+    if np is not None:
+        return np.load(path, mmap_mode='r')
+    with open(path, 'rb') as column:
+        raw = column.read()
+    length = struct.unpack('<H', raw[8:10])[0]
+    header = ast.literal_eval(raw[10:10 + length].decode('latin1'))
+    values = array(_TYPECODES[header['descr']])
+    values.frombytes(raw[10 + length:])
+    if sys.byteorder != 'little':  # pragma: no cover - big-endian hosts
+        values.byteswap()
+    return values
+
+
+# Snapshot
+
+def _month(created_at):
+    created_at = timezone.localtime(created_at)
+    return created_at.year * 12 + created_at.month - 1
+
+
+def month_label(month):
+    return f'{month // 12:04d}-{month % 12 + 1:02d}'
+
+
+def parse_month(value):
+    """'YYYY-MM' as a month column value; ValueError otherwise"""
+    year, _, month = value.partition('-')
+    if not (year.isdigit() and month.isdigit() and 1 <= int(month) <= 12):
+        raise ValueError(f"'{value}' is not a month (YYYY-MM)")
+    return int(year) * 12 + int(month) - 1
+
+
+class _Writer:
+    """Fact rows accumulated column by column"""
+
+    def __init__(self):
+        self.columns = {name: array(typecode) for name, (typecode, _) in COLUMNS.items()}
+        self.dictionaries = {name: {} for name in CODED}
+        self.rates = {}
+        self.unconverted = 0
+
+    def _code(self, dimension, value):
+        codes = self.dictionaries[dimension]
+        return codes.setdefault(value or '', len(codes))
+
+    def _cents(self, amount, factor):
+        return int((Decimal(str(amount or 0)) * factor * 100).quantize(Decimal(1), ROUND_HALF_UP))
+
+    def add(self, row, created_at, currency):
+        day = timezone.localdate(created_at)
+        if (currency, day) not in self.rates:
+            self.rates[currency, day] = fx.rate(currency, day)
+        factor = self.rates[currency, day]
+        if factor is None:
+            self.unconverted += 1
+        values = dict(row, month=_month(created_at), currency=currency)
+        for name, column in self.columns.items():
+            value = values[name]
+            if name in CODED:
+                value = self._code(name, value)
+            elif name in MEASURES:
+                value = 0 if factor is None else self._cents(value, factor)
+            elif name == 'tramitador':
+                value = value or 0
+            column.append(value)
+
+
+def _items():
+    """(fact row, order created_at, order currency) for every item, archived ones included"""
+    fields = {name: field for name, (_, field) in COLUMNS.items() if field}
+    for values in ServiceItem.objects.order_by('pk').values_list(
+            *fields.values(), 'order__created_at', 'order__currency').iterator(chunk_size=CHUNK_SIZE):
+        yield dict(zip(fields, values)), values[-2], values[-1]
+
+    # Archived rows keep the model fields by name (crm.archive), the primary key apart
+    names = {name: field.removesuffix('_id') for name, field in fields.items()}
+    for created_at, currency, rows in ArchivedOrder.objects.order_by('pk').values_list(
+            'created_at', 'currency', 'rows').iterator(chunk_size=CHUNK_SIZE // 10):
+        for row in rows:
+            if row['model'] == 'crm.serviceitem':
+                item = dict(row['fields'], pk=row['pk'])
+                yield {name: item.get(field) for name, field in names.items()}, created_at, currency
+
+
+def take_snapshot(directory=None, now=None):
+    """Export the fact rows as a new snapshot and publish it; returns its manifest"""
+    directory = directory or snapshot_dir()
+    now = timezone.localtime(now or timezone.now())
+    name = now.strftime('%Y%m%dT%H%M%S%f')
+    os.makedirs(directory, exist_ok=True)
+
+    writer = _Writer()
+    for row, created_at, currency in _items():
+        writer.add(row, created_at, currency)
+
+    tramitadores = sorted(set(writer.columns['tramitador']) - {0})
+    manifest = {
+        'name': name,
+        'generated_at': now.isoformat(),
+        'rows': len(writer.columns['item']),
+        'base_currency': fx.base_currency(),
+        'unconverted': writer.unconverted,
+        'columns': {column: _DESCR[values.typecode] for column, values in writer.columns.items()},
+        'dictionaries': {dimension: list(codes) for dimension, codes in writer.dictionaries.items()},
+        'tramitadores': {str(pk): username for pk, username in
+                         User.objects.filter(pk__in=tramitadores).values_list('pk', 'username')},
+    }
+
+    staging = os.path.join(directory, f'.{name}')
+    os.makedirs(staging)
+    for column, values in writer.columns.items():
+        _write_column(os.path.join(staging, f'{column}.npy'), values)
+    with open(os.path.join(staging, MANIFEST), 'w') as out:
+        json.dump(manifest, out)
+    os.rename(staging, os.path.join(directory, name))
+    with open(os.path.join(directory, f'.{CURRENT}'), 'w') as out:
+        out.write(name)
+    os.replace(os.path.join(directory, f'.{CURRENT}'), os.path.join(directory, CURRENT))
+
+    # Older snapshots may still be mapped by a worker until its next request
+    names = sorted(entry for entry in os.listdir(directory) if entry[:1].isdigit())
+    for old in names[:-max(settings.ANALYTICS_SNAPSHOTS_KEPT, 1)]:
+        shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+    return manifest
+
+
+class Snapshot:
+    def __init__(self, path):
+        with open(os.path.join(path, MANIFEST)) as manifest:
+            self.manifest = json.load(manifest)
+        self.columns = {column: _read_column(os.path.join(path, f'{column}.npy'))
+                        for column in self.manifest['columns']}
+        self.rows = self.manifest['rows']
+
+    def code(self, dimension, value):
+        """Column value for a filter value, None when no row can match it"""
+        if dimension == 'month':
+            return parse_month(value)
+        if dimension == 'tramitador':
+            if value == 'none':
+                return 0
+            if not value.isdigit():
+                raise ValueError(f"tramitador must be a user id or 'none', not '{value}'")
+            return int(value)
+        codes = self.manifest['dictionaries'][dimension]
+        return codes.index(value) if value in codes else None
+
+    def label(self, dimension, value):
+        if dimension == 'month':
+            return month_label(value)
+        if dimension == 'tramitador':
+            return value or None
+        return self.manifest['dictionaries'][dimension][value] or None
+
+    def aggregate(self, group_by, filters=(), months=(None, None)):
+        """
+        {(value per group_by dimension): (items, {measure: cents})} over the
+        rows matching every (dimension, column value) filter and month range.
+        """
+        if np is None:
+            return self._aggregate_python(group_by, filters, months)
+        mask = np.ones(self.rows, dtype=bool)
+        for dimension, code in filters:
+            mask &= self.columns[dimension] == code
+        first, last = months
+        if first is not None:
+            mask &= self.columns['month'] >= first
+        if last is not None:
+            mask &= self.columns['month'] <= last
+
+        keys = np.zeros(int(mask.sum()), dtype=np.int64)
+        groups = []
+        for dimension in group_by:
+            values, inverse = np.unique(self.columns[dimension][mask], return_inverse=True)
+            keys = keys * len(values) + inverse.reshape(-1)
+            groups.append(values)
+        keys, slots = np.unique(keys, return_inverse=True)
+        slots = slots.reshape(-1)
+        counts = np.bincount(slots, minlength=len(keys))
+        # float64 sums are exact up to 2**53 cents
+        sums = {measure: np.bincount(slots, weights=self.columns[measure][mask], minlength=len(keys))
+                for measure in MEASURES}
+
+        result = {}
+        for slot, key in enumerate(keys.tolist()):
+            group = []
+            for values in reversed(groups):
+                key, index = divmod(key, len(values))
+                group.append(int(values[index]))
+            result[tuple(reversed(group))] = (
+                int(counts[slot]), {measure: int(round(sums[measure][slot])) for measure in MEASURES})
+        return result
+
+    def _aggregate_python(self, group_by, filters, months):
+        first, last = months
+        month = self.columns['month']
+        conditions = [(self.columns[dimension], code) for dimension, code in filters]
+        keys = [self.columns[dimension] for dimension in group_by]
+        measures = [self.columns[measure] for measure in MEASURES]
+        result = {}
+        for row in range(self.rows):
+            if (first is not None and month[row] < first) or (last is not None and month[row] > last):
+                continue
+            if any(column[row] != code for column, code in conditions):
+                continue
+            key = tuple(column[row] for column in keys)
+            items, sums = result.get(key, (0, None))
+            values = [column[row] for column in measures]
+            result[key] = (items + 1, values if sums is None else [a + b for a, b in zip(sums, values)])
+        return {key: (items, dict(zip(MEASURES, sums))) for key, (items, sums) in result.items()}
+
+
+def current(directory=None):
+    """The published snapshot, mapped once per process; NoSnapshot before the first one"""
+    directory = directory or snapshot_dir()
+    try:
+        with open(os.path.join(directory, CURRENT)) as pointer:
+            name = pointer.read().strip()
+    except FileNotFoundError:
+        raise NoSnapshot('No analytics snapshot yet: run `python manage.py snapshot_analytics`') from None
+    path = os.path.join(directory, name)
+    if _loaded['name'] != path:
+        with _lock:
+            if _loaded['name'] != path:
+                _loaded.update(snapshot=Snapshot(path), name=path)
+    return _loaded['snapshot']
+
+
+def _list(params, name):
+    return [value for value in params.get(name, '').split(',') if value]
+
+
+def _cells(items, sums):
+    return {'items': items, **{measure: decimal_string(Decimal(sums[measure]).scaleb(-2)) for measure in MEASURES}}
+
+
+def report(params, directory=None):
+    """
+    Pivot or time series from the current snapshot, for the query parameters:
+
+    - group_by: comma-separated dimensions for the rows (DIMENSIONS; none: the totals)
+    - columns: a dimension spread across columns of `measure` (items, price, cost,
+      margin), e.g. group_by=tramitador&columns=month&measure=margin
+    - from, to: first and last month (YYYY-MM)
+    - any dimension: only the rows with that value (tramitador: user id or 'none')
+
+    ValueError for an unknown dimension, measure or month; NoSnapshot.
+    """
+    group_by, pivot = _list(params, 'group_by'), params.get('columns') or None
+    measure = params.get('measure', 'margin')
+    for dimension in group_by + ([pivot] if pivot else []):
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"Unknown dimension '{dimension}', expected one of: {', '.join(DIMENSIONS)}")
+    if len(set(group_by + ([pivot] if pivot else []))) != len(group_by) + bool(pivot):
+        raise ValueError('A dimension can only be used once')
+    if measure not in ('items', *MEASURES):
+        raise ValueError(f"Unknown measure '{measure}', expected items, {', '.join(MEASURES)}")
+    months = tuple(parse_month(params[bound]) if params.get(bound) else None for bound in ('from', 'to'))
+
+    snapshot = current(directory)
+    filters = []
+    for dimension in DIMENSIONS:
+        if params.get(dimension):
+            filters.append((dimension, snapshot.code(dimension, params[dimension])))
+    if any(code is None for _, code in filters):
+        groups = {}
+    else:
+        groups = snapshot.aggregate(group_by + ([pivot] if pivot else []), filters, months)
+
+    def row_labels(key):
+        labels = {dimension: snapshot.label(dimension, value) for dimension, value in zip(group_by, key)}
+        if 'tramitador' in labels:
+            labels['tramitador_name'] = snapshot.manifest['tramitadores'].get(str(labels['tramitador']))
+        return labels
+
+    def order(dimensions, key):
+        # By label, the rows without a value first
+        return tuple((label is not None, label) for label in map(snapshot.label, dimensions, key))
+
+    response = {
+        'snapshot': {'generated_at': snapshot.manifest['generated_at'], 'rows': snapshot.rows,
+                     'unconverted': snapshot.manifest['unconverted']},
+        'base_currency': snapshot.manifest['base_currency'],
+        'group_by': group_by,
+    }
+    if not pivot:
+        response['rows'] = [{**row_labels(key), **_cells(*groups[key])}
+                            for key in sorted(groups, key=partial(order, group_by))]
+        return response
+
+    columns = sorted({key[-1] for key in groups}, key=lambda value: order([pivot], [value]))
+    rows = {}
+    for key, (items, sums) in groups.items():
+        rows.setdefault(key[:-1], {})[key[-1]] = items if measure == 'items' else sums[measure]
+    cell = (lambda value: value) if measure == 'items' else (
+        lambda value: decimal_string(Decimal(value).scaleb(-2)))
+    response.update(
+        columns=[snapshot.label(pivot, value) for value in columns],
+        measure=measure,
+        rows=[{**row_labels(key), 'values': [cell(values.get(column, 0)) for column in columns],
+               'total': cell(sum(values.values()))}
+              for key, values in sorted(rows.items(), key=lambda entry: order(group_by, entry[0]))],
+    )
+    return response
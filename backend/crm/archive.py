@@ -0,0 +1,127 @@
+"""
+Hot/cold split: closed orders leave the operational tables.
+
+`python manage.py archive_orders` moves the orders CLOSED for more than
+ARCHIVE_AFTER_DAYS, with their items, payments and activity log, into
+crm.models.ArchivedOrder: one row per order holding the original rows (to
+restore them exactly, ids included) and the order as the detail and portal
+endpoints returned it. Kanban, Smart Queue, dashboard counters and every
+other operational query then only scan active work.
+
+The detail, multi-get and portal endpoints fall back to the archive for the
+ids and clients they don't find, so archived orders can still be looked up;
+they are read-only until `python manage.py restore_orders <id>` brings them
+back. Stored documents are left where they are.
+"""
+from datetime import date, datetime
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import serializers as model_serializers
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import fragments
+from .fragments import refresh_order
+from .models import ArchivedOrder, Order, ServiceItem
+from .serializers import OrderDetailSerializer, OrderSerializer, order_detail_queryset
+
+# Foreign keys to users that may have been deleted by the time an order is restored
+_USER_FIELDS = {'crm.order': ('created_by', 'assigned_to'), 'crm.serviceitem': ('assigned_tramitador',),
+                'crm.activitylog': ('user',)}
+
+
+def archivable(now=None, days=None):
+    """Orders closed, paid, and untouched for more than `days` (default ARCHIVE_AFTER_DAYS)"""
+    days = settings.ARCHIVE_AFTER_DAYS if days is None else days
+    cutoff = (now or timezone.now()) - timezone.timedelta(days=days)
+    # An open item (Smart Queue) or an outstanding balance (aging report, kanban
+    # ?with_debt=, dashboard) keeps its order in the operational tables
+    return Order.objects.filter(global_status='CLOSED', updated_at__lt=cutoff, balance_due__lte=0).exclude(
+        items__urgency__gt=ServiceItem.URGENCY_CLOSED)
+
+
+def _archive(order):
+    rows = model_serializers.serialize('python', [
+        order, *order.items.all(), *order.payments.all(), *order.activity_logs.all()])
+    for row in rows:
+        # DjangoJSONEncoder would round the timestamps to milliseconds
+        row['fields'] = {name: value.isoformat() if isinstance(value, (date, datetime)) else value
+                         for name, value in row['fields'].items()}
+    return ArchivedOrder(
+        id=order.pk,
+        order_friendly_id=order.order_friendly_id,
+        client_id=order.client_id,
+        currency=order.currency,
+        total_amount=order.total_amount,
+        total_paid=order.total_paid,
+        created_at=order.created_at,
+        closed_at=order.updated_at,
+        rows=rows,
+        detail=OrderDetailSerializer(order).data,
+        portal=OrderSerializer(order).data,
+    )
+
+
+def archive_orders(days=None, batch_size=None, now=None):
+    """Move the archivable orders to the archive, one transaction per batch; returns how many"""
+    batch_size = batch_size or settings.ARCHIVE_BATCH_SIZE
+    archived = 0
+    while True:
+        with transaction.atomic():
+            pks = list(archivable(now, days).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                return archived
+            orders = list(order_detail_queryset(Order.objects.filter(pk__in=pks)).select_for_update(of=('self',)))
+            item_pks = [item.pk for order in orders for item in order.items.all()]
+            ArchivedOrder.objects.bulk_create([_archive(order) for order in orders])
+            # Cascades to the items, payments and activity log
+            Order.objects.filter(pk__in=[order.pk for order in orders]).delete()
+            fragments.bump(Order, *pks)
+            fragments.bump(ServiceItem, *item_pks)
+        archived += len(orders)
+
+
+def restore_orders(pks):
+    """Move these archived orders back to the operational tables; returns the ids restored"""
+    with transaction.atomic():
+        archives = list(ArchivedOrder.objects.select_for_update().filter(pk__in=pks))
+        rows = [row for archived in archives for row in archived.rows]
+        users = set(User.objects.filter(pk__in={
+            row['fields'][name] for row in rows for name in _USER_FIELDS.get(row['model'], ())
+        } - {None}).values_list('pk', flat=True))
+        for row in rows:
+            for name in _USER_FIELDS.get(row['model'], ()):
+                if row['fields'][name] not in users:
+                    row['fields'][name] = None
+        # raw saves: ids, timestamps, versions and totals exactly as archived
+        for obj in model_serializers.deserialize('python', rows):
+            obj.save()
+        restored = [archived.pk for archived in archives]
+        # Columns added since the order was archived take their defaults: recompute. A restored
+        # order starts a new retention period, or the next archive_orders would take it again
+        Order.objects.filter(pk__in=restored).update(balance_due=F('total_amount') - F('total_paid'),
+                                                     updated_at=timezone.now())
+        ArchivedOrder.objects.filter(pk__in=restored).delete()
+        fragments.bump(Order, *restored)
+    return restored
+
+
+def archived_details(pks, now=None):
+    """{pk: detail} of the archived orders among pks, as OrderDetailView returned them"""
+    now = now or timezone.now()
+    details = dict(ArchivedOrder.objects.filter(pk__in=pks).values_list('pk', 'detail'))
+    for detail in details.values():
+        refresh_order(detail, now)
+    return details
+
+
+def archived_portal_orders(client_email, now=None):
+    """The client's archived orders, as OrderListView returned them"""
+    now = now or timezone.now()
+    orders = list(ArchivedOrder.objects.filter(client__email=client_email).order_by('pk')
+                  .values_list('portal', flat=True))
+    for order in orders:
+        refresh_order(order, now)
+    return orders
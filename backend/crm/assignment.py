@@ -0,0 +1,215 @@
+"""
+Workload-balancing assignment of service items to tramitadores.
+
+A tramitador's workload is the estimated effort of their open items
+(ASSIGNMENT_EFFORT, by legalization type). Candidate items are handed out
+one at a time to the least loaded tramitador, popped from a heap keyed on
+(workload, open items, id): express and near-deadline items first, so they
+land with whoever can start them soonest, then the rest heaviest first
+(longest-processing-time order keeps the final workloads close).
+
+Planning reads the per-tramitador aggregates and the candidates only, so an
+incremental run over new items costs O(n log t) whatever the size of the
+backlog already assigned. plan_assignments() computes a plan without
+writing; apply_plan() applies it in one transaction.
+"""
+import hashlib
+import heapq
+from collections import defaultdict
+from functools import cached_property
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from . import fragments
+from .models import ActivityLog, Order, ServiceItem
+
+# Relative effort of a legalization, by legalization_type (others: 1.0).
+# Override or extend with the ASSIGNMENT_EFFORT setting.
+DEFAULT_EFFORT = {
+    'MINJUS_CONSULADO': 3.0,
+    'CONSULADO': 2.0,
+    'MINJUS': 1.5,
+}
+
+# Items nobody has started on yet, the only assigned ones a rebalance moves
+UNSTARTED_STATUS = 'INIT'
+
+MODES = ('unassigned', 'rebalance')
+
+
+def effort_weights():
+    return {**DEFAULT_EFFORT, **getattr(settings, 'ASSIGNMENT_EFFORT', {})}
+
+
+def tramitador_ids():
+    """Active members of the TRAMITADOR_GROUP group"""
+    group = getattr(settings, 'TRAMITADOR_GROUP', 'Tramitadores')
+    return list(User.objects.filter(groups__name=group, is_active=True).order_by('pk').values_list('pk', flat=True))
+
+
+class Assignment:
+    __slots__ = ('item', 'order', 'titular_name', 'previous', 'tramitador', 'effort', 'boosted')
+
+    def __init__(self, item, order, titular_name, previous, tramitador, effort, boosted):
+        self.item = item
+        self.order = order
+        self.titular_name = titular_name
+        self.previous = previous
+        self.tramitador = tramitador
+        self.effort = effort
+        self.boosted = boosted
+
+
+class AssignmentPlan:
+    def __init__(self, mode, assignments, before, after):
+        self.mode = mode
+        self.assignments = assignments
+        # {tramitador id: [workload, open items]}
+        self.before = before
+        self.after = after
+
+    @cached_property
+    def plan_id(self):
+        """Identifies the exact set of moves, to commit what was previewed"""
+        moves = sorted((a.item, a.previous or 0, a.tramitador) for a in self.assignments)
+        return hashlib.sha1(repr(moves).encode()).hexdigest()[:16]
+
+    def as_dict(self):
+        usernames = dict(User.objects.filter(pk__in=self.after).values_list('pk', 'username'))
+        return {
+            'plan_id': self.plan_id,
+            'mode': self.mode,
+            'assignments': [
+                {
+                    'item': a.item,
+                    'order': a.order,
+                    'titular_name': a.titular_name,
+                    'from': a.previous,
+                    'to': a.tramitador,
+                    'to_name': usernames.get(a.tramitador),
+                    'effort': a.effort,
+                    'boosted': a.boosted,
+                }
+                for a in self.assignments
+            ],
+            'workload': [
+                {
+                    'tramitador': pk,
+                    'username': usernames.get(pk),
+                    'before': round(self.before[pk][0], 2),
+                    'after': round(after[0], 2),
+                    'items_before': self.before[pk][1],
+                    'items_after': after[1],
+                }
+                for pk, after in sorted(self.after.items())
+            ],
+        }
+
+
+def plan_assignments(tramitadores=None, mode='unassigned', now=None, limit=None):
+    """
+    Assign the open unassigned items ('unassigned'), or also redistribute
+    the unstarted assigned ones ('rebalance'), across `tramitadores`
+    (default: tramitador_ids()).
+    """
+    now = now or timezone.now()
+    pool = list(tramitadores) if tramitadores is not None else tramitador_ids()
+    weights = effort_weights()
+    near_deadline = now + timezone.timedelta(hours=getattr(settings, 'ASSIGNMENT_NEAR_DEADLINE_HOURS', 48))
+
+    open_items = ServiceItem.objects.filter(urgency__gt=ServiceItem.URGENCY_CLOSED)
+    movable = Q(assigned_tramitador__isnull=True)
+    if mode == 'rebalance':
+        movable |= Q(status=UNSTARTED_STATUS)
+
+    def workload(queryset):
+        loads = {pk: [0.0, 0] for pk in pool}
+        rows = (queryset.filter(assigned_tramitador_id__in=pool)
+                .values_list('assigned_tramitador_id', 'legalization_type').annotate(n=Count('id')).order_by())
+        for tramitador, legalization_type, n in rows:
+            loads[tramitador][0] += weights.get(legalization_type, 1.0) * n
+            loads[tramitador][1] += n
+        return loads
+
+    before = workload(open_items)
+    fixed = workload(open_items.exclude(movable)) if mode == 'rebalance' else {pk: list(v) for pk, v in before.items()}
+
+    candidates = open_items.filter(movable).order_by('deadline', 'id').values_list(
+        'id', 'order_id', 'titular_name', 'assigned_tramitador_id', 'legalization_type', 'priority', 'deadline')
+    if limit:
+        candidates = candidates[:limit]
+
+    queue = []
+    for pk, order, titular_name, previous, legalization_type, priority, deadline in candidates:
+        effort = weights.get(legalization_type, 1.0)
+        boosted = priority == 'EXPRESS' or (deadline is not None and deadline <= near_deadline)
+        # Boosted by deadline (rows come sorted by it), the rest heaviest first
+        queue.append(((0, 0.0) if boosted else (1, -effort), (pk, order, titular_name, previous, effort, boosted)))
+    queue.sort(key=lambda entry: entry[0])
+
+    assignments = []
+    if pool:
+        loads = fixed
+        heap = [(load, n, pk) for pk, (load, n) in loads.items()]
+        heapq.heapify(heap)
+        for _, (pk, order, titular_name, previous, effort, boosted) in queue:
+            # Entries superseded by a later push are skipped (lazy deletion)
+            while tuple(loads[heap[0][2]]) != heap[0][:2]:
+                heapq.heappop(heap)
+            tramitador = heap[0][2]
+            # Assigned items stay put unless their tramitador is ahead of the
+            # least loaded one by at least the item's effort (no churn)
+            if previous in loads and loads[previous][0] < loads[tramitador][0] + effort:
+                tramitador = previous
+            loads[tramitador] = [loads[tramitador][0] + effort, loads[tramitador][1] + 1]
+            heapq.heappush(heap, (*loads[tramitador], tramitador))
+            if tramitador != previous:
+                assignments.append(Assignment(pk, order, titular_name, previous, tramitador, effort, boosted))
+        fixed = loads
+    return AssignmentPlan(mode, assignments, before, fixed)
+
+
+def apply_plan(plan, user=None, batch_size=500):
+    """
+    Apply the plan in one transaction; items whose assignment changed since
+    it was computed (or that were closed) are skipped. Returns the number
+    of items reassigned.
+    """
+    by_move = defaultdict(list)
+    for assignment in plan.assignments:
+        by_move[assignment.previous, assignment.tramitador].append(assignment)
+    usernames = dict(User.objects.filter(pk__in={a.tramitador for a in plan.assignments})
+                     .values_list('pk', 'username'))
+
+    now = timezone.now()
+    applied = []
+    with transaction.atomic():
+        for (previous, tramitador), assignments in by_move.items():
+            for start in range(0, len(assignments), batch_size):
+                batch = {a.item: a for a in assignments[start:start + batch_size]}
+                unchanged = ServiceItem.objects.filter(
+                    pk__in=batch, assigned_tramitador_id=previous, urgency__gt=ServiceItem.URGENCY_CLOSED)
+                pks = list(unchanged.select_for_update().values_list('pk', flat=True))
+                ServiceItem.objects.filter(pk__in=pks).update(
+                    assigned_tramitador_id=tramitador, updated_at=now, version=F('version') + 1)
+                applied += [batch[pk] for pk in pks]
+
+        ActivityLog.objects.bulk_create([
+            ActivityLog(
+                order_id=a.order,
+                user=user,
+                action_type='ASSIGNMENT',
+                description=f"Servicio '{a.titular_name}' asignado a {usernames.get(a.tramitador)} (automático)",
+                metadata={'item': a.item, 'from': a.previous, 'to': a.tramitador, 'plan_id': plan.plan_id},
+            )
+            for a in applied
+        ], batch_size=batch_size)
+
+        # update() and bulk_create() bypass the save() bumps
+        fragments.bump(ServiceItem, *[a.item for a in applied])
+        fragments.bump(Order, *{a.order for a in applied})
+    return len(applied)
@@ -0,0 +1,221 @@
+"""
+Transactional batches of desk operations.
+
+    POST /api/batch/
+    {"operations": [
+        {"ref": "cart", "op": "order.create", "data": {"client": 4, "items": [...]}},
+        {"op": "payment.create", "data": {"order": "$cart", "amount": "50.00", "method": "CASH"}},
+        {"op": "order.update", "target": "$cart",
+         "data": {"assigned_to": 7, "global_status": "IN_PROCESS_PARTIAL"}},
+        {"op": "item.update", "target": "$cart.items.0", "data": {"status": "RECEIVED"}}
+    ]}
+
+The operations run in order in one transaction: all of them apply or none
+does, and the error names the operation that failed. An operation with a
+`ref` can be referred to by the later ones as "$ref" (the id it created or
+changed) or "$ref.<key>..." (any value of its result, e.g. "$cart.items.0"
+for the first item of the cart).
+
+Side effects are coalesced: the order recalculations triggered by item and
+payment writes are deferred (crm.models.deferred_totals), so every order
+touched is recalculated once at the end of the batch, and the activity log
+entries are inserted in one query. Until then, operations see the totals
+and payment status from before the batch.
+"""
+import re
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework import status
+
+from . import fragments
+from .models import ActivityLog, Order, ServiceItem, deferred_totals
+from .projections import decimal_string
+from .serializers import OrderDetailSerializer, OrderSerializer, PaymentSerializer, ServiceItemSerializer
+
+REFERENCE = re.compile(r'^\$([A-Za-z_][\w-]*)((?:\.[\w-]+)*)$')
+
+# Fields each update operation may change
+ORDER_MUTABLE = ('global_status', 'assigned_to', 'notes')
+ITEM_MUTABLE = ('status', 'current_location', 'assigned_tramitador', 'phase_dates', 'notes',
+                'responsible', 'logistics_status')
+
+SUMMARY_FIELDS = ('id', 'version', 'global_status', 'payment_status', 'total_amount', 'total_paid')
+
+
+class BatchError(Exception):
+    def __init__(self, message, status_code=status.HTTP_400_BAD_REQUEST, details=None, index=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.details = details
+        self.index = index
+
+    def as_dict(self):
+        data = {'error': str(self), 'index': self.index}
+        if self.details is not None:
+            data['details'] = self.details
+        return data
+
+
+def _resolve(value, results):
+    """`value` with every "$ref..." string replaced by the value it refers to"""
+    if isinstance(value, dict):
+        return {name: _resolve(item, results) for name, item in value.items()}
+    if isinstance(value, list):
+        return [_resolve(item, results) for item in value]
+    match = REFERENCE.match(value) if isinstance(value, str) else None
+    if match is None:
+        return value
+    if match.group(1) not in results:
+        raise BatchError(f'Unknown reference: {value}')
+    resolved = results[match.group(1)]
+    path = match.group(2)[1:].split('.') if match.group(2) else ['id']
+    for key in path:
+        if isinstance(resolved, list) and key.isdigit() and int(key) < len(resolved):
+            resolved = resolved[int(key)]
+        elif isinstance(resolved, dict) and key in resolved:
+            resolved = resolved[key]
+        else:
+            raise BatchError(f'Unknown reference: {value}')
+    return resolved
+
+
+def _check_fields(data, allowed):
+    if not isinstance(data, dict) or not data or set(data) - set(allowed):
+        raise BatchError(f"data may only change: {', '.join(allowed)}")
+
+
+def _validated(serializer):
+    if not serializer.is_valid():
+        raise BatchError('Invalid data', details=serializer.errors)
+    return serializer
+
+
+def _get(model, pk, lock=False):
+    queryset = model.objects.select_for_update() if lock else model.objects.all()
+    obj = queryset.filter(pk=pk).first() if isinstance(pk, int) else None
+    if obj is None:
+        raise BatchError(f'{model.__name__} not found', status.HTTP_404_NOT_FOUND)
+    return obj
+
+
+class _Batch:
+    def __init__(self, user):
+        self.user = user
+        self.logs = []
+        self.orders = set()
+
+    def log(self, order_id, action_type, description, **metadata):
+        self.orders.add(order_id)
+        self.logs.append(ActivityLog(order_id=order_id, user=self.user, action_type=action_type,
+                                     description=description, metadata={'batch': True, **metadata}))
+
+    def order_create(self, target, data):
+        order = _validated(OrderSerializer(data=data)).save()
+        items = list(order.items.order_by('pk').values_list('pk', flat=True))
+        self.log(order.pk, 'SERVICE_ADDED', f"Orden creada con {len(items)} servicios")
+        return {'id': order.pk, 'order_friendly_id': order.order_friendly_id, 'items': items}
+
+    def order_update(self, target, data):
+        _check_fields(data, ORDER_MUTABLE)
+        order = _get(Order, target, lock=True)
+        old_status = order.get_global_status_display()
+        serializer = _validated(OrderDetailSerializer(order, data=data, partial=True))
+        changes = []
+        if serializer.validated_data.get('global_status', order.global_status) != order.global_status:
+            changes.append(f"Estado cambiado de '{old_status}' a "
+                           f"'{dict(Order.GLOBAL_STATUS_CHOICES)[serializer.validated_data['global_status']]}'")
+        if 'assigned_to' in data:
+            changes.append("Asignado a gestor")
+        order = serializer.save()
+        if changes:
+            self.log(order.pk, 'STATUS_CHANGE', '; '.join(changes))
+        self.orders.add(order.pk)
+        return {'id': order.pk, 'version': order.version}
+
+    def order_note(self, target, data):
+        text = data.get('text') if isinstance(data, dict) else None
+        if not isinstance(text, str) or not text.strip():
+            raise BatchError('data.text is required')
+        order = _get(Order, target)
+        self.log(order.pk, 'NOTE', text.strip())
+        return {'id': order.pk}
+
+    def item_create(self, target, data):
+        if not isinstance(data, dict):
+            raise BatchError('data must be an object')
+        order = _get(Order, data.get('order'))
+        item = _validated(ServiceItemSerializer(data=data)).save(order=order)
+        self.log(order.pk, 'SERVICE_ADDED', f"Servicio añadido: {item.get_service_type_display()}")
+        return {'id': item.pk}
+
+    def item_update(self, target, data):
+        _check_fields(data, ITEM_MUTABLE)
+        item = _get(ServiceItem, target, lock=True)
+        old_status = item.get_status_display()
+        item = _validated(ServiceItemSerializer(item, data=data, partial=True)).save()
+        if 'status' in data:
+            self.log(item.order_id, 'STATUS_CHANGE',
+                     f"Servicio '{item.titular_name}': {old_status} → {item.get_status_display()}")
+        self.orders.add(item.order_id)
+        return {'id': item.pk, 'version': item.version}
+
+    def payment_create(self, target, data):
+        payment = _validated(PaymentSerializer(data=data)).save()
+        self.log(payment.order_id, 'PAYMENT', f"Pago registrado: {payment.amount} {payment.currency}",
+                 payment_id=payment.pk, method=payment.method)
+        return {'id': payment.pk}
+
+
+OPERATIONS = {
+    'order.create': _Batch.order_create,
+    'order.update': _Batch.order_update,
+    'order.note': _Batch.order_note,
+    'item.create': _Batch.item_create,
+    'item.update': _Batch.item_update,
+    'payment.create': _Batch.payment_create,
+}
+
+
+def execute(operations, user=None):
+    """
+    Run the operations in one transaction; returns
+    {"results": [one per operation], "orders": [the orders touched, after the batch]}.
+    Raises BatchError (with the index of the failed operation) after rolling everything back.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise BatchError('operations must be a non-empty list')
+    if len(operations) > settings.BATCH_MAX_OPERATIONS:
+        raise BatchError(f'Batches are limited to {settings.BATCH_MAX_OPERATIONS} operations')
+
+    batch = _Batch(user)
+    refs, results = {}, []
+    with transaction.atomic(), deferred_totals():
+        for index, operation in enumerate(operations):
+            try:
+                if not isinstance(operation, dict) or operation.get('op') not in OPERATIONS:
+                    raise BatchError(f"Unknown operation: {operation.get('op') if isinstance(operation, dict) else ''}")
+                ref = operation.get('ref')
+                if ref is not None and (not isinstance(ref, str) or not REFERENCE.match(f'${ref}') or ref in refs):
+                    raise BatchError(f'Invalid or repeated ref: {ref}')
+                result = OPERATIONS[operation['op']](
+                    batch, _resolve(operation.get('target'), refs), _resolve(operation.get('data') or {}, refs))
+            except BatchError as exc:
+                exc.index = index
+                raise
+            if ref is not None:
+                refs[ref] = result
+            results.append({'op': operation['op'], **({'ref': ref} if ref else {}), **result})
+        ActivityLog.objects.bulk_create(batch.logs)
+        # bulk_create skips ActivityLog.save, which bumps the order fragments
+        fragments.bump(Order, *{log.order_id for log in batch.logs})
+
+    orders = Order.objects.filter(pk__in=batch.orders).order_by('pk').values_list(*SUMMARY_FIELDS)
+    return {
+        'results': results,
+        'orders': [
+            {name: decimal_string(value) if name.startswith('total_') else value
+             for name, value in zip(SUMMARY_FIELDS, row)}
+            for row in orders
+        ],
+    }
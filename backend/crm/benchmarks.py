@@ -0,0 +1,319 @@
+"""
+Query-budget benchmark for the crm API.
+
+Seeds increasing numbers of orders and calls every route in crm/urls.py,
+measuring query count, wall time and peak Python memory per request. An
+endpoint fails when it exceeds its query budget or when its query count
+grows with the number of orders (an N+1 pattern).
+"""
+import os
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test.utils import (
+    CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment,
+)
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from . import analytics, files, urls as crm_urls
+from .datagen import DatasetGenerator
+from .models import Order, Payment, ServiceItem, Upload
+from .slow_queries import is_transaction_statement
+
+DEFAULT_SIZES = (10, 1000, 50000)
+
+# Maximum number of SQL queries per request (cold fragment cache), independent of dataset size.
+# Writes to orders in another currency than FX_BASE_CURRENCY also load the exchange rates once (crm.fx)
+QUERY_BUDGETS = {
+    'api-root': 0,
+    'create-order': 13,
+    'order-list': 4,
+    'order-kanban': 3,
+    'order-detail': 5,
+    'order-multi': 5,
+    'add-service': 6,
+    'register-payment': 7,
+    'request-payment': 4,
+    'generate-invoice': 5,
+    'activity-log': 2,
+    'batch': 17,
+    'payment-proof': 1,
+    'upload-create': 2,
+    'upload-detail': 1,
+    'upload-complete': 6,
+    'dashboard-stats': 4,
+    'aging-report': 1,
+    'analytics': 0,
+    'smart-queue': 2,
+    'auto-assign': 4,
+    'sync': 5,
+    'service-item-list': 2,
+    'service-item-detail': 2,
+    'service-item-multi': 2,
+    'service-item-update-status': 7,
+    'service-item-upload-final': 3,
+    'service-item-final-document': 1,
+}
+
+
+@contextmanager
+def throwaway_database():
+    """Run the block against a freshly created test database, never the working one"""
+    setup_test_environment(debug=False)
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def route_names():
+    """Names of every route declared in crm/urls.py (format suffixes collapsed)"""
+    names = []
+    for pattern in crm_urls.urlpatterns:
+        if pattern.name and pattern.name not in names:
+            names.append(pattern.name)
+    return names
+
+
+def build_scenarios():
+    """
+    One request per route: (method, url, data, format). Uses the oldest
+    order so every dataset size exercises the same object.
+    """
+    order = Order.objects.filter(items__isnull=False).order_by('pk').first()
+    item = order.items.order_by('pk').first()
+    client_id = order.client_id
+    payment = Payment.objects.order_by('pk').first()
+    # A location with open items, so the sync pull has a scope
+    location = (ServiceItem.objects.filter(urgency__gt=ServiceItem.URGENCY_CLOSED).order_by('pk')
+                .values_list('current_location', flat=True).first())
+
+    # A stored document to download and an upload with every byte received
+    content = b'%PDF-1.4 bench'
+    path, digest, _ = files.store_uploaded_file(SimpleUploadedFile('bench.pdf', content),
+                                                   files.upload_to('FINAL_DOCUMENT'))
+    ServiceItem.objects.filter(pk=item.pk).update(final_document=path)
+    Payment.objects.filter(pk=payment.pk).update(proof_file=path)
+    upload = Upload.objects.create(target='FINAL_DOCUMENT', object_id=item.pk, filename='bench.pdf',
+                                   size=len(content), sha256=digest, received=len(content))
+    os.makedirs(files.partial_dir(), exist_ok=True)
+    with open(files.partial_path(upload), 'wb') as partial:
+        partial.write(content)
+    # The same ten oldest orders and items at every size
+    multi_orders = list(Order.objects.order_by('pk').values_list('pk', flat=True)[:10])
+    multi_items = list(ServiceItem.objects.order_by('pk').values_list('pk', flat=True)[:10])
+    # The analytics endpoint reads the columnar snapshot, not the database
+    analytics.take_snapshot()
+    new_item = {'service_type': 'LEGALIZATION', 'titular_name': 'Bench', 'cost': '10.00', 'price': '25.00'}
+
+    return {
+        'api-root': ('get', reverse('api-root'), None, None),
+        'create-order': ('post', reverse('create-order'),
+                         {'client': client_id, 'currency': 'EUR', 'items': [new_item, new_item]}, 'json'),
+        'order-list': ('get', reverse('order-list'), None, None),
+        'order-kanban': ('get', reverse('order-kanban'), None, None),
+        'order-detail': ('get', reverse('order-detail', args=[order.pk]), None, None),
+        'order-multi': ('get', f"{reverse('order-multi')}?ids={','.join(map(str, multi_orders))}", None, None),
+        'add-service': ('post', reverse('add-service', args=[order.pk]), new_item, 'json'),
+        'register-payment': ('post', reverse('register-payment', args=[order.pk]),
+                             {'amount': '10.00', 'currency': 'EUR', 'method': 'CASH'}, 'json'),
+        'request-payment': ('post', reverse('request-payment', args=[order.pk]), None, None),
+        'generate-invoice': ('get', reverse('generate-invoice', args=[order.pk]), None, None),
+        'activity-log': ('get', reverse('activity-log', args=[order.pk]), None, None),
+        'batch': ('post', reverse('batch'), {'operations': [
+            {'ref': 'cart', 'op': 'order.create',
+             'data': {'client': client_id, 'currency': 'EUR', 'items': [new_item, new_item]}},
+            {'op': 'payment.create', 'data': {'order': '$cart', 'amount': '10.00', 'method': 'CASH'}},
+            {'op': 'order.update', 'target': '$cart', 'data': {'global_status': 'IN_PROCESS_PARTIAL'}},
+            {'op': 'item.update', 'target': '$cart.items.0', 'data': {'status': 'RECEIVED'}},
+        ]}, 'json'),
+        'payment-proof': ('get', reverse('payment-proof', args=[payment.pk]), None, None),
+        'upload-create': ('post', reverse('upload-create'),
+                          {'target': 'FINAL_DOCUMENT', 'object_id': item.pk, 'filename': 'doc.pdf', 'size': 1000},
+                          'json'),
+        'upload-detail': ('get', reverse('upload-detail', args=[upload.pk]), None, None),
+        # Moves the received file: only the first of the two calls completes
+        'upload-complete': ('post', reverse('upload-complete', args=[upload.pk]), None, None),
+        'dashboard-stats': ('get', reverse('dashboard-stats'), None, None),
+        'aging-report': ('get', reverse('aging-report'), None, None),
+        'analytics': ('get', f"{reverse('analytics')}?group_by=tramitador&columns=month&measure=margin", None, None),
+        'smart-queue': ('get', reverse('smart-queue'), None, None),
+        'auto-assign': ('post', reverse('auto-assign'), {'limit': 500}, 'json'),
+        'sync': ('get', f"{reverse('sync')}?location={location}", None, None),
+        'service-item-list': ('get', reverse('service-item-list'), None, None),
+        'service-item-detail': ('get', reverse('service-item-detail', args=[item.pk]), None, None),
+        'service-item-multi': ('get', f"{reverse('service-item-multi')}?ids={','.join(map(str, multi_items))}",
+                               None, None),
+        'service-item-update-status': ('patch', reverse('service-item-update-status', args=[item.pk]),
+                                       {'status': 'MINJUS_IN', 'version': item.version}, 'json'),
+        'service-item-upload-final': ('post', reverse('service-item-upload-final', args=[item.pk]),
+                                      {'final_document': SimpleUploadedFile('doc.pdf', b'%PDF-1.4 bench')},
+                                      'multipart'),
+        'service-item-final-document': ('get', reverse('service-item-final-document', args=[item.pk]), None, None),
+    }
+
+
+def bench_settings():
+    """
+    Scratch MEDIA_ROOT and analytics snapshots, and a private cache emptied
+    before every request: budgets hold for a cold cache
+    """
+    private_cache = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                 'LOCATION': 'crm-bench', 'OPTIONS': {'MAX_ENTRIES': 10 ** 6}}}
+    return override_settings(MEDIA_ROOT=tempfile.mkdtemp(prefix='crm-bench-'), CACHES=private_cache,
+                             ANALYTICS_SNAPSHOT_DIR=tempfile.mkdtemp(prefix='crm-bench-analytics-'))
+
+
+def call(api, method, url, data, fmt):
+    if isinstance(data, dict):
+        for value in data.values():
+            if hasattr(value, 'seek'):
+                value.seek(0)
+    kwargs = {'format': fmt} if fmt else {}
+    return getattr(api, method)(url, data, **kwargs)
+
+
+def measure(api, method, url, data, fmt):
+    """Run one request (rolled back) and return its metrics"""
+    with transaction.atomic():
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            response = call(api, method, url, data, fmt)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+        transaction.set_rollback(True)
+    # The next request resets connection.queries, keep the captured SQL now
+    queries = [q['sql'] for q in ctx.captured_queries if not is_transaction_statement(q['sql'])]
+
+    with transaction.atomic():
+        tracemalloc.start()
+        try:
+            call(api, method, url, data, fmt)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        transaction.set_rollback(True)
+
+    return {
+        'status': response.status_code,
+        'queries': len(queries),
+        'wall_ms': round(elapsed_ms, 2),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def run_benchmark(sizes=DEFAULT_SIZES, budgets=None, routes=None, seed=0, log=None):
+    """
+    Seed each size in ascending order and measure every route.
+    Returns {'sizes': [...], 'results': {route: {size: metrics}}, 'failures': [...]}.
+    """
+    budgets = QUERY_BUDGETS if budgets is None else budgets
+    generator = DatasetGenerator(seed=seed)
+    api = APIClient()
+    results = {}
+    seeded = Order.objects.count()
+
+    with bench_settings():
+        for size in sorted(sizes):
+            if size > seeded:
+                generator.generate(size - seeded)
+                seeded = size
+            scenarios = build_scenarios()
+            for name in routes or route_names():
+                if name not in scenarios:
+                    results.setdefault(name, {})[size] = {'error': 'no scenario defined'}
+                    continue
+                cache.clear()
+                metrics = measure(api, *scenarios[name])
+                results.setdefault(name, {})[size] = metrics
+                if log:
+                    log(f"{name:<28} N={size:<7} {metrics['queries']:>4} queries "
+                        f"{metrics['wall_ms']:>9.1f} ms {metrics['peak_kb']:>9.1f} KiB  [{metrics['status']}]")
+
+    return {
+        'sizes': sorted(sizes),
+        'results': results,
+        'failures': check_results(results, budgets),
+    }
+
+
+def check_results(results, budgets):
+    failures = []
+    for name, per_size in results.items():
+        sizes = sorted(per_size)
+        for size in sizes:
+            metrics = per_size[size]
+            if 'error' in metrics:
+                failures.append(f"{name}: {metrics['error']}")
+                break
+            if metrics['status'] >= 400:
+                failures.append(f"{name}: HTTP {metrics['status']} at N={size}")
+            budget = budgets.get(name)
+            if budget is not None and metrics['queries'] > budget:
+                failures.append(f"{name}: {metrics['queries']} queries at N={size} exceeds budget of {budget}")
+        else:
+            smallest, largest = per_size[sizes[0]], per_size[sizes[-1]]
+            if len(sizes) > 1 and largest['queries'] > smallest['queries']:
+                failures.append(
+                    f"{name}: query count grows with N ({smallest['queries']} at N={sizes[0]}, "
+                    f"{largest['queries']} at N={sizes[-1]}) - N+1 pattern"
+                )
+    return failures
+
+
+def renderer_candidates():
+    """(name, renderer, media type) for every payload encoding available here"""
+    from rest_framework.renderers import JSONRenderer
+
+    from . import renderers
+
+    candidates = [
+        ('drf-json', JSONRenderer(), 'application/json'),
+        ('orjson', renderers.ORJSONRenderer(), 'application/json'),
+    ]
+    if renderers.msgpack is not None:
+        candidates.append(('msgpack', renderers.MessagePackRenderer(), 'application/msgpack'))
+    return candidates
+
+
+def compare_renderers(data, repeat=20):
+    """
+    Encode `data` with every renderer and measure encoding time and the wire
+    size raw, gzipped and brotli-compressed (with the middleware's settings).
+    """
+    import gzip
+
+    from django.conf import settings
+
+    from .middleware import brotli
+
+    rows = {}
+    for name, renderer, media_type in renderer_candidates():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            body = renderer.render(data, media_type, {})
+        encode_ms = (time.perf_counter() - start) * 1000 / repeat
+
+        start = time.perf_counter()
+        gzipped = gzip.compress(body, compresslevel=settings.RESPONSE_COMPRESSION_GZIP_LEVEL, mtime=0)
+        row = {
+            'encode_ms': round(encode_ms, 2),
+            'raw_kb': round(len(body) / 1024, 1),
+            'gzip_kb': round(len(gzipped) / 1024, 1),
+            'gzip_ms': round((time.perf_counter() - start) * 1000, 2),
+        }
+        if brotli is not None:
+            start = time.perf_counter()
+            compressed = brotli.compress(body, quality=settings.RESPONSE_COMPRESSION_BROTLI_QUALITY)
+            row['br_kb'] = round(len(compressed) / 1024, 1)
+            row['br_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        rows[name] = row
+    return rows
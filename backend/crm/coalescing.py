@@ -0,0 +1,170 @@
+"""
+Single-flight coalescing of identical concurrent GET requests.
+
+Many gestores poll the kanban and the smart queue with the same filters
+at the same moment. For views decorated with @coalesce_get, requests with
+the same normalized query string and scope share one computation:
+
+- inside a process, followers wait for the leader's in-flight computation
+  (threaded workers, runserver);
+- across processes, the leader holds a lock in the Django cache and the
+  result is published there for COALESCE_WINDOW_SECONDS, so every request
+  arriving within that window reuses it (all workers and nodes with a
+  shared cache backend, each worker on its own with the local one).
+
+The key includes the fragment cache generation (crm.fragments), which every
+write bumps, so a shared result never outlives a change to the data; the
+window only bounds how long an unchanged result is reused. Only successful
+responses are shared.
+"""
+import hashlib
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+
+from .fragments import current_generation
+
+# Query parameters that never change the result (cache busters)
+IGNORED_PARAMS = ('_',)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.shareable = False
+        self.error = None
+
+
+class SingleFlight:
+    """
+    SingleFlight().do(key, compute) -> compute() or the result of an
+    identical computation already in flight or finished within the window.
+    `compute` returns (shareable, result); unshareable results (errors)
+    are only returned to the caller that computed them.
+    """
+
+    def __init__(self, window=None, wait=None, alias='default'):
+        self._window = window
+        self._wait = wait
+        self.alias = alias
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    @property
+    def window(self):
+        return self._window if self._window is not None else getattr(settings, 'COALESCE_WINDOW_SECONDS', 1.0)
+
+    @property
+    def wait(self):
+        return self._wait if self._wait is not None else getattr(settings, 'COALESCE_WAIT_SECONDS', 10.0)
+
+    def do(self, key, compute):
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        result_key, lock_key = f'crm:sf:{digest}', f'crm:sf-lock:{digest}'
+        cache = caches[self.alias]
+
+        found = cache.get(result_key) if self.window > 0 else None
+        if found is not None:
+            return found
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if call.done.wait(self.wait):
+                if call.error is not None:
+                    raise call.error
+                if call.shareable:
+                    return call.result
+            return compute()[1]
+
+        try:
+            call.shareable, call.result = self._lead(cache, result_key, lock_key, compute)
+            return call.result
+        except Exception as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _lead(self, cache, result_key, lock_key, compute):
+        """Compute, unless another process is already doing it: then wait for its result"""
+        if self.window > 0 and not cache.add(lock_key, 1, timeout=self.wait):
+            deadline = time.monotonic() + self.wait
+            while time.monotonic() < deadline:
+                time.sleep(0.02)
+                found = cache.get(result_key)
+                if found is not None:
+                    return True, found
+                if cache.get(lock_key) is None:
+                    break  # the other leader failed or returned an error
+        try:
+            shareable, result = compute()
+            if shareable and self.window > 0:
+                cache.set(result_key, result, timeout=self.window)
+            return shareable, result
+        finally:
+            if self.window > 0:
+                cache.delete(lock_key)
+
+
+single_flight = SingleFlight()
+
+
+def request_scope(request, per_user_params=()):
+    """What the caller may see: authenticated or not, and who, when the query depends on it"""
+    if any(request.query_params.get(param) for param in per_user_params):
+        return f'user:{request.user.pk}'
+    return 'user' if request.user.is_authenticated else 'anonymous'
+
+
+def normalized_query(request):
+    """Sorted query string without empty values or cache busters"""
+    items = sorted(
+        (name, value)
+        for name, values in request.query_params.lists() if name not in IGNORED_PARAMS
+        for value in values if value != ''
+    )
+    return '&'.join(f'{name}={value}' for name, value in items)
+
+
+def coalesce_get(per_user_params=()):
+    """
+    Decorator for APIView.get: identical concurrent requests share one response.
+    `per_user_params` are query parameters that make the result depend on
+    request.user (e.g. assigned_to_me).
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            if not getattr(settings, 'COALESCE_ENABLED', True):
+                return method(view, request, *args, **kwargs)
+
+            key = '|'.join([
+                f'{type(view).__module__}.{type(view).__qualname__}',
+                repr(sorted(kwargs.items())),
+                request_scope(request, per_user_params),
+                normalized_query(request),
+                str(current_generation()),
+            ])
+
+            def compute():
+                response = method(view, request, *args, **kwargs)
+                headers = {name: value for name, value in response.items() if name != 'Content-Type'}
+                return response.status_code == 200, (response.status_code, response.data, headers)
+
+            status_code, data, headers = single_flight.do(key, compute)
+            # A fresh Response per request: rendering mutates it
+            return Response(data, status=status_code, headers=headers)
+        return wrapper
+    return decorator
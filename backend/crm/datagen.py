@@ -0,0 +1,372 @@
+"""
+Deterministic synthetic dataset generator.
+
+Produces production-like orders (status mix, legalization types,
+destinations, payments, activity logs, overdue deadlines) from a seed and
+writes them in chunks with bulk_create. Everything that save() normally
+derives (friendly id, margin, deadline, order totals, payment status,
+fragment cache versions) is computed here explicitly, so no per-row save
+or totals recomputation runs.
+"""
+import random
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.db import transaction
+from django.db.models import BigIntegerField, Max, Value
+from django.db.models.functions import Cast, Replace, Right
+from django.utils import timezone
+
+from . import fragments, fx
+from .models import Client, Order, ServiceItem, Payment, ActivityLog, ExchangeRate
+
+GLOBAL_STATUS_WEIGHTS = {
+    'NEW_REQUEST': 6,
+    'PENDING_PAYMENT': 9,
+    'IN_PROCESS_PARTIAL': 14,
+    'IN_PROCESS_PAID': 18,
+    'READY_DELIVERY': 8,
+    'CLOSED': 45,
+}
+LEGALIZATION_TYPE_WEIGHTS = {'MINJUS': 45, 'CONSULADO': 20, 'MINJUS_CONSULADO': 35}
+DESTINATION_WEIGHTS = {'INTERNACIONAL': 60, 'HABANA': 25, 'CAMAGUEY': 15}
+CURRENCY_WEIGHTS = {'EUR': 85, 'USD': 10, 'CUP': 5}
+ITEMS_PER_ORDER_WEIGHTS = {1: 50, 2: 28, 3: 12, 4: 6, 5: 3, 6: 1}
+DOCUMENT_TYPE_WEIGHTS = {
+    'ANTECEDENTES_PENALES': 30, 'NACIMIENTO': 25, 'MATRIMONIO': 12, 'DIVORCIO': 6,
+    'SOLTERIA': 6, 'DEFUNCION': 3, 'ESTADO_CONYUGAL': 4, 'PODER_NOTARIAL': 4,
+    'TITULO_ACADEMICO': 4, 'PLAN_ESTUDIOS': 2, 'NOTAS': 2, 'OTRO': 2,
+}
+# Units of EUR per unit, from before the oldest order on
+FX_RATES = {'USD': Decimal('0.92'), 'CUP': Decimal('0.0077')}
+# Base internal cost per legalization type (EUR)
+BASE_COST = {'MINJUS': 35, 'CONSULADO': 45, 'MINJUS_CONSULADO': 70}
+EXPRESS_RATE = 0.15
+# Share of open items whose deadline has already passed
+OVERDUE_RATE = 0.12
+# Orders are spread over this many days, open ones over the most recent window
+HISTORY_DAYS = 3 * 365
+OPEN_WINDOW_DAYS = 60
+
+FIRST_NAMES = ['Juan', 'María', 'Pedro', 'Ana', 'Luis', 'Carmen', 'Roberto', 'Laura', 'Yoandri',
+               'Yanet', 'Osmany', 'Dayana', 'Alejandro', 'Lisandra', 'Ernesto', 'Yaima']
+LAST_NAMES = ['Pérez', 'González', 'Rodríguez', 'Martín', 'Fernández', 'Sánchez', 'Díaz', 'Torres',
+              'Hernández', 'García', 'López', 'Suárez', 'Castillo', 'Ramos', 'Morales', 'Cruz']
+RESPONSIBLES = [choice for choice, _ in ServiceItem.RESPONSIBLE_CHOICES]
+LOCATIONS = [choice for choice, _ in ServiceItem.LOCATION_CHOICES]
+OPEN_STATUSES = ['NEW_REQUEST', 'PENDING_PAYMENT', 'IN_PROCESS_PARTIAL', 'IN_PROCESS_PAID']
+TWO_PLACES = Decimal('0.01')
+
+
+@contextmanager
+def historical_timestamps(*models):
+    """
+    Let bulk_create keep explicit created_at/updated_at/payment_date/timestamp
+    values by disabling auto_now/auto_now_add for the duration of the block.
+    """
+    saved = []
+    for model in models:
+        for field in model._meta.concrete_fields:
+            if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+                saved.append((field, field.auto_now, field.auto_now_add))
+                field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def _weighted(weights):
+    return list(weights), list(weights.values())
+
+
+class DatasetGenerator:
+    """
+    generator = DatasetGenerator(seed=42)
+    generator.generate(orders=1_000_000, chunk_size=5000)
+    """
+
+    def __init__(self, seed=42, now=None, gestores=6, tramitadores=12, orders_per_client=4):
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self.now = now or timezone.now()
+        self.num_gestores = gestores
+        self.num_tramitadores = tramitadores
+        self.orders_per_client = orders_per_client
+        self.gestores = []
+        self.tramitadores = []
+        self.system_user = None
+        self._statuses = _weighted(GLOBAL_STATUS_WEIGHTS)
+        self._leg_types = _weighted(LEGALIZATION_TYPE_WEIGHTS)
+        self._destinations = _weighted(DESTINATION_WEIGHTS)
+        self._currencies = _weighted(CURRENCY_WEIGHTS)
+        self._items_per_order = _weighted(ITEMS_PER_ORDER_WEIGHTS)
+        self._doc_types = _weighted(DOCUMENT_TYPE_WEIGHTS)
+
+    def pick(self, weighted):
+        return self.rng.choices(weighted[0], weights=weighted[1])[0]
+
+    def ensure_users(self):
+        self.system_user, _ = User.objects.get_or_create(username='admin', defaults={'is_staff': True})
+        self.gestores = [
+            User.objects.get_or_create(username=f'gestor{i}')[0] for i in range(1, self.num_gestores + 1)
+        ]
+        self.tramitadores = [
+            User.objects.get_or_create(username=f'tramitador{i}')[0] for i in range(1, self.num_tramitadores + 1)
+        ]
+        group, _ = Group.objects.get_or_create(name=settings.TRAMITADOR_GROUP)
+        group.user_set.add(*self.tramitadores)
+
+    def ensure_rates(self):
+        effective = (self.now - timezone.timedelta(days=HISTORY_DAYS + 1)).date()
+        for currency, rate in FX_RATES.items():
+            if not ExchangeRate.objects.filter(currency=currency, effective_date__lte=effective).exists():
+                ExchangeRate.objects.create(currency=currency, effective_date=effective, rate=rate)
+
+    def next_index(self):
+        """
+        First index after those of the generated orders and clients already
+        stored (friendly id suffix, email), so a run after deletes can't
+        reuse one: row counts shrink, the largest index doesn't.
+        """
+        last_order = Order.objects.filter(order_friendly_id__regex=r'_[0-9]{8}_[0-9A-F]{6}$').aggregate(
+            last=Max(Right('order_friendly_id', 6)))['last']
+        prefix, domain = f'cliente{self.seed}.', '@dataset.example'
+        last_client = Client.objects.filter(email__startswith=prefix, email__endswith=domain).aggregate(
+            last=Max(Cast(Replace(Replace('email', Value(prefix), Value('')), Value(domain), Value('')),
+                          BigIntegerField())))['last']
+        return max(int(last_order, 16) + 1 if last_order else 0,
+                   last_client + 1 if last_client is not None else 0)
+
+    def generate(self, orders, chunk_size=5000, progress=None):
+        """Create `orders` orders (plus clients, items, payments and logs). Returns row counts."""
+        self.ensure_users()
+        self.ensure_rates()
+        counts = {'clients': 0, 'orders': 0, 'items': 0, 'payments': 0, 'logs': 0}
+        offset = self.next_index()
+        started = time.monotonic()
+
+        with historical_timestamps(Client, Order, ServiceItem, Payment, ActivityLog):
+            for start in range(0, orders, chunk_size):
+                size = min(chunk_size, orders - start)
+                with transaction.atomic():
+                    chunk_counts = self._generate_chunk(offset + start, size)
+                for key, value in chunk_counts.items():
+                    counts[key] += value
+                if progress:
+                    elapsed = time.monotonic() - started
+                    progress(start + size, orders, elapsed)
+        return counts
+
+    # -- chunk construction -------------------------------------------------
+
+    def _generate_chunk(self, first_index, size):
+        num_clients = max(1, size // self.orders_per_client)
+        clients = Client.objects.bulk_create(
+            [self._build_client(first_index + i) for i in range(num_clients)], batch_size=2000
+        )
+
+        orders, children = [], []
+        for i in range(size):
+            order, items, payments, logs = self._build_order(first_index + i, self.rng.choice(clients))
+            orders.append(order)
+            children.append((items, payments, logs))
+
+        Order.objects.bulk_create(orders, batch_size=2000)
+
+        items, payments, logs = [], [], []
+        for order, (order_items, order_payments, order_logs) in zip(orders, children):
+            for obj in order_items:
+                obj.order = order
+            for obj in order_payments:
+                obj.order = order
+            for obj in order_logs:
+                obj.order = order
+            items.extend(order_items)
+            payments.extend(order_payments)
+            logs.extend(order_logs)
+
+        ServiceItem.objects.bulk_create(items, batch_size=2000)
+        Payment.objects.bulk_create(payments, batch_size=2000)
+        ActivityLog.objects.bulk_create(logs, batch_size=2000)
+        # Primary keys can be reused after a flush: drop any cached fragments
+        fragments.bump(Order, *(order.pk for order in orders))
+        fragments.bump(ServiceItem, *(item.pk for item in items))
+        return {'clients': len(clients), 'orders': len(orders), 'items': len(items),
+                'payments': len(payments), 'logs': len(logs)}
+
+    def _build_client(self, index):
+        rng = self.rng
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        created_at = self.now - timezone.timedelta(days=rng.randint(0, HISTORY_DAYS), minutes=rng.randint(0, 1439))
+        return Client(
+            full_name=f'{first} {last} {rng.choice(LAST_NAMES)}',
+            email=f'cliente{self.seed}.{index}@dataset.example',
+            phone=f'+53 5{rng.randint(1000000, 9999999)}',
+            is_collaborator=rng.random() < 0.08,
+            created_at=created_at,
+        )
+
+    def _build_order(self, index, client):
+        rng = self.rng
+        global_status = self.pick(self._statuses)
+        window = OPEN_WINDOW_DAYS if global_status in OPEN_STATUSES else HISTORY_DAYS
+        created_at = self.now - timezone.timedelta(days=rng.uniform(0, window))
+        currency = self.pick(self._currencies)
+        gestor = rng.choice(self.gestores)
+
+        items = [
+            self._build_item(index, client, global_status, created_at)
+            for _ in range(self.pick(self._items_per_order))
+        ]
+        total_amount = sum((item.price for item in items), Decimal('0.00'))
+        total_cost = sum((item.cost for item in items), Decimal('0.00'))
+
+        payments = self._build_payments(global_status, total_amount, currency, created_at)
+        total_paid = sum((p.amount for p in payments), Decimal('0.00'))
+        if total_paid >= total_amount:
+            payment_status = 'PAID'
+        elif total_paid > 0:
+            payment_status = 'PARTIAL'
+        else:
+            payment_status = 'PENDING'
+
+        last_activity = max([created_at] + [p.payment_date for p in payments])
+        order = Order(
+            order_friendly_id=f"{client.full_name.replace(' ', '').upper()[:5]}_"
+                              f"{created_at:%Y%m%d}_{index:06X}",
+            client=client,
+            created_by=self.system_user,
+            assigned_to=gestor,
+            status='COMPLETED' if global_status == 'CLOSED' else 'PROCESSING',
+            global_status=global_status,
+            payment_status=payment_status,
+            currency=currency,
+            total_amount=total_amount,
+            total_cost=total_cost,
+            total_margin=total_amount - total_cost,
+            total_paid=total_paid,
+            balance_due=total_amount - total_paid,
+            total_amount_base=fx.to_base(total_amount, currency, created_at),
+            total_margin_base=fx.to_base(total_amount - total_cost, currency, created_at),
+            balance_due_base=fx.to_base(total_amount - total_paid, currency, created_at),
+            has_overdue=any(item.urgency == ServiceItem.URGENCY_OVERDUE for item in items),
+            created_at=created_at,
+            updated_at=last_activity,
+        )
+        logs = self._build_logs(gestor, items, payments, created_at, global_status)
+        return order, items, payments, logs
+
+    def _build_item(self, index, client, global_status, created_at):
+        rng = self.rng
+        legalization_type = self.pick(self._leg_types)
+        destination = self.pick(self._destinations)
+        priority = 'EXPRESS' if rng.random() < EXPRESS_RATE else 'NORMAL'
+        cost = Decimal(BASE_COST[legalization_type] + rng.randint(-5, 15))
+        markup = Decimal('1.8') if client.is_collaborator else Decimal('2.5')
+        price = (cost * markup).quantize(TWO_PLACES)
+        if priority == 'EXPRESS':
+            price = (price * Decimal('1.4')).quantize(TWO_PLACES)
+
+        item = ServiceItem(
+            service_type='LEGALIZATION',
+            document_type=self.pick(self._doc_types),
+            legalization_type=legalization_type,
+            delivery_destination=destination,
+            titular_name=client.full_name if rng.random() < 0.6 else
+            f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+            responsible=rng.choice(RESPONSIBLES),
+            current_location=rng.choice(LOCATIONS),
+            cost=cost,
+            price=price,
+            margin=price - cost,
+            priority=priority,
+            created_at=created_at,
+            updated_at=created_at,
+        )
+
+        phases = item.get_workflow_phases()
+        if global_status in ('NEW_REQUEST', 'PENDING_PAYMENT'):
+            position = 0
+        elif global_status in ('IN_PROCESS_PARTIAL', 'IN_PROCESS_PAID'):
+            position = rng.randint(1, max(1, len(phases) - 3))
+        elif global_status == 'READY_DELIVERY':
+            position = len(phases) - 2
+        else:
+            position = len(phases) - 1
+        item.status = phases[position]
+        item.logistics_status = 'DELIVERED' if item.status == 'DELIVERED' else 'NA'
+
+        step = timezone.timedelta(days=2)
+        item.phase_dates = {
+            phase: (created_at + step * n).isoformat() for n, phase in enumerate(phases[:position + 1])
+        }
+
+        sla_days = 3 if priority == 'EXPRESS' else 15
+        item.deadline = created_at + timezone.timedelta(days=sla_days)
+        is_open = item.status not in ('READY', 'DELIVERED')
+        if is_open:
+            if rng.random() < OVERDUE_RATE:
+                item.deadline = self.now - timezone.timedelta(days=rng.uniform(0.1, 20))
+            elif item.deadline < self.now:
+                item.deadline = self.now + timezone.timedelta(days=rng.uniform(0.5, sla_days))
+            if rng.random() < 0.8:
+                item.assigned_tramitador = rng.choice(self.tramitadores)
+        else:
+            item.assigned_tramitador = rng.choice(self.tramitadores)
+        # bulk_create bypasses save()
+        item.urgency = item.compute_urgency(self.now)
+        return item
+
+    def _build_payments(self, global_status, total_amount, currency, created_at):
+        rng = self.rng
+        if global_status in ('NEW_REQUEST', 'PENDING_PAYMENT') or total_amount <= 0:
+            return []
+        if global_status == 'IN_PROCESS_PARTIAL':
+            amounts = [(total_amount * Decimal(rng.randint(30, 70)) / 100).quantize(TWO_PLACES)]
+        else:
+            deposit = (total_amount * Decimal(rng.choice([50, 100])) / 100).quantize(TWO_PLACES)
+            amounts = [deposit] if deposit == total_amount else [deposit, total_amount - deposit]
+
+        payments = []
+        for n, amount in enumerate(amounts):
+            payment_date = created_at + timezone.timedelta(days=1 + 4 * n, hours=rng.randint(0, 8))
+            payments.append(Payment(
+                amount=amount,
+                currency=currency,
+                method=rng.choices(['TRANSFER', 'CASH', 'STRIPE'], weights=[60, 30, 10])[0],
+                destination_account='CUBA' if currency == 'CUP' else 'SPAIN',
+                receipt_sent=rng.random() < 0.9,
+                payment_date=payment_date,
+                amount_base=fx.to_base(amount, currency, payment_date),
+            ))
+        return payments
+
+    def _build_logs(self, gestor, items, payments, created_at, global_status):
+        logs = [ActivityLog(
+            user=self.system_user,
+            action_type='SERVICE_ADDED',
+            description=f'Orden creada con {len(items)} servicios',
+            timestamp=created_at,
+        )]
+        for payment in payments:
+            logs.append(ActivityLog(
+                user=gestor,
+                action_type='PAYMENT',
+                description=f'Pago registrado: {payment.amount} {payment.currency}',
+                metadata={'method': payment.method},
+                timestamp=payment.payment_date,
+            ))
+        if global_status not in ('NEW_REQUEST', 'PENDING_PAYMENT'):
+            for item in items:
+                logs.append(ActivityLog(
+                    user=item.assigned_tramitador,
+                    action_type='STATUS_CHANGE',
+                    description=f"Servicio '{item.titular_name}': Iniciado/Solicitado → {item.get_status_display()}",
+                    timestamp=created_at + timezone.timedelta(days=2),
+                ))
+        return logs
@@ -0,0 +1,51 @@
+"""
+Deadline sweeper.
+
+ServiceItem.urgency and Order.has_overdue are recomputed on every save, but
+an item whose deadline passes without being touched keeps them. The sweeper
+finds those items with one range query on the crm_item_due_idx partial
+index, marks them overdue (URGENCY_OVERDUE) and their orders has_overdue in
+bulk, and records one ESCALATION activity log per item in a single insert.
+A run costs the number of items that became overdue, not the size of the
+backlog. Run it periodically with `python manage.py sweep_deadlines
+--interval 60` (or from cron without --interval).
+"""
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import fragments
+from .models import ActivityLog, Order, ServiceItem
+
+
+def sweep_overdue(now=None, batch_size=500):
+    """Escalate open items past their deadline; returns how many became overdue"""
+    now = now or timezone.now()
+    swept = 0
+    due = ServiceItem.objects.filter(
+        urgency__in=[ServiceItem.URGENCY_NORMAL, ServiceItem.URGENCY_EXPRESS], deadline__lt=now,
+    ).order_by('deadline')
+    while True:
+        with transaction.atomic():
+            # Locked rows are re-checked against the condition (concurrent saves)
+            rows = list(due.select_for_update().values_list('pk', 'order_id', 'titular_name', 'deadline')[:batch_size])
+            if not rows:
+                return swept
+            pks = [pk for pk, _, _, _ in rows]
+            order_ids = {order_id for _, order_id, _, _ in rows}
+            changed = {'updated_at': timezone.now(), 'version': F('version') + 1}
+            ServiceItem.objects.filter(pk__in=pks).update(urgency=ServiceItem.URGENCY_OVERDUE, **changed)
+            Order.objects.filter(pk__in=order_ids, has_overdue=False).update(has_overdue=True, **changed)
+            ActivityLog.objects.bulk_create([
+                ActivityLog(
+                    order_id=order_id,
+                    action_type='ESCALATION',
+                    description=f"Servicio '{titular_name}' vencido (fecha límite {deadline:%d/%m/%Y %H:%M})",
+                    metadata={'item': pk, 'deadline': deadline.isoformat()},
+                )
+                for pk, order_id, titular_name, deadline in rows
+            ])
+            # update() and bulk_create() bypass the save() bumps
+            fragments.bump(ServiceItem, *pks)
+            fragments.bump(Order, *order_ids)
+            swept += len(rows)
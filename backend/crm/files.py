@@ -0,0 +1,355 @@
+"""
+Stored documents: final legalizations (ServiceItem.final_document) and
+payment proofs (Payment.proof_file).
+
+Large scans are uploaded in chunks that can be resumed after a dropped
+connection (crm.models.Upload):
+
+    POST   /api/uploads/                 {target, object_id, filename, size[, sha256]}
+    PUT    /api/uploads/<id>/            chunk bytes; Upload-Offset, X-Chunk-SHA256 headers
+    GET    /api/uploads/<id>/            bytes received so far: where to resume
+    POST   /api/uploads/<id>/complete/   verify the whole file, store it and attach it
+    DELETE /api/uploads/<id>/            abort
+
+Chunks are streamed from the socket into MEDIA_ROOT/partial/<id>.part, one
+block at a time, and acknowledged only once their SHA-256 matches and they
+are on disk. A chunk cut short or corrupted is discarded and resent from
+the same offset.
+
+Files are stored under their SHA-256 (<upload_to>/<hash[:2]>/<hash><ext>),
+so the same scan uploaded twice is stored once, and attached with an UPDATE
+of that column only (save() would recompute the order totals).
+
+Downloads honour single byte ranges (resuming a download) and, with
+FILE_DOWNLOAD_OFFLOAD, hand the transfer to the front server: nginx
+(X-Accel-Redirect to FILE_DOWNLOAD_ACCEL_PREFIX, an internal location
+aliased to MEDIA_ROOT) or Apache/lighttpd (X-Sendfile), which then also
+serve the ranges.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import content_disposition_header
+
+from . import fragments
+from .models import ActivityLog, Order, Payment, ServiceItem, Upload
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock on the partial file
+    fcntl = None
+
+BLOCK_SIZE = 64 * 1024
+
+# Upload.target -> (model, file field)
+TARGETS = {
+    'FINAL_DOCUMENT': (ServiceItem, 'final_document'),
+    'PAYMENT_PROOF': (Payment, 'proof_file'),
+}
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+_SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class UploadError(ValueError):
+    """A chunk or upload that cannot be accepted as sent"""
+
+
+class OffsetMismatch(UploadError):
+    """The chunk does not start where the received bytes end"""
+
+    def __init__(self, expected):
+        super().__init__(f'Expected offset {expected}')
+        self.expected = expected
+
+
+class UploadBusy(UploadError):
+    """Another request is writing or completing this upload"""
+
+
+def partial_dir():
+    return getattr(settings, 'UPLOAD_PARTIAL_DIR', None) or os.path.join(settings.MEDIA_ROOT, 'partial')
+
+
+def partial_path(upload):
+    return os.path.join(partial_dir(), f'{upload.pk}.part')
+
+
+@contextmanager
+def _locked(path):
+    """The partial file opened for writing, locked against other requests"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o640)
+    with open(fd, 'r+b') as handle:
+        if fcntl is not None:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadBusy('Upload in progress')
+        yield handle
+
+
+def write_chunk(upload, stream, offset, length, checksum=''):
+    """
+    Append `length` bytes read from `stream` at `offset`, which must be
+    where the received bytes end. Returns the new offset.
+    """
+    if offset + length > upload.size:
+        raise UploadError('Chunk past the declared size')
+    with _locked(partial_path(upload)) as handle:
+        # Re-read under the lock: a concurrent request may have moved it
+        upload.refresh_from_db(fields=['received', 'status'])
+        if upload.status != 'OPEN':
+            raise UploadError('Upload is not open')
+        if offset != upload.received:
+            raise OffsetMismatch(upload.received)
+
+        # Drop whatever a previous, interrupted chunk left past the offset
+        handle.seek(offset)
+        handle.truncate()
+        digest = hashlib.sha256()
+        remaining = length
+        while remaining:
+            block = stream.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                break
+            digest.update(block)
+            handle.write(block)
+            remaining -= len(block)
+        if remaining or (checksum and checksum.lower() != digest.hexdigest()):
+            handle.truncate(offset)
+            raise UploadError('Chunk incomplete' if remaining else 'Chunk checksum mismatch')
+        handle.flush()
+        os.fsync(handle.fileno())
+
+        received = offset + length
+        Upload.objects.filter(pk=upload.pk, received=offset).update(received=received, updated_at=timezone.now())
+        upload.received = received
+    return received
+
+
+def file_sha256(handle):
+    digest = hashlib.sha256()
+    for block in iter(lambda: handle.read(BLOCK_SIZE), b''):
+        digest.update(block)
+    return digest.hexdigest()
+
+
+def content_name(upload_to, digest, filename):
+    """Storage path of a file by content: <upload_to>/<hash[:2]>/<hash><ext>"""
+    ext = os.path.splitext(filename)[1].lower()
+    if not re.fullmatch(r'\.[a-z0-9]{1,10}', ext):
+        ext = ''
+    return f"{upload_to.rstrip('/')}/{digest[:2]}/{digest}{ext}"
+
+
+class _LocalFile(File):
+    """A file already on local disk: FileSystemStorage moves it instead of copying"""
+
+    def temporary_file_path(self):
+        return self.name
+
+
+def store(content, upload_to, filename, digest):
+    """Save unless the same content is already stored; returns (path, deduplicated)"""
+    path = content_name(upload_to, digest, filename)
+    if default_storage.exists(path):
+        return path, True
+    saved = default_storage.save(path, content)
+    if saved != path:
+        # Stored concurrently by another request under the same name
+        default_storage.delete(saved)
+    return path, False
+
+
+def store_uploaded_file(uploaded, upload_to):
+    """A multipart UploadedFile stored by content; returns (path, digest, deduplicated)"""
+    digest = hashlib.sha256()
+    for block in uploaded.chunks(BLOCK_SIZE):
+        digest.update(block)
+    uploaded.seek(0)
+    path, deduplicated = store(uploaded, upload_to, uploaded.name, digest.hexdigest())
+    return path, digest.hexdigest(), deduplicated
+
+
+def upload_to(target):
+    """Storage prefix of a target's file field, as declared on the model"""
+    model, field = TARGETS[target]
+    return model._meta.get_field(field).upload_to
+
+
+def target_object(target, object_id):
+    """The ServiceItem or Payment an upload is for (DoesNotExist if gone)"""
+    model, _ = TARGETS[target]
+    return model.objects.only('pk', 'order_id', *(
+        ('titular_name',) if model is ServiceItem else ('amount', 'currency'))).get(pk=object_id)
+
+
+def attach(obj, path, user=None, metadata=None):
+    """Point the document field at the stored file and log it, without save()"""
+    now = timezone.now()
+    if isinstance(obj, ServiceItem):
+        ServiceItem.objects.filter(pk=obj.pk).update(
+            final_document=path, updated_at=now, version=F('version') + 1)
+        fragments.bump(ServiceItem, obj.pk)
+        description = f"Documento final subido para '{obj.titular_name}'"
+    else:
+        Payment.objects.filter(pk=obj.pk).update(proof_file=path)
+        description = f"Justificante de pago subido ({obj.amount} {obj.currency})"
+    # update() bypasses the save() bumps
+    fragments.bump(Order, obj.order_id)
+    ActivityLog.objects.create(
+        order_id=obj.order_id,
+        user=user,
+        action_type='DOCUMENT_UPLOAD',
+        description=description,
+        metadata={'file': path, **(metadata or {})},
+    )
+
+
+def complete_upload(upload, obj, user=None):
+    """
+    Verify the received file, store it by content and attach it to `obj`.
+    Call outside a transaction: hashing and moving a large file takes time.
+    """
+    path = partial_path(upload)
+    with _locked(path) as handle:
+        upload.refresh_from_db(fields=['received', 'status'])
+        if upload.status != 'OPEN':
+            raise UploadError('Upload is not open')
+        if upload.received != upload.size:
+            raise OffsetMismatch(upload.received)
+        handle.seek(0)
+        digest = file_sha256(handle)
+        if upload.sha256 and upload.sha256 != digest:
+            # Corrupted somewhere the chunk checksums did not cover: start over
+            handle.truncate(0)
+            Upload.objects.filter(pk=upload.pk).update(received=0, updated_at=timezone.now())
+            raise UploadError('File checksum mismatch')
+
+        with open(path, 'rb') as source:
+            stored, deduplicated = store(_LocalFile(source, name=path), upload_to(upload.target), upload.filename,
+                                         digest)
+        if os.path.exists(path):
+            os.remove(path)
+
+    with transaction.atomic():
+        Upload.objects.filter(pk=upload.pk).update(
+            status='COMPLETE', sha256=digest, stored_name=stored, updated_at=timezone.now())
+        attach(obj, stored, user, {'sha256': digest, 'size': upload.size, 'upload': str(upload.pk)})
+    upload.status, upload.sha256, upload.stored_name = 'COMPLETE', digest, stored
+    return stored, deduplicated
+
+
+def abort_upload(upload):
+    Upload.objects.filter(pk=upload.pk, status='OPEN').update(status='ABORTED', updated_at=timezone.now())
+    upload.status = 'ABORTED'
+    try:
+        os.remove(partial_path(upload))
+    except FileNotFoundError:
+        pass
+
+
+def purge_stale_uploads(hours=None):
+    """Abort the uploads untouched for UPLOAD_EXPIRY_HOURS; returns how many"""
+    hours = hours if hours is not None else getattr(settings, 'UPLOAD_EXPIRY_HOURS', 48)
+    stale = Upload.objects.filter(status='OPEN', updated_at__lt=timezone.now() - timezone.timedelta(hours=hours))
+    purged = 0
+    for upload in stale.only('pk'):
+        abort_upload(upload)
+        purged += 1
+    return purged
+
+
+def parse_range(header, size):
+    """
+    (start, end) inclusive for a single 'bytes=' range, None to serve the
+    whole file (no header, several ranges or unparseable), or False when it
+    starts past the end (416).
+    """
+    match = _RANGE_RE.match(header.replace(' ', '')) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        # Suffix range: the last N bytes
+        length = int(last)
+        return (max(size - length, 0), size - 1) if length and size else False
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        return False
+    return start, end
+
+
+def _read_range(handle, start, length):
+    try:
+        handle.seek(start)
+        while length > 0:
+            block = handle.read(min(BLOCK_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+    finally:
+        handle.close()
+
+
+def serve(request, path, filename=None):
+    """
+    Download response for a stored file: 304 on a matching If-None-Match,
+    offloaded to the front server when configured, otherwise the whole file
+    or the requested byte range.
+    """
+    filename = filename or os.path.basename(path)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    # Content-addressed names are their own ETag; legacy names are not
+    etag = f'"{stem}"' if _SHA256_RE.match(stem) else None
+    if etag and etag in request.headers.get('If-None-Match', ''):
+        return HttpResponseNotModified(headers={'ETag': etag})
+
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    offload = getattr(settings, 'FILE_DOWNLOAD_OFFLOAD', '')
+    if offload == 'nginx':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = getattr(settings, 'FILE_DOWNLOAD_ACCEL_PREFIX', '/protected-media/') + path
+    elif offload == 'sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = default_storage.path(path)
+    else:
+        size = default_storage.size(path)
+        if_range = request.headers.get('If-Range')
+        byte_range = parse_range(request.headers.get('Range'), size) if not if_range or if_range == etag else None
+        if byte_range is False:
+            response = HttpResponse(status=416, content_type=content_type)
+            response['Content-Range'] = f'bytes */{size}'
+        elif byte_range is None:
+            response = FileResponse(default_storage.open(path, 'rb'), content_type=content_type)
+        else:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                _read_range(default_storage.open(path, 'rb'), start, end - start + 1),
+                status=206, content_type=content_type)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = str(end - start + 1)
+        response['Accept-Ranges'] = 'bytes'
+
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    response['Cache-Control'] = 'private, no-cache'
+    if etag:
+        response['ETag'] = etag
+    return response
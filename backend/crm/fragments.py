@@ -0,0 +1,199 @@
+"""
+Versioned cache of serialized fragments (order cards, service items, order details).
+
+Every cached row has a version token stored under `crm:v:<model>:<pk>`;
+fragments are stored under `crm:f:<kind>:<pk>:<version>`, so bumping the
+version is all it takes to invalidate every fragment derived from a row.
+The model save paths call bump(); endpoints fetch the pks of their queryset
+from the database and assemble the response with two get_many calls,
+serializing only the misses.
+
+days_until_deadline depends on the current time and is recomputed on every
+read (the values the refresh returns are part of the ETags, crm.views). The
+overdue flags are persisted (see crm.deadlines), so the writes that change
+them bump the versions like any other.
+"""
+import threading
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from . import invalidation
+
+GENERATION_KEY = 'crm:generation'
+
+_token_lock = threading.Lock()
+_last_token = 0
+
+
+def _cache(alias=None):
+    return caches[alias or getattr(settings, 'FRAGMENT_CACHE_ALIAS', 'default')]
+
+
+def _timeout():
+    return getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 86400)
+
+
+def _label(model):
+    return model if isinstance(model, str) else model._meta.model_name
+
+
+def version_key(model, pk):
+    return f'crm:v:{_label(model)}:{pk}'
+
+
+def new_token():
+    """Strictly increasing within the process, practically unique across processes (never compared across them)"""
+    global _last_token
+    with _token_lock:
+        _last_token = max(time.time_ns(), _last_token + 1)
+        return _last_token
+
+
+def set_versions(model, pks, publish=True):
+    token = new_token()
+    versions = {version_key(model, pk): token for pk in pks}
+    if publish:
+        versions[GENERATION_KEY] = token
+    _cache().set_many(versions, _timeout())
+    if publish:
+        # Other workers' local caches (crm.invalidation)
+        invalidation.publish(_label(model), pks, token)
+    return token
+
+
+def current_generation():
+    """Version of the last write to any cached row (keys derived results such as crm.coalescing)"""
+    cache = _cache()
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        generation = new_token()
+        cache.add(GENERATION_KEY, generation, _timeout())
+        generation = cache.get(GENERATION_KEY, generation)
+    return generation
+
+
+def apply_versions(model, pks, version, alias=None):
+    """
+    Versions bumped by another process. Only rows this cache holds a version
+    for matter: missing ones get a fresh version when next read. Tokens come
+    from each process' clock, so a different one replaces the local version
+    even when it is smaller: ordering them across hosts would let clock skew
+    hide real invalidations.
+    """
+    cache = _cache(alias)
+    keys = [version_key(model, pk) for pk in pks] + [GENERATION_KEY]
+    current = cache.get_many(keys)
+    cache.set_many({key: version for key, token in current.items() if token != version}, _timeout())
+
+
+def forget_versions(alias=None):
+    """Drop everything cached locally (invalidations may have been missed)"""
+    _cache(alias).clear()
+
+
+def bump(model, *pks):
+    """
+    Invalidate the fragments of these rows: now, and again once the current
+    transaction commits (a concurrent reader may have cached the old rows
+    under the first token in between).
+    """
+    pks = [pk for pk in pks if pk is not None]
+    if not pks:
+        return
+    set_versions(model, pks)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: set_versions(model, pks))
+
+
+def get_versions(model, pks):
+    """{pk: version}; rows without a version (cold or evicted) get a new one"""
+    keys = {pk: version_key(model, pk) for pk in pks}
+    found = _cache().get_many(keys.values())
+    versions = {pk: found.get(key) for pk, key in keys.items()}
+    missing = [pk for pk, version in versions.items() if version is None]
+    if missing:
+        token = set_versions(model, missing, publish=False)
+        versions.update(dict.fromkeys(missing, token))
+    return versions
+
+
+def refresh_item(item, now):
+    """Recompute the time dependent fields of a ServiceItemSerializer fragment; returns their values"""
+    deadline = item['deadline'] and datetime.fromisoformat(item['deadline'])
+    item['days_until_deadline'] = (deadline - now).days if deadline else None
+    return item['days_until_deadline']
+
+
+def refresh_order(order, now):
+    """Same for an order fragment and its nested items"""
+    return [refresh_item(item, now) for item in order.get('items', ())]
+
+
+class FragmentCache:
+    """
+    FragmentCache('order-card', Order, build).get_list(queryset)
+
+    `build(queryset)` serializes the rows of a queryset into {pk: fragment}.
+    The version of `model` decides the freshness of each fragment, so rows
+    that embed other rows (orders embed items and payments) must have their
+    version bumped when those change.
+    """
+    # Above this many misses the whole queryset is rebuilt instead of
+    # filtering it by pk (keeps clear of database parameter limits)
+    max_misses_by_pk = 900
+
+    def __init__(self, kind, model, build, refresh=None):
+        self.kind = kind
+        self.model = model
+        self.build = build
+        self.refresh = refresh
+
+    def get_list(self, queryset, now=None):
+        """Fragments for the rows of `queryset`, in its order"""
+        if not getattr(settings, 'FRAGMENT_CACHE_ENABLED', True):
+            return list(self.build(queryset).values())
+        return self.get_many(list(queryset.values_list('pk', flat=True)), queryset, now)
+
+    def get_many(self, pks, queryset=None, now=None, versions=None):
+        """
+        Fragments for `pks`, in that order, building the misses from
+        `queryset` (default: all rows of the model). For pages whose pks were
+        already fetched, e.g. by keyset pagination. `versions` are those
+        already read with get_versions(), e.g. to compute ETags.
+        """
+        if queryset is None or queryset.query.is_sliced:
+            queryset = self.model._default_manager.all()
+        if not pks:
+            return []
+        if not getattr(settings, 'FRAGMENT_CACHE_ENABLED', True):
+            built = self.build(queryset.filter(pk__in=pks))
+            return [built[pk] for pk in pks if pk in built]
+
+        cache = _cache()
+        if versions is None or any(pk not in versions for pk in pks):
+            versions = get_versions(self.model, pks)
+        keys = {pk: f'crm:f:{self.kind}:{pk}:{versions[pk]}' for pk in pks}
+        cached = cache.get_many(keys.values())
+
+        fragments = {}
+        now = now or timezone.now()
+        for pk, key in keys.items():
+            if key in cached:
+                fragment = cached[key]
+                if self.refresh:
+                    self.refresh(fragment, now)
+                fragments[pk] = fragment
+
+        misses = [pk for pk in pks if pk not in fragments]
+        if misses:
+            if len(misses) <= self.max_misses_by_pk:
+                queryset = queryset.filter(pk__in=misses)
+            built = {pk: fragment for pk, fragment in self.build(queryset).items() if pk in keys}
+            cache.set_many({keys[pk]: fragment for pk, fragment in built.items()}, _timeout())
+            fragments.update(built)
+        return [fragments[pk] for pk in pks if pk in fragments]
@@ -0,0 +1,160 @@
+"""
+Exchange rates to the base currency (FX_BASE_CURRENCY).
+
+An ExchangeRate row gives how many units of the base currency one unit of
+a currency is worth from its effective date on, until the next row for
+that currency. The table is small and read by every write of an amount,
+so each process keeps it in memory and reloads it when its version
+changes: ExchangeRate writes bump it (crm.fragments) and crm.invalidation
+carries the bump to the other workers.
+
+Order and payment amounts are also stored in the base currency at write
+time (the *_base columns), at the rate effective on the day the order was
+created or the payment made, so reports add them up in SQL across
+currencies. They stay NULL while a currency has no rate for that day:
+`python manage.py rebase_amounts` fills them in once rates are entered,
+and recomputes them all (--all) after a rate is corrected.
+"""
+import bisect
+import threading
+from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from django.db.models import F
+from django.db.models.functions import Round
+from django.utils import timezone
+
+from . import fragments
+
+CENTS = Decimal('0.01')
+_TABLE = 'table'
+
+_lock = threading.Lock()
+_loaded = {'version': None, 'rates': {}}
+
+
+class MissingRate(ValueError):
+    """No exchange rate for a currency on a day"""
+
+
+def base_currency():
+    return settings.FX_BASE_CURRENCY
+
+
+def invalidate():
+    """Reload the rates everywhere (ExchangeRate.save() and delete() call it)"""
+    fragments.bump('exchangerate', _TABLE)
+
+
+def _rates():
+    """{currency: ([effective dates], [rates])}, both ascending"""
+    version = fragments.get_versions('exchangerate', [_TABLE])[_TABLE]
+    if _loaded['version'] != version:
+        from .models import ExchangeRate
+        with _lock:
+            rates = {}
+            for currency, effective, value in ExchangeRate.objects.order_by(
+                    'currency', 'effective_date').values_list('currency', 'effective_date', 'rate'):
+                dates, values = rates.setdefault(currency, ([], []))
+                dates.append(effective)
+                values.append(value)
+            _loaded.update(version=version, rates=rates)
+    return _loaded['rates']
+
+
+def _day(on):
+    if on is None:
+        return timezone.localdate()
+    return timezone.localdate(on) if isinstance(on, datetime) else on
+
+
+def rate(currency, on=None):
+    """Units of the base currency per unit of `currency` on that day (date or datetime), or None"""
+    if currency == base_currency():
+        return Decimal(1)
+    dates, values = _rates().get(currency, ((), ()))
+    position = bisect.bisect_right(dates, _day(on))
+    return values[position - 1] if position else None
+
+
+def to_base(amount, currency, on=None):
+    """`amount` in the base currency, or None without a rate"""
+    factor = rate(currency, on)
+    if amount is None or factor is None:
+        return None
+    return (Decimal(str(amount)) * factor).quantize(CENTS, ROUND_HALF_UP)
+
+
+def convert(amount, source, target, on=None):
+    """`amount` from one currency into another; MissingRate when either has no rate"""
+    if source == target:
+        return Decimal(str(amount))
+    source_rate, target_rate = rate(source, on), rate(target, on)
+    if source_rate is None or target_rate is None:
+        raise MissingRate(f'No exchange rate for {source if source_rate is None else target} on {_day(on)}')
+    return (Decimal(str(amount)) * source_rate / target_rate).quantize(CENTS, ROUND_HALF_UP)
+
+
+def convert_nearest(amount, source, target, on=None):
+    """
+    convert() at the rates of `on`, or of the first later day both
+    currencies have a rate for when that day predates one of them
+    (payments entered before their currency's first rate). MissingRate
+    only when a currency has no rate at all.
+    """
+    try:
+        return convert(amount, source, target, on)
+    except MissingRate:
+        table, day = _rates(), _day(on)
+        firsts = [table[currency][0][0] for currency in (source, target)
+                  if currency != base_currency() and currency in table]
+        if len(firsts) < len({source, target} - {base_currency()}):
+            raise
+        return convert(amount, source, target, max([day] + firsts))
+
+
+def periods():
+    """(currency, first day, first day of the next rate or None, rate) for every rate"""
+    for currency, (dates, values) in _rates().items():
+        for position, (effective, value) in enumerate(zip(dates, values)):
+            following = dates[position + 1] if position + 1 < len(dates) else None
+            yield currency, effective, following, value
+
+
+def rebase(only_missing=True):
+    """
+    Recompute the *_base columns of orders and payments with the current
+    rates: one UPDATE per currency, rate period and table. Returns the
+    number of rows written.
+    """
+    from .models import Order, Payment
+
+    base = base_currency()
+    tables = (
+        (Order, 'created_at', {'total_amount_base': 'total_amount', 'total_margin_base': 'total_margin',
+                               'balance_due_base': 'balance_due'}),
+        (Payment, 'payment_date', {'amount_base': 'amount'}),
+    )
+    spans = [(base, None, None, Decimal(1))] + [span for span in periods() if span[0] != base]
+    if not only_missing:
+        # Days before the first rate of a currency (all of them without any) have no rate
+        rates = _rates()
+        spans += [(currency, None, rates[currency][0][0] if currency in rates else None, None)
+                  for currency, _ in Order.CURRENCY_CHOICES if currency != base]
+
+    written = 0
+    for currency, first, following, factor in spans:
+        for model, day, fields in tables:
+            rows = model.objects.filter(currency=currency)
+            if first is not None:
+                rows = rows.filter(**{f'{day}__date__gte': first})
+            if following is not None:
+                rows = rows.filter(**{f'{day}__date__lt': following})
+            if only_missing:
+                rows = rows.filter(**{f'{next(iter(fields))}__isnull': True})
+            written += rows.update(**{
+                name: None if factor is None else Round(F(source) * factor, 2) for name, source in fields.items()})
+    # Reports summing the *_base columns (crm.receivables) are cached under the generation
+    invalidate()
+    return written
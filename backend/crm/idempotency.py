@@ -0,0 +1,122 @@
+"""
+Idempotency-Key support for the mutating endpoints.
+
+When a slow link drops the response, the client retries the same request
+with the same Idempotency-Key header and gets the first response back
+(with Idempotent-Replayed: true) instead of a second order or payment.
+
+    @idempotent
+    def post(self, request, order_id):
+        ...
+
+The key is inserted in the request's transaction before the view runs and
+the response stored in the same transaction, so the key commits if and only
+if the side effects do. A concurrent duplicate blocks on the unique index
+until the first request finishes, then replays its response: duplicates
+are serialized on the key, not on the order. 5xx responses are not stored,
+so the retry runs again. Keys are per user, expire after
+IDEMPOTENCY_KEY_TTL_HOURS and are removed by
+`python manage.py purge_idempotency_keys`. Reusing a key for a different
+request is a 422.
+"""
+import hashlib
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+# Headers that belong to the transport, not to the stored response
+_SKIPPED_HEADERS = {'content-type', 'content-length', 'vary', 'allow'}
+
+
+def request_fingerprint(request):
+    """SHA-256 of method, path and body (uploaded files by name and size)"""
+    def jsonable(value):
+        if isinstance(value, UploadedFile):
+            return [value.name, value.size]
+        return str(value)
+
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = {name: values for name, values in data.lists()}
+    body = json.dumps(data, sort_keys=True, default=jsonable, separators=(',', ':'))
+    return hashlib.sha256(f'{request.method} {request.path}\n{body}'.encode()).hexdigest()
+
+
+def _scope(request):
+    return f'user:{request.user.pk}' if request.user.is_authenticated else 'anonymous'
+
+
+def _replay(record):
+    if record.status_code is None:
+        # Only visible without ATOMIC_REQUESTS: the first request is still running
+        return Response({'error': 'A request with this Idempotency-Key is in progress'},
+                        status=status.HTTP_409_CONFLICT, headers={'Retry-After': '1'})
+    headers = {**record.response['headers'], 'Idempotent-Replayed': 'true'}
+    return Response(record.response['data'], status=record.status_code, headers=headers)
+
+
+def _claim(key, scope, fingerprint):
+    """(record, None) when this request runs the view, (None, response) otherwise"""
+    now = timezone.now()
+    expires_at = now + timezone.timedelta(hours=getattr(settings, 'IDEMPOTENCY_KEY_TTL_HOURS', 24))
+    for _ in range(2):
+        # A retry finds its key with one SELECT
+        record = IdempotencyKey.objects.filter(key=key, scope=scope).first()
+        if record is not None and record.expires_at <= now:
+            record.delete()
+            record = None
+        if record is not None:
+            if record.fingerprint != fingerprint:
+                return None, Response({'error': 'Idempotency-Key already used for a different request'},
+                                      status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            return None, _replay(record)
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    key=key, scope=scope, fingerprint=fingerprint, expires_at=expires_at), None
+        except IntegrityError:
+            continue  # inserted by a concurrent duplicate, now committed: replay it
+    return None, Response({'error': 'Could not claim the Idempotency-Key'}, status=status.HTTP_409_CONFLICT)
+
+
+def idempotent(method):
+    """Decorator for APIView handlers: honour the Idempotency-Key header"""
+    @wraps(method)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return method(view, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response({'error': f'{HEADER} is limited to {MAX_KEY_LENGTH} characters'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        record, response = _claim(key, _scope(request), request_fingerprint(request))
+        if response is not None:
+            return response
+
+        response = method(view, request, *args, **kwargs)
+        if response.status_code >= 500 or not isinstance(response, Response):
+            record.delete()
+            return response
+        headers = {name: value for name, value in response.items() if name.lower() not in _SKIPPED_HEADERS}
+        IdempotencyKey.objects.filter(pk=record.pk).update(
+            status_code=response.status_code, response={'data': response.data, 'headers': headers})
+        return response
+    return wrapper
+
+
+def purge_expired_keys(now=None):
+    """Delete the expired keys; returns how many"""
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=now or timezone.now()).delete()
+    return deleted
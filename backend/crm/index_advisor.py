@@ -0,0 +1,107 @@
+"""
+Index advisor: which queries of the crm API scan whole tables.
+
+Seeds a dataset like the benchmark (crm.benchmarks), then calls every
+route, plus the filtered variants in FILTERED_ROUTES, with a cold cache.
+Every SELECT they run is explained (crm.slow_queries.explain) and the
+sequential scans found in the plans are reported per route and query:
+`Seq Scan on <table>` on PostgreSQL, `SCAN <table>` without an index on
+SQLite. Statistics are refreshed (ANALYZE) before explaining so the
+planner sees the seeded data.
+
+Scans of small tables, or of queries that read most of a table anyway
+(unfiltered lists, dashboard sums), are expected; the report is a list of
+candidates, not a verdict.
+"""
+import re
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from rest_framework.test import APIClient
+
+from .benchmarks import bench_settings, build_scenarios, call
+from .datagen import DatasetGenerator
+from .models import Order
+from .slow_queries import SlowQueryRecorder, normalize_sql
+
+# Query strings exercising the filters the views apply, on top of build_scenarios()
+FILTERED_ROUTES = {
+    'order-kanban': ['with_debt=1', 'urgent=1', 'overdue=1', 'location={location}', 'assigned_to_me=1'],
+    'order-list': ['client_email={client_email}'],
+    'smart-queue': ['location={location}', 'tramitador=none'],
+}
+
+_POSTGRES_SCAN_RE = re.compile(r'Seq Scan on "?(\w+)"?')
+_SQLITE_SCAN_RE = re.compile(r'\bSCAN "?(\w+)"?( .*)?$', re.MULTILINE)
+
+
+def sequential_scans(plan, tables):
+    """Tables among `tables` read in full according to an EXPLAIN plan"""
+    scanned = _POSTGRES_SCAN_RE.findall(plan)
+    scanned += [table for table, rest in _SQLITE_SCAN_RE.findall(plan) if 'USING' not in (rest or '')]
+    return sorted({table for table in scanned if table in tables})
+
+
+def filtered_scenarios():
+    """build_scenarios() for the GET routes, plus their FILTERED_ROUTES variants"""
+    scenarios = {name: scenario for name, scenario in build_scenarios().items() if scenario[0] == 'get'}
+    order = Order.objects.select_related('client').filter(items__isnull=False).order_by('pk').first()
+    values = {'client_email': order.client.email,
+              'location': order.items.order_by('pk').values_list('current_location', flat=True).first()}
+    for name, queries in FILTERED_ROUTES.items():
+        method, url, data, fmt = scenarios[name]
+        for query in queries:
+            query = query.format(**values)
+            scenarios[f'{name}?{query}'] = (method, f"{url}{'&' if '?' in url else '?'}{query}", data, fmt)
+    return scenarios
+
+
+def explain_routes(scenarios, user=None):
+    """{route: [{'sql', 'origin', 'plan'}]} for every SELECT of each request (rolled back)"""
+    api = APIClient()
+    if user is not None:
+        api.force_authenticate(user)
+    plans = {}
+    for name, (method, url, data, fmt) in scenarios.items():
+        cache.clear()
+        # Every statement is recorded, SELECTs with their plan
+        recorder = SlowQueryRecorder(connection, threshold_ms=0, view_name=name)
+        with transaction.atomic(), connection.execute_wrapper(recorder):
+            call(api, method, url, data, fmt)
+            transaction.set_rollback(True)
+        plans[name] = [entry for entry in recorder.entries if entry['plan']]
+    return plans
+
+
+def find_scans(plans, tables=None):
+    """
+    One finding per (route, query shape, table):
+    [{'route', 'table', 'sql', 'origin', 'plan'}], by table then route.
+    """
+    tables = set(connection.introspection.table_names()) if tables is None else tables
+    findings = {}
+    for route, entries in plans.items():
+        for entry in entries:
+            sql = normalize_sql(entry['sql'])
+            for table in sequential_scans(entry['plan'], tables):
+                findings.setdefault((route, sql, table), {
+                    'route': route, 'table': table, 'sql': sql, 'origin': entry['origin'], 'plan': entry['plan'],
+                })
+    return sorted(findings.values(), key=lambda finding: (finding['table'], finding['route']))
+
+
+def advise(orders=2000, seed=0, log=None):
+    """Seed `orders` orders in the current database and return find_scans() over every route"""
+    seeded = Order.objects.count()
+    if orders > seeded:
+        DatasetGenerator(seed=seed).generate(orders - seeded)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    with bench_settings():
+        scenarios = filtered_scenarios()
+        if log:
+            log(f'Explaining the queries of {len(scenarios)} requests over {max(orders, seeded)} orders')
+        # Logged in, for ?assigned_to_me=
+        user = User.objects.order_by('pk').first()
+        return find_scans(explain_routes(scenarios, user=user))
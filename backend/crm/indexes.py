@@ -0,0 +1,46 @@
+"""
+Index migrations that don't lock production tables.
+
+AddIndexConcurrently / RemoveIndexConcurrently behave like AddIndex and
+RemoveIndex, but on PostgreSQL they use CREATE / DROP INDEX CONCURRENTLY,
+so writes to the table go on while the index is built. PostgreSQL refuses
+that inside a transaction: migrations using them set `atomic = False`.
+Other databases (SQLite in development and tests) build the index as usual.
+"""
+from django.db.migrations.operations import AddIndex, RemoveIndex
+
+
+def _concurrently(schema_editor):
+    return {'concurrently': True} if schema_editor.connection.vendor == 'postgresql' else {}
+
+
+class AddIndexConcurrently(AddIndex):
+    def describe(self):
+        return f'Concurrently create index {self.index.name} on {self.model_name}'
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.add_index(model, self.index, **_concurrently(schema_editor))
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.remove_index(model, self.index, **_concurrently(schema_editor))
+
+
+class RemoveIndexConcurrently(RemoveIndex):
+    def describe(self):
+        return f'Concurrently remove index {self.name} from {self.model_name}'
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            index = from_state.models[app_label, self.model_name_lower].get_index_by_name(self.name)
+            schema_editor.remove_index(model, index, **_concurrently(schema_editor))
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            index = to_state.models[app_label, self.model_name_lower].get_index_by_name(self.name)
+            schema_editor.add_index(model, index, **_concurrently(schema_editor))
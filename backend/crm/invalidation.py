@@ -0,0 +1,282 @@
+"""
+Cross-worker invalidation bus for the fragment cache (crm.fragments).
+
+With a per-process cache every gunicorn worker (and every node) keeps its
+own version tokens, so a bump in one worker would leave the others serving
+stale fragments. Every bump is broadcast as a (model, pks, version) event
+and the receivers store that version in their local cache (any version
+that differs: tokens from different hosts aren't ordered, see
+crm.fragments.apply_versions).
+
+Transports (INVALIDATION_BUS setting):
+    'unix'      datagram Unix sockets in INVALIDATION_BUS_SOCKET_DIR, one per
+                listening process (single host; a receiver that misses a
+                datagram drops its local cache)
+    'postgres'  LISTEN/NOTIFY on the default database (any number of hosts;
+                notifications sent inside a transaction are only delivered
+                if it commits)
+    'local'     in-process subscribers, for tests
+    'auto'      'postgres' on PostgreSQL, 'unix' otherwise
+    'none'      disabled (shared cache backend, or a single process)
+
+Listeners are started per worker by gunicorn's post_worker_init hook
+(see gunicorn_config.py); processes that only publish, such as management
+commands, don't need one.
+"""
+import json
+import logging
+import os
+import select
+import socket
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# pg_notify payloads are limited to 8000 bytes; datagrams are kept as small
+MAX_PAYLOAD_BYTES = 7900
+
+
+class LocalTransport:
+    """Delivers to subscribers of the same process, synchronously"""
+    subscribers = []
+
+    def publish(self, payload):
+        for callback in list(self.subscribers):
+            callback(payload)
+
+    def listen(self, callback):
+        self.subscribers.append(callback)
+
+    def close(self):
+        self.subscribers.clear()
+
+
+class UnixSocketTransport:
+    """
+    One datagram socket per listening process, all in the same directory.
+    Datagrams are numbered per sender: a receiver that finds a number
+    missing (a full queue or a timed out send) calls on_gap.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = Path(directory or getattr(settings, 'INVALIDATION_BUS_SOCKET_DIR', '/tmp/hol-crm-bus'))
+        self.address = None
+        self.sock = None
+        self.sender_id = uuid.uuid4().hex[:12]
+        self.sequence = 0
+        # Numbers are sent in order
+        self.send_lock = threading.Lock()
+
+    def publish(self, payload):
+        if not self.directory.is_dir():
+            return
+        with self.send_lock, socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+            self.sequence += 1
+            payload = f'{self.sender_id} {self.sequence}\n'.encode() + payload
+            # Never stall a request on a busy peer
+            sender.settimeout(0.2)
+            for peer in self.directory.glob('*.sock'):
+                if str(peer) == self.address:
+                    continue
+                try:
+                    sender.sendto(payload, str(peer))
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # Socket left behind by a dead worker
+                    peer.unlink(missing_ok=True)
+                except OSError as exc:
+                    logger.warning('Invalidation to %s lost: %s', peer, exc)
+
+    def listen(self, callback, on_gap=None):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.address = str(self.directory / f'{os.getpid()}-{uuid.uuid4().hex[:8]}.sock')
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.address)
+        threading.Thread(target=self._receive, args=(self.sock, callback, on_gap),
+                         name='crm-invalidation', daemon=True).start()
+
+    def _receive(self, sock, callback, on_gap):
+        # Last number received from each sender
+        received = {}
+        while True:
+            try:
+                payload = sock.recv(65536)
+            except OSError:
+                return  # closed
+            try:
+                header, payload = payload.split(b'\n', 1)
+                sender, sequence = header.decode().split(' ')
+                sequence = int(sequence)
+            except ValueError:
+                logger.warning('Malformed invalidation datagram: %r', payload[:100])
+                continue
+            if sender in received and sequence != received[sender] + 1 and on_gap:
+                logger.warning('Invalidations from %s lost (%s to %s)', sender, received[sender] + 1, sequence - 1)
+                on_gap()
+            received[sender] = sequence
+            try:
+                callback(payload)
+            except Exception:
+                logger.exception('Could not apply cache invalidation')
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            Path(self.address).unlink(missing_ok=True)
+            self.sock = None
+
+
+class PostgresNotifyTransport:
+    """NOTIFY through the request's connection, LISTEN on a dedicated one"""
+    channel = 'crm_invalidation'
+
+    def __init__(self, using='default'):
+        self.using = using
+        self.closed = threading.Event()
+
+    def publish(self, payload):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, payload.decode()])
+
+    def listen(self, callback, on_gap=None):
+        threading.Thread(target=self._receive, args=(callback, on_gap),
+                         name='crm-invalidation', daemon=True).start()
+
+    def _receive(self, callback, on_gap):
+        import psycopg2
+        from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+        params = connections[self.using].get_connection_params()
+        backoff = 1
+        while not self.closed.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**params)
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN {self.channel}')
+                backoff = 1
+                while not self.closed.is_set():
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        try:
+                            callback(conn.notifies.pop(0).payload.encode())
+                        except Exception:
+                            logger.exception('Could not apply cache invalidation')
+            except psycopg2.Error as exc:
+                logger.warning('Invalidation listener disconnected: %s', exc)
+                # Events sent while disconnected are lost
+                if on_gap:
+                    on_gap()
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def close(self):
+        self.closed.set()
+
+
+TRANSPORTS = {
+    'local': LocalTransport,
+    'unix': UnixSocketTransport,
+    'postgres': PostgresNotifyTransport,
+}
+
+
+class InvalidationBus:
+    """
+    Encodes version events, splits them under the payload limit and applies
+    the ones received from other processes to the local cache.
+    """
+
+    def __init__(self, transport, cache_alias=None):
+        self.transport = transport
+        self.cache_alias = cache_alias
+        self.origin = uuid.uuid4().hex[:12]
+        self.listening = False
+
+    def publish(self, model, pks, version):
+        pks = list(pks)
+        header = {'o': self.origin, 'm': model, 'v': version}
+        # Size the batches from the longest id (plus its comma)
+        per_message = max(1, (MAX_PAYLOAD_BYTES - 100) // (max(len(str(pk)) for pk in pks) + 1))
+        for start in range(0, len(pks), per_message):
+            payload = json.dumps({**header, 'p': pks[start:start + per_message]}, separators=(',', ':'))
+            try:
+                self.transport.publish(payload.encode())
+            except Exception:
+                logger.exception('Could not publish cache invalidation')
+
+    def receive(self, payload):
+        from .fragments import apply_versions
+
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            logger.warning('Malformed invalidation event: %r', payload[:100])
+            return
+        if event.get('o') == self.origin:
+            return
+        apply_versions(event['m'], event['p'], event['v'], alias=self.cache_alias)
+
+    def start(self):
+        if self.listening:
+            return
+        if isinstance(self.transport, (PostgresNotifyTransport, UnixSocketTransport)):
+            self.transport.listen(self.receive, on_gap=self.forget)
+        else:
+            self.transport.listen(self.receive)
+        self.listening = True
+
+    def forget(self):
+        from .fragments import forget_versions
+        forget_versions(alias=self.cache_alias)
+
+    def close(self):
+        self.transport.close()
+        self.listening = False
+
+
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def backend_name():
+    name = getattr(settings, 'INVALIDATION_BUS', 'none')
+    if name == 'auto':
+        return 'postgres' if connections['default'].vendor == 'postgresql' else 'unix'
+    return name
+
+
+def get_bus():
+    """The process-wide bus, or None when disabled"""
+    global _bus
+    name = backend_name()
+    if name == 'none':
+        return None
+    with _bus_lock:
+        if _bus is None or not isinstance(_bus.transport, TRANSPORTS[name]):
+            _bus = InvalidationBus(TRANSPORTS[name]())
+        return _bus
+
+
+def publish(model, pks, version):
+    bus = get_bus()
+    if bus is not None:
+        bus.publish(model, pks, version)
+
+
+def start():
+    """Receive the other workers' invalidations in this process"""
+    bus = get_bus()
+    if bus is not None:
+        bus.start()
@@ -0,0 +1,168 @@
+"""
+Invoice PDFs, rendered once per financial version of an order.
+
+Everything printed on an invoice (client, items, payments, totals and the
+issuer) is loaded with three values() queries for any number of orders and
+hashed; the PDF is stored under that hash in the default storage
+(invoices/<hash[:2]>/<hash>.pdf). Until one of those values changes, every
+download is served from the stored file, and a change produces a new file
+instead of overwriting the old one.
+
+Rendering runs in the job workers (crm.tasks.render_invoice) or in batch
+(`python manage.py render_invoices --month 2026-09 --processes 8`).
+"""
+import hashlib
+import json
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .models import Order, Payment, ServiceItem
+from .pdf import PDFDocument
+
+# Bump when the layout changes, so every invoice is rendered again
+LAYOUT_VERSION = 1
+
+PAYMENT_METHODS = dict(Payment.PAYMENT_METHODS)
+
+
+def _money(amount, currency):
+    return f'{Decimal(amount).quantize(Decimal("0.01"))} {currency}'
+
+
+def _date(value):
+    return timezone.localtime(value).strftime('%d/%m/%Y') if timezone.is_aware(value) else value.strftime('%d/%m/%Y')
+
+
+def invoice_documents(order_ids):
+    """{order id: what its invoice shows}, in three queries"""
+    orders = Order.objects.filter(pk__in=order_ids).values(
+        'id', 'order_friendly_id', 'currency', 'total_amount', 'total_paid', 'created_at',
+        'client__full_name', 'client__email', 'client__identity_doc', 'client__address',
+    )
+    documents = {}
+    for row in orders:
+        currency = row['currency']
+        documents[row['id']] = {
+            'layout': LAYOUT_VERSION,
+            'issuer': getattr(settings, 'INVOICE_ISSUER', []),
+            'number': row['order_friendly_id'],
+            'date': _date(row['created_at']),
+            'client': [line for line in (
+                row['client__full_name'], row['client__identity_doc'], row['client__email'],
+                *(row['client__address'] or '').splitlines(),
+            ) if line],
+            'items': [],
+            'payments': [],
+            'total': _money(row['total_amount'], currency),
+            'paid': _money(row['total_paid'], currency),
+            'pending': _money(row['total_amount'] - row['total_paid'], currency),
+            'currency': currency,
+        }
+
+    items = (ServiceItem.objects.filter(order_id__in=documents).order_by('pk')
+             .values_list('order_id', 'titular_name', 'document_type', 'legalization_type', 'price'))
+    for order_id, titular_name, document_type, legalization_type, price in items:
+        document = documents[order_id]
+        legalization = ServiceItem.LEGALIZATION_DISPLAY.get(legalization_type, '')
+        concept = ' - '.join(part for part in (document_type, legalization, titular_name) if part) or 'Servicio'
+        document['items'].append([concept, _money(price, document['currency'])])
+
+    payments = (Payment.objects.filter(order_id__in=documents).order_by('payment_date', 'pk')
+                .values_list('order_id', 'payment_date', 'method', 'amount', 'currency'))
+    for order_id, payment_date, method, amount, currency in payments:
+        documents[order_id]['payments'].append(
+            [_date(payment_date), PAYMENT_METHODS.get(method, method), _money(amount, currency)])
+    return documents
+
+
+def fingerprint(document):
+    return hashlib.sha256(json.dumps(document, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+def invoice_path(digest):
+    return f'invoices/{digest[:2]}/{digest}.pdf'
+
+
+def render(document):
+    """The invoice as PDF bytes"""
+    pdf = PDFDocument()
+    left, right, bottom = 50, pdf.width - 50, 60
+    y = pdf.height - 60
+
+    def new_page():
+        nonlocal y
+        pdf.add_page()
+        y = pdf.height - 60
+        pdf.text(left, y, f"Factura {document['number']} (cont.)", size=9)
+        y -= 30
+
+    def row(cells, bold=False, size=10):
+        nonlocal y
+        if y < bottom:
+            new_page()
+        concept, amount = cells
+        pdf.text(left + 5, y, concept[:90], size=size, bold=bold)
+        pdf.text(right - 5, y, amount, size=size, bold=bold, align='right')
+        y -= size + 6
+
+    pdf.add_page()
+    pdf.text(left, y, 'FACTURA', size=20, bold=True)
+    for n, line in enumerate(document['issuer']):
+        pdf.text(right, y - n * 12, line, size=9, align='right')
+    y -= 40
+    pdf.text(left, y, f"Nº {document['number']}", size=11, bold=True)
+    pdf.text(right, y, f"Fecha: {document['date']}", size=10, align='right')
+    y -= 30
+
+    pdf.text(left, y, 'Cliente', size=10, bold=True)
+    for line in document['client']:
+        y -= 13
+        pdf.text(left, y, line[:100], size=10)
+    y -= 30
+
+    pdf.rect(left, y - 5, right - left, 18)
+    row(['Concepto', 'Importe'], bold=True)
+    for item in document['items']:
+        row(item)
+    pdf.line(left, y + 8, right, y + 8)
+    y -= 6
+    row(['Total', document['total']], bold=True, size=11)
+    row(['Pagado', document['paid']])
+    row(['Pendiente', document['pending']], bold=True)
+
+    if document['payments']:
+        y -= 20
+        row(['Pagos', ''], bold=True)
+        for payment_date, method, amount in document['payments']:
+            row([f'{payment_date}  {method}', amount], size=9)
+    return pdf.output()
+
+
+def store(document, digest=None):
+    """Render and save unless already stored; returns the storage path"""
+    path = invoice_path(digest or fingerprint(document))
+    if not default_storage.exists(path):
+        saved = default_storage.save(path, ContentFile(render(document)))
+        if saved != path:
+            # Stored concurrently by another worker under the same name
+            default_storage.delete(saved)
+    return path
+
+
+def render_invoices(order_ids, chunk_size=500):
+    """Store the invoices of these orders; returns (rendered, already stored)"""
+    order_ids = list(order_ids)
+    rendered = cached = 0
+    for start in range(0, len(order_ids), chunk_size):
+        for document in invoice_documents(order_ids[start:start + chunk_size]).values():
+            path = invoice_path(fingerprint(document))
+            if default_storage.exists(path):
+                cached += 1
+            else:
+                store(document)
+                rendered += 1
+    return rendered, cached
@@ -0,0 +1,247 @@
+"""
+Background jobs stored in the database (crm.models.Job).
+
+    @task(max_attempts=5, backoff=60)
+    def send_payment_request(order_id, user_id=None):
+        ...
+
+    enqueue(send_payment_request, order_id=order.pk, dedupe_key=f'payment-request:{order.pk}')
+
+enqueue() inserts the job in the current transaction: workers only see it
+once the request commits, and never for a request that rolled back.
+Arguments are stored as JSON, so pass ids rather than model instances.
+
+`python manage.py run_workers --concurrency 4` runs the workers. They claim
+jobs with SELECT ... FOR UPDATE SKIP LOCKED on PostgreSQL, where NOTIFY
+wakes them up as soon as a job is committed, and with a conditional UPDATE
+on SQLite (which serializes writers anyway), polling every
+JOB_POLL_INTERVAL seconds. Failed jobs are retried with exponential backoff
+up to max_attempts; jobs left RUNNING by a dead worker for more than
+JOB_TIMEOUT_SECONDS are requeued.
+
+A dedupe_key keeps at most one queued job per key: enqueueing a duplicate
+returns the job already waiting.
+"""
+import logging
+import os
+import random
+import select
+import socket
+import time
+import traceback
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'crm_jobs'
+
+
+def task(func=None, *, max_attempts=3, backoff=30, priority=0):
+    """
+    Mark a module-level function as a job. `backoff` is the delay in
+    seconds before the first retry, doubled on each following one.
+    """
+    def decorator(func):
+        func.job_options = {'max_attempts': max_attempts, 'backoff': backoff, 'priority': priority}
+        return func
+    return decorator(func) if func is not None else decorator
+
+
+def task_name(func):
+    return f'{func.__module__}.{func.__qualname__}'
+
+
+def resolve(name):
+    func = import_string(name)
+    if not hasattr(func, 'job_options'):
+        raise ValueError(f'{name} is not a task')
+    return func
+
+
+def enqueue(func, *, dedupe_key=None, delay=0, priority=None, **kwargs):
+    """Queue func(**kwargs) to run in a worker once the current transaction commits"""
+    if not hasattr(func, 'job_options'):
+        raise ValueError(f'{task_name(func)} is not a task')
+    options = func.job_options
+    job = Job(
+        task=task_name(func),
+        kwargs=kwargs,
+        priority=options['priority'] if priority is None else priority,
+        run_at=timezone.now() + timezone.timedelta(seconds=delay),
+        max_attempts=options['max_attempts'],
+        dedupe_key=dedupe_key,
+    )
+    if dedupe_key is None:
+        job.save()
+    else:
+        existing = Job.objects.filter(dedupe_key=dedupe_key, status='QUEUED').first()
+        if existing is not None:
+            return existing
+        try:
+            with transaction.atomic():
+                job.save()
+        except IntegrityError:
+            # Queued concurrently by another request
+            return Job.objects.get(dedupe_key=dedupe_key, status='QUEUED')
+    if connection.vendor == 'postgresql':
+        # Delivered when the transaction commits
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [NOTIFY_CHANNEL, ''])
+    return job
+
+
+def _jsonable(value):
+    return value if isinstance(value, (dict, list, str, int, float, bool, type(None))) else repr(value)
+
+
+class _Wakeup:
+    """Sleeps until the next poll, or until a NOTIFY on PostgreSQL"""
+
+    def __init__(self):
+        self.conn = None
+
+    def wait(self, timeout):
+        if connection.vendor != 'postgresql':
+            time.sleep(timeout)
+            return
+        import psycopg2
+        from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+        try:
+            if self.conn is None:
+                self.conn = psycopg2.connect(**connection.get_connection_params())
+                self.conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with self.conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN {NOTIFY_CHANNEL}')
+            if select.select([self.conn], [], [], timeout) != ([], [], []):
+                self.conn.poll()
+                self.conn.notifies.clear()
+        except psycopg2.Error as exc:
+            logger.warning('Job listener disconnected: %s', exc)
+            self.close()
+            time.sleep(timeout)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class Worker:
+    """
+    Worker().run() processes jobs until stop() is called (or, with
+    burst=True, until the queue is empty).
+    """
+    # Seconds between requeueing jobs of dead workers and purging old ones
+    maintenance_interval = 60
+
+    def __init__(self, name=None, poll_interval=None, burst=False):
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.poll_interval = poll_interval or getattr(settings, 'JOB_POLL_INTERVAL', 1.0)
+        self.burst = burst
+        self.stopping = False
+        self.processed = 0
+
+    def stop(self, *args):
+        """Finish the current job, then return from run() (usable as a signal handler)"""
+        self.stopping = True
+
+    def run(self):
+        wakeup = _Wakeup()
+        next_maintenance = 0
+        try:
+            while not self.stopping:
+                close_old_connections()
+                if time.monotonic() >= next_maintenance:
+                    self.maintenance()
+                    next_maintenance = time.monotonic() + self.maintenance_interval
+                job = self.claim()
+                if job is not None:
+                    self.run_job(job)
+                elif self.burst:
+                    return
+                else:
+                    wakeup.wait(self.poll_interval)
+        finally:
+            wakeup.close()
+            close_old_connections()
+
+    def claim(self):
+        """The next due job, marked RUNNING for this worker, or None"""
+        now = timezone.now()
+        due = Job.objects.filter(status='QUEUED', run_at__lte=now).order_by('-priority', 'run_at', 'id')
+        claimed = {'status': 'RUNNING', 'worker': self.name, 'started_at': now, 'attempts': F('attempts') + 1}
+        if connection.features.has_select_for_update_skip_locked:
+            with transaction.atomic():
+                job = due.select_for_update(skip_locked=True).first()
+                if job is None:
+                    return None
+                Job.objects.filter(pk=job.pk).update(**claimed)
+        else:
+            # Another worker may claim a candidate first: try the next ones
+            for pk in due.values_list('pk', flat=True)[:10]:
+                if Job.objects.filter(pk=pk, status='QUEUED').update(**claimed):
+                    job = Job(pk=pk)
+                    break
+            else:
+                return None
+        job.refresh_from_db()
+        return job
+
+    def run_job(self, job):
+        try:
+            func = resolve(job.task)
+        except (ImportError, ValueError) as exc:
+            self.finish(job, 'FAILED', error=f'{type(exc).__name__}: {exc}')
+            return
+
+        started = time.monotonic()
+        try:
+            with transaction.atomic():
+                result = func(**job.kwargs)
+        except Exception:
+            logger.warning('Job %s #%s failed (attempt %s of %s)', job.task, job.pk, job.attempts,
+                           job.max_attempts, exc_info=True)
+            self.retry_or_fail(job, traceback.format_exc(), func.job_options['backoff'])
+        else:
+            self.finish(job, 'DONE', result=_jsonable(result))
+            logger.info('Job %s #%s done in %.0f ms', job.task, job.pk, (time.monotonic() - started) * 1000)
+        self.processed += 1
+
+    def finish(self, job, status, result=None, error=''):
+        Job.objects.filter(pk=job.pk).update(
+            status=status, result=result, last_error=error, finished_at=timezone.now())
+
+    def retry_or_fail(self, job, error, backoff):
+        if job.attempts >= job.max_attempts:
+            self.finish(job, 'FAILED', error=error)
+            return
+        delay = backoff * 2 ** (job.attempts - 1) * random.uniform(0.8, 1.2)
+        delay = min(delay, getattr(settings, 'JOB_MAX_BACKOFF_SECONDS', 3600))
+        try:
+            with transaction.atomic():
+                Job.objects.filter(pk=job.pk).update(
+                    status='QUEUED', worker='', last_error=error,
+                    run_at=timezone.now() + timezone.timedelta(seconds=delay))
+        except IntegrityError:
+            # An identical job was queued meanwhile and will do the work
+            self.finish(job, 'CANCELLED', error=error)
+
+    def maintenance(self):
+        """Requeue the jobs of dead workers, purge old finished jobs"""
+        now = timezone.now()
+        timeout = getattr(settings, 'JOB_TIMEOUT_SECONDS', 900)
+        stale = Job.objects.filter(status='RUNNING', started_at__lt=now - timezone.timedelta(seconds=timeout))
+        for job in stale:
+            logger.warning('Job %s #%s lost by worker %s', job.task, job.pk, job.worker)
+            self.retry_or_fail(job, f'Worker {job.worker} did not finish within {timeout}s', backoff=0)
+
+        retention = timezone.timedelta(days=getattr(settings, 'JOB_RETENTION_DAYS', 7))
+        Job.objects.filter(status__in=['DONE', 'CANCELLED'], finished_at__lt=now - retention).delete()
@@ -0,0 +1,205 @@
+"""
+HTTP load generator modelling the office workload against a running server.
+
+Virtual users loop over weighted personas (gestores polling the kanban,
+tramitadores moving items through their workflow, payments being
+registered, carts being created) with exponential think time between
+actions. Latencies are recorded per endpoint and summarised as throughput
+and percentiles. Only the standard library is used so it runs anywhere
+the backend runs.
+"""
+import gzip
+import json
+import math
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+PERSONA_WEIGHTS = {'gestor': 50, 'tramitador': 30, 'payment': 10, 'cart': 10}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.bytes = defaultdict(int)
+
+    def record(self, endpoint, latency_ms, ok, size):
+        with self.lock:
+            self.latencies[endpoint].append(latency_ms)
+            self.bytes[endpoint] += size
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def summary(self, elapsed):
+        endpoints = {}
+        total = 0
+        for endpoint, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            total += len(values)
+            endpoints[endpoint] = {
+                'requests': len(values),
+                'errors': self.errors[endpoint],
+                'rps': round(len(values) / elapsed, 2),
+                'mean_ms': round(sum(values) / len(values), 1),
+                'p50_ms': round(percentile(values, 50), 1),
+                'p90_ms': round(percentile(values, 90), 1),
+                'p95_ms': round(percentile(values, 95), 1),
+                'p99_ms': round(percentile(values, 99), 1),
+                'max_ms': round(values[-1], 1),
+                'avg_kb': round(self.bytes[endpoint] / len(values) / 1024, 1),
+            }
+        return {
+            'elapsed_s': round(elapsed, 1),
+            'requests': total,
+            'errors': sum(self.errors.values()),
+            'rps': round(total / elapsed, 2) if elapsed else 0,
+            'endpoints': endpoints,
+        }
+
+
+class LoadTest:
+    """
+    LoadTest(base_url, fixtures, concurrency=20, think_time=1.0, duration=60).run()
+
+    `fixtures` holds the ids personas act on: {'orders': [id, ...], 'clients': [id, ...],
+    'items': [{'id', 'phases'}, ...]}, usually sampled from the database the server uses.
+    """
+
+    def __init__(self, base_url, fixtures, concurrency=20, think_time=1.0, duration=60,
+                 weights=None, seed=None, timeout=30, headers=None):
+        self.base_url = base_url.rstrip('/')
+        self.fixtures = fixtures
+        self.concurrency = concurrency
+        self.think_time = think_time
+        self.duration = duration
+        self.weights = weights or PERSONA_WEIGHTS
+        self.seed = seed
+        self.timeout = timeout
+        self.headers = {'Accept': 'application/json', 'Accept-Encoding': 'gzip'}
+        self.headers.update(headers or {})
+        self.stats = Stats()
+        self.stop_at = 0
+
+    # -- HTTP ---------------------------------------------------------------
+
+    def request(self, method, path, endpoint, payload=None):
+        """Timed request; returns the decoded JSON body of a successful response, else None"""
+        data = json.dumps(payload).encode() if payload is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method)
+        for key, value in self.headers.items():
+            request.add_header(key, value)
+        if data is not None:
+            request.add_header('Content-Type', 'application/json')
+
+        start = time.perf_counter()
+        size, ok, body = 0, False, None
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                body = response.read()
+                size = len(body)
+                ok = response.status < 400
+                if response.headers.get('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+        except urllib.error.HTTPError as exc:
+            size = len(exc.read() or b'')
+        except (urllib.error.URLError, OSError):
+            pass
+        self.stats.record(f'{method} {endpoint}', (time.perf_counter() - start) * 1000, ok, size)
+        if ok and body:
+            try:
+                return json.loads(body)
+            except ValueError:
+                pass
+        return None
+
+    # -- personas -------------------------------------------------------------
+
+    def gestor(self, rng):
+        """Polls the board, opens an order, sometimes checks the queue or the dashboard"""
+        query = rng.choice(['', '', '?with_debt=1', '?urgent=1', '?location=OFICINA_HABANA'])
+        self.request('GET', f'/orders/kanban/{query}', '/orders/kanban/')
+        if self.fixtures['orders']:
+            order_id = rng.choice(self.fixtures['orders'])
+            self.request('GET', f'/orders/{order_id}/', '/orders/<id>/')
+        if rng.random() < 0.3:
+            self.request('GET', '/smart-queue/', '/smart-queue/')
+        if rng.random() < 0.1:
+            self.request('GET', '/dashboard-stats/', '/dashboard-stats/')
+
+    def tramitador(self, rng):
+        """
+        Checks the queue, opens one item and advances it to its next workflow
+        phase, at the version read (a 409 when another user got there first)
+        """
+        self.request('GET', '/smart-queue/', '/smart-queue/')
+        if self.fixtures['items']:
+            item = rng.choice(self.fixtures['items'])
+            current = self.request('GET', f"/service-items/{item['id']}/", '/service-items/<id>/')
+            if current is None:
+                return
+            phases = item['phases']
+            position = phases.index(current['status']) if current['status'] in phases else -1
+            # Wrap around at the end so long runs keep producing transitions
+            self.request('PATCH', f"/service-items/{item['id']}/update_status/",
+                         '/service-items/<id>/update_status/',
+                         {'status': phases[(position + 1) % len(phases)], 'current_location': 'OFICINA_HABANA',
+                          'version': current['version']})
+
+    def payment(self, rng):
+        if not self.fixtures['orders']:
+            return
+        order_id = rng.choice(self.fixtures['orders'])
+        self.request('GET', f'/orders/{order_id}/', '/orders/<id>/')
+        self.request('POST', f'/orders/{order_id}/payments/', '/orders/<id>/payments/',
+                     {'amount': f'{rng.randint(10, 120)}.00', 'currency': 'EUR',
+                      'method': rng.choice(['CASH', 'TRANSFER'])})
+
+    def cart(self, rng):
+        if not self.fixtures['clients']:
+            return
+        items = [{
+            'service_type': 'LEGALIZATION',
+            'document_type': rng.choice(['ANTECEDENTES_PENALES', 'NACIMIENTO', 'MATRIMONIO']),
+            'legalization_type': rng.choice(['MINJUS', 'CONSULADO', 'MINJUS_CONSULADO']),
+            'titular_name': 'Carga Sintética',
+            'cost': '40.00',
+            'price': '100.00',
+        } for _ in range(rng.randint(1, 3))]
+        self.request('POST', '/orders/create/', '/orders/create/',
+                     {'client': rng.choice(self.fixtures['clients']), 'currency': 'EUR', 'items': items})
+
+    # -- driver -----------------------------------------------------------------
+
+    def virtual_user(self, index):
+        rng = random.Random(None if self.seed is None else self.seed + index)
+        personas, weights = list(self.weights), list(self.weights.values())
+        # Spread the first requests so users don't start in lockstep
+        time.sleep(rng.uniform(0, self.think_time))
+        while time.monotonic() < self.stop_at:
+            getattr(self, rng.choices(personas, weights=weights)[0])(rng)
+            if self.think_time:
+                time.sleep(min(rng.expovariate(1 / self.think_time), max(0, self.stop_at - time.monotonic())))
+
+    def run(self):
+        started = time.monotonic()
+        self.stop_at = started + self.duration
+        threads = [threading.Thread(target=self.virtual_user, args=(i,), daemon=True)
+                   for i in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.stats.summary(time.monotonic() - started)
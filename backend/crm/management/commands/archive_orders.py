@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from crm.archive import archivable, archive_orders
+
+
+class Command(BaseCommand):
+    help = 'Move orders closed for a while, with their items, payments and activity log, to the archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ARCHIVE_AFTER_DAYS,
+                            help='Closed and untouched for at least this many days (default: ARCHIVE_AFTER_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=settings.ARCHIVE_BATCH_SIZE,
+                            help='Orders moved per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the orders that would be archived')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            self.stdout.write(f"{archivable(days=options['days']).count()} orders would be archived")
+            return
+        archived = archive_orders(days=options['days'], batch_size=options['batch_size'])
+        self.stdout.write(f'{archived} orders archived')
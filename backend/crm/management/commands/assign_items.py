@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from crm.assignment import apply_plan, plan_assignments
+
+
+class Command(BaseCommand):
+    help = 'Assign open service items to tramitadores, balancing their workload'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebalance', action='store_true',
+                            help='Also redistribute assigned items nobody has started on')
+        parser.add_argument('--limit', type=int, default=None, help='At most this many items per run')
+        parser.add_argument('--dry-run', action='store_true', help='Show the plan without applying it')
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep running, assigning new items every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        mode = 'rebalance' if options['rebalance'] else 'unassigned'
+        while True:
+            plan = plan_assignments(mode=mode, limit=options['limit'])
+            if options['dry_run']:
+                self.show(plan)
+                return
+            if plan.assignments or not options['interval']:
+                self.stdout.write(f'{apply_plan(plan)} items assigned')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
+
+    def show(self, plan):
+        data = plan.as_dict()
+        self.stdout.write(f"Plan {data['plan_id']}: {len(data['assignments'])} items")
+        for row in data['workload']:
+            self.stdout.write(
+                f"  {row['username']:<20} {row['before']:>8.1f} -> {row['after']:>8.1f}  "
+                f"({row['items_before']} -> {row['items_after']} items)"
+            )
@@ -0,0 +1,60 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from crm.benchmarks import DEFAULT_SIZES, run_benchmark, throwaway_database
+
+
+class Command(BaseCommand):
+    help = 'Measure queries, wall time and memory of every crm endpoint on seeded datasets of growing size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES),
+                            help='Comma separated number of orders to seed (default: 10,1000,50000)')
+        parser.add_argument('--routes', default='', help='Comma separated route names (default: all)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default='',
+                            help='JSON results file (default: benchmarks/endpoints-<timestamp>.json)')
+        parser.add_argument('--compare', default='', help='Previous JSON results to diff against')
+
+    def handle(self, *args, **options):
+        sizes = [int(s) for s in options['sizes'].split(',') if s.strip()]
+        routes = [r.strip() for r in options['routes'].split(',') if r.strip()] or None
+
+        # Never seed the working database: run against a throwaway test database
+        with throwaway_database():
+            report = run_benchmark(sizes, routes=routes, seed=options['seed'], log=self.stdout.write)
+
+        report['generated_at'] = timezone.now().isoformat()
+        output = Path(options['output'] or Path(settings.BASE_DIR) / 'benchmarks' /
+                      f"endpoints-{timezone.now():%Y%m%d-%H%M%S}.json")
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(report, indent=2))
+        self.stdout.write(f'\nResults written to {output}')
+
+        if options['compare']:
+            self.compare(json.loads(Path(options['compare']).read_text()), report)
+
+        if report['failures']:
+            for failure in report['failures']:
+                self.stderr.write(self.style.ERROR(f'  ✗ {failure}'))
+            raise CommandError(f"{len(report['failures'])} endpoint(s) over budget")
+        self.stdout.write(self.style.SUCCESS('✅ All endpoints within query budget'))
+
+    def compare(self, previous, current):
+        self.stdout.write('\nChanges vs previous run (largest common N):')
+        for name, per_size in current['results'].items():
+            before = previous.get('results', {}).get(name, {})
+            common = sorted(set(before) & {str(size) for size in per_size}, key=int)
+            if not common:
+                continue
+            old, new = before[common[-1]], per_size[int(common[-1])]
+            if 'error' in old or 'error' in new:
+                continue
+            self.stdout.write(
+                f"  {name:<28} queries {old['queries']:>4} → {new['queries']:<4} "
+                f"wall {old['wall_ms']:>9.1f} → {new['wall_ms']:.1f} ms"
+            )
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIClient
+
+from crm.benchmarks import compare_renderers, throwaway_database
+from crm.datagen import DatasetGenerator
+
+PAYLOADS = {
+    'kanban': '/api/orders/kanban/',
+    'orders': '/api/orders/',
+    'smart-queue': '/api/smart-queue/',
+}
+
+
+class Command(BaseCommand):
+    help = ('Compare encoding time and wire size (raw, gzip, brotli) of the JSON, orjson and '
+            'MessagePack renderers on real API payloads, using a throwaway seeded database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=2000, help='Orders to seed (default: 2000)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=20, help='Encodings per renderer')
+
+    def handle(self, *args, **options):
+        with throwaway_database():
+            DatasetGenerator(seed=options['seed']).generate(options['orders'])
+            api = APIClient()
+            payloads = {name: api.get(url, HTTP_ACCEPT='application/json').data
+                        for name, url in PAYLOADS.items()}
+
+        for name, data in payloads.items():
+            self.stdout.write(f"\n{name} ({options['orders']} orders)")
+            self.stdout.write(f"  {'renderer':<10}{'encode ms':>11}{'raw KiB':>10}"
+                              f"{'gzip KiB':>10}{'gzip ms':>9}{'br KiB':>9}{'br ms':>8}")
+            for renderer, row in compare_renderers(data, options['repeat']).items():
+                self.stdout.write(
+                    f"  {renderer:<10}{row['encode_ms']:>11.2f}{row['raw_kb']:>10.1f}"
+                    f"{row['gzip_kb']:>10.1f}{row['gzip_ms']:>9.2f}"
+                    f"{row.get('br_kb', 0):>9.1f}{row.get('br_ms', 0):>8.2f}"
+                )
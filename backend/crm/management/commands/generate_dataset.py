@@ -0,0 +1,52 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from crm.datagen import DatasetGenerator
+from crm.models import Client, Order, ServiceItem, Payment, ActivityLog
+
+
+class Command(BaseCommand):
+    help = 'Generate a deterministic, production-sized synthetic dataset (e.g. --orders 1000000 --seed 42)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1000, help='Number of orders to create')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed (same seed, same data)')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Orders written per transaction')
+        parser.add_argument('--now', default='',
+                            help='Reference date (YYYY-MM-DD) for ages and deadlines; default is today')
+        parser.add_argument('--gestores', type=int, default=6)
+        parser.add_argument('--tramitadores', type=int, default=12)
+        parser.add_argument('--flush', action='store_true',
+                            help='Delete all clients, orders, items, payments and logs first')
+
+    def handle(self, *args, **options):
+        if options['orders'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('--orders and --chunk-size must be positive')
+
+        now = None
+        if options['now']:
+            now = timezone.make_aware(datetime.strptime(options['now'], '%Y-%m-%d').replace(hour=12))
+
+        if options['flush']:
+            self.stdout.write('Clearing existing data...')
+            # Children first, so each delete finds nothing left to cascade to
+            for model in (ActivityLog, Payment, ServiceItem, Order, Client):
+                model.objects.all().delete()
+
+        generator = DatasetGenerator(
+            seed=options['seed'], now=now,
+            gestores=options['gestores'], tramitadores=options['tramitadores'],
+        )
+
+        def progress(done, total, elapsed):
+            rate = done / elapsed if elapsed else 0
+            self.stdout.write(f'  {done:>9}/{total} orders  {elapsed:7.1f}s  ({rate:,.0f} orders/s)')
+
+        self.stdout.write(f"Generating {options['orders']} orders (seed={options['seed']})...")
+        counts = generator.generate(options['orders'], chunk_size=options['chunk_size'], progress=progress)
+
+        self.stdout.write(self.style.SUCCESS(
+            '\n✅ Created ' + ', '.join(f'{value} {key}' for key, value in counts.items())
+        ))
@@ -0,0 +1,44 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from crm.benchmarks import throwaway_database
+from crm.index_advisor import advise
+
+
+class Command(BaseCommand):
+    help = 'Explain the queries of every crm endpoint on a seeded dataset and report sequential scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=2000, help='Number of orders to seed')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--table', action='append', default=[], help='Only report scans of this table')
+        parser.add_argument('--plans', action='store_true', help='Print the EXPLAIN plan of each query')
+        parser.add_argument('--output', default='', help='Also write the findings to this JSON file')
+
+    def handle(self, *args, **options):
+        # Never seed the working database: run against a throwaway test database
+        with throwaway_database():
+            findings = advise(orders=options['orders'], seed=options['seed'], log=self.stdout.write)
+        if options['table']:
+            findings = [finding for finding in findings if finding['table'] in options['table']]
+
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(findings, indent=2))
+        if not findings:
+            self.stdout.write(self.style.SUCCESS('No sequential scans'))
+            return
+
+        table = None
+        for finding in findings:
+            if finding['table'] != table:
+                table = finding['table']
+                self.stdout.write(self.style.WARNING(f'\nSequential scans of {table}'))
+            self.stdout.write(f"  {finding['route']}")
+            self.stdout.write(f"    origin: {finding['origin'] or '-'}")
+            self.stdout.write(f"    sql:    {finding['sql']}")
+            if options['plans']:
+                for line in finding['plan'].splitlines():
+                    self.stdout.write(f'      {line}')
+        self.stdout.write(f'\n{len(findings)} sequential scans in {len({f["route"] for f in findings})} requests')
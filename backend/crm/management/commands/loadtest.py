@@ -0,0 +1,87 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.loadtest import LoadTest, PERSONA_WEIGHTS
+from crm.models import Client, Order, ServiceItem
+
+
+class Command(BaseCommand):
+    help = ('Replay a realistic office workload (gestores, tramitadores, payments, carts) against a '
+            'running server and report throughput and latency percentiles per endpoint. '
+            'Creates orders and payments: run it against a disposable dataset (see generate_dataset).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8001/api')
+        parser.add_argument('--concurrency', type=int, default=20, help='Simultaneous virtual users')
+        parser.add_argument('--think-time', type=float, default=1.0,
+                            help='Mean pause between actions of a user, in seconds (exponential)')
+        parser.add_argument('--duration', type=float, default=60, help='Test length in seconds')
+        parser.add_argument('--mix', default=','.join(f'{k}={v}' for k, v in PERSONA_WEIGHTS.items()),
+                            help='Persona weights, e.g. gestor=50,tramitador=30,payment=10,cart=10')
+        parser.add_argument('--sample', type=int, default=500, help='Orders/items sampled as targets')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--header', action='append', default=[],
+                            help='Extra request header "Name: value" (repeatable), e.g. Authorization')
+        parser.add_argument('--output', default='', help='Write the summary as JSON to this file')
+
+    def handle(self, *args, **options):
+        weights = {}
+        for part in options['mix'].split(','):
+            name, _, value = part.partition('=')
+            if name.strip() not in PERSONA_WEIGHTS or not value.strip().isdigit():
+                raise CommandError(f'Invalid --mix entry: {part!r}')
+            weights[name.strip()] = int(value)
+
+        headers = {}
+        for header in options['header']:
+            name, _, value = header.partition(':')
+            headers[name.strip()] = value.strip()
+
+        test = LoadTest(
+            options['base_url'], self.sample_fixtures(options['sample']),
+            concurrency=options['concurrency'], think_time=options['think_time'],
+            duration=options['duration'], weights=weights, seed=options['seed'], headers=headers,
+        )
+        self.stdout.write(
+            f"Running {options['concurrency']} users for {options['duration']:.0f}s "
+            f"against {options['base_url']} (mix: {options['mix']})..."
+        )
+        summary = test.run()
+        self.print_summary(summary)
+
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(summary, indent=2))
+            self.stdout.write(f"\nSummary written to {options['output']}")
+
+    def sample_fixtures(self, size):
+        """Ids of open orders/items and clients from the database the server uses"""
+        open_items = ServiceItem.objects.exclude(status__in=['READY', 'DELIVERED']).order_by('-id')[:size]
+        return {
+            'orders': list(Order.objects.exclude(global_status='CLOSED')
+                           .order_by('-id').values_list('id', flat=True)[:size]),
+            'clients': list(Client.objects.order_by('-id').values_list('id', flat=True)[:size]),
+            'items': [{'id': item.id, 'phases': item.get_workflow_phases()} for item in open_items],
+        }
+
+    def print_summary(self, summary):
+        self.stdout.write('')
+        self.stdout.write(f"{'endpoint':<44}{'req':>7}{'err':>6}{'rps':>8}"
+                          f"{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}{'max':>9}{'KiB':>8}")
+        for endpoint, row in summary['endpoints'].items():
+            self.stdout.write(
+                f"{endpoint:<44}{row['requests']:>7}{row['errors']:>6}{row['rps']:>8.1f}"
+                f"{row['p50_ms']:>9.0f}{row['p90_ms']:>9.0f}{row['p95_ms']:>9.0f}"
+                f"{row['p99_ms']:>9.0f}{row['max_ms']:>9.0f}{row['avg_kb']:>8.1f}"
+            )
+        self.stdout.write('')
+        style = self.style.ERROR if summary['errors'] else self.style.SUCCESS
+        self.stdout.write(style(
+            f"{summary['requests']} requests in {summary['elapsed_s']}s: "
+            f"{summary['rps']} req/s, {summary['errors']} errors"
+        ))
+        # Little's law: busy workers needed = throughput x mean service time
+        busy = sum(row['rps'] * row['mean_ms'] / 1000 for row in summary['endpoints'].values())
+        self.stdout.write(f'Average requests in flight: {busy:.1f} '
+                          f'(sync gunicorn workers needed to avoid queueing at this load)')
@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
-from django.contrib.auth.models import User
+from django.conf import settings
+from django.contrib.auth.models import Group, User
 from crm.models import Client, Order, ServiceItem, Payment, ActivityLog
 from decimal import Decimal
 from django.utils import timezone
@@ -40,6 +41,7 @@ class Command(BaseCommand):
             username='tramitador1',
             defaults={'first_name': 'Ana', 'last_name': 'Martínez', 'email': 'ana@hol-crm.com'}
         )
+        Group.objects.get_or_create(name=settings.TRAMITADOR_GROUP)[0].user_set.add(tramitador1)
         
         # Create clients
         self.stdout.write('Creating clients...')
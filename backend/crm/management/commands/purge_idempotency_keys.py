@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from crm.idempotency import purge_expired_keys
+
+
+class Command(BaseCommand):
+    help = 'Delete the stored Idempotency-Key responses past their TTL'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{purge_expired_keys()} expired idempotency keys purged')
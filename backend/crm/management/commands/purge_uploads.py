@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from crm.files import purge_stale_uploads
+
+
+class Command(BaseCommand):
+    help = 'Abort resumable uploads left unfinished and delete their partial files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=settings.UPLOAD_EXPIRY_HOURS,
+                            help='Untouched for at least this many hours (default: UPLOAD_EXPIRY_HOURS)')
+
+    def handle(self, *args, **options):
+        purged = purge_stale_uploads(options['hours'])
+        self.stdout.write(f'{purged} abandoned uploads purged')
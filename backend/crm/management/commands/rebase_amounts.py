@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from crm import fx
+
+
+class Command(BaseCommand):
+    help = 'Fill in the base currency amounts of orders and payments (crm.fx) from the exchange rates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Recompute every amount, not only those still missing (after correcting a rate)')
+
+    def handle(self, *args, **options):
+        written = fx.rebase(only_missing=not options['all'])
+        self.stdout.write(f'{written} rows updated to {fx.base_currency()}')
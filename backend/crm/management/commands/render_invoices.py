@@ -0,0 +1,73 @@
+import multiprocessing
+import os
+import time
+from datetime import date, datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from crm.invoices import render_invoices
+from crm.jobs import enqueue
+from crm.models import Order
+from crm.tasks import render_invoice_batch
+
+
+def _render_chunk(order_ids):
+    return render_invoices(order_ids)
+
+
+class Command(BaseCommand):
+    help = 'Render the invoices of a month in parallel processes (stored invoices are skipped)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help='YYYY-MM of the orders to invoice (default: last month)')
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--chunk-size', type=int, default=200, help='Orders per process task')
+        parser.add_argument('--enqueue', action='store_true',
+                            help='Queue one job per chunk for run_workers instead of rendering here')
+
+    def handle(self, *args, **options):
+        start, end = self.month_bounds(options['month'])
+        order_ids = list(Order.objects.filter(created_at__gte=start, created_at__lt=end, items__isnull=False)
+                         .distinct().order_by('pk').values_list('pk', flat=True))
+        size = options['chunk_size']
+        chunks = [order_ids[n:n + size] for n in range(0, len(order_ids), size)]
+        self.stdout.write(f'{len(order_ids)} orders from {start:%Y-%m-%d} to {end:%Y-%m-%d}, {len(chunks)} chunks')
+
+        if options['enqueue']:
+            for chunk in chunks:
+                enqueue(render_invoice_batch, order_ids=chunk)
+            self.stdout.write(self.style.SUCCESS(f'{len(chunks)} jobs queued'))
+            return
+
+        started = time.monotonic()
+        rendered = cached = 0
+        if options['processes'] <= 1:
+            results = map(_render_chunk, chunks)
+        else:
+            # Children must not share the parent's database connections
+            connections.close_all()
+            pool = multiprocessing.get_context('fork').Pool(options['processes'])
+            results = pool.imap_unordered(_render_chunk, chunks)
+        for chunk_rendered, chunk_cached in results:
+            rendered += chunk_rendered
+            cached += chunk_cached
+        if options['processes'] > 1:
+            pool.close()
+            pool.join()
+        self.stdout.write(self.style.SUCCESS(
+            f'{rendered} invoices rendered, {cached} already stored, in {time.monotonic() - started:.1f}s'))
+
+    def month_bounds(self, month):
+        if month:
+            try:
+                first = date.fromisoformat(f'{month}-01')
+            except ValueError:
+                raise CommandError('--month must be YYYY-MM')
+        else:
+            today = timezone.localdate()
+            first = (today.replace(day=1) - timedelta(days=1)).replace(day=1)
+        following = (first.replace(day=28) + timedelta(days=4)).replace(day=1)
+        return (timezone.make_aware(datetime.combine(first, datetime.min.time())),
+                timezone.make_aware(datetime.combine(following, datetime.min.time())))
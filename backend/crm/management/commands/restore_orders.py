@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from crm.archive import restore_orders
+from crm.models import ArchivedOrder
+
+
+class Command(BaseCommand):
+    help = 'Move archived orders back to the operational tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('orders', nargs='+', help='Order ids or friendly ids')
+
+    def handle(self, *args, **options):
+        ids = [value for value in options['orders'] if value.isdigit()]
+        pks = set(ArchivedOrder.objects.filter(
+            Q(pk__in=ids) | Q(order_friendly_id__in=options['orders'])).values_list('pk', flat=True))
+        if not pks:
+            raise CommandError('No archived order matches')
+        restored = restore_orders(pks)
+        self.stdout.write(f"{len(restored)} orders restored: {', '.join(map(str, sorted(restored)))}")
@@ -0,0 +1,69 @@
+import multiprocessing
+import signal
+from multiprocessing.connection import wait
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from crm.jobs import Worker
+
+
+def _work(name, poll_interval, burst):
+    worker = Worker(name=name, poll_interval=poll_interval, burst=burst)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run()
+
+
+class Command(BaseCommand):
+    help = 'Run background job workers (crm.jobs)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1, help='Number of worker processes')
+        parser.add_argument('--poll-interval', type=float, default=None,
+                            help='Seconds between polls when the queue is empty (default JOB_POLL_INTERVAL)')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        concurrency, poll_interval, burst = options['concurrency'], options['poll_interval'], options['burst']
+        if concurrency <= 1:
+            worker = Worker(poll_interval=poll_interval, burst=burst)
+            signal.signal(signal.SIGTERM, worker.stop)
+            signal.signal(signal.SIGINT, worker.stop)
+            self.stdout.write(f'Worker {worker.name} started')
+            worker.run()
+            self.stdout.write(f'{worker.processed} jobs processed')
+            return
+
+        # Children must not share the parent's database connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        stopping = False
+
+        def spawn(index):
+            process = context.Process(target=_work, args=(None, poll_interval, burst), name=f'crm-worker-{index}')
+            process.start()
+            return process
+
+        def stop(*args):
+            nonlocal stopping
+            stopping = True
+            for process in processes.values():
+                if process.is_alive():
+                    process.terminate()  # SIGTERM: finish the current job first
+
+        processes = {index: spawn(index) for index in range(concurrency)}
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        self.stdout.write(f'{concurrency} workers started')
+
+        while processes:
+            wait([process.sentinel for process in processes.values()])
+            for index, process in list(processes.items()):
+                if process.is_alive():
+                    continue
+                process.join()
+                del processes[index]
+                if not stopping and not burst:
+                    self.stderr.write(f'Worker {process.pid} exited with {process.exitcode}, restarting')
+                    processes[index] = spawn(index)
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, FloatField, ExpressionWrapper
+from crm.models import SlowQuery
+
+
+class Command(BaseCommand):
+    help = 'List the worst slow queries recorded by SlowQueryMiddleware'
+
+    ORDERINGS = {
+        'max': '-max_duration_ms',
+        'total': '-total_duration_ms',
+        'calls': '-calls',
+        'avg': '-avg_ms',
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20, help='Number of fingerprints to show')
+        parser.add_argument('--order-by', choices=sorted(self.ORDERINGS), default='total',
+                            help='Rank by max, total or average duration, or by number of calls')
+        parser.add_argument('--plans', action='store_true', help='Print the EXPLAIN plan of each query')
+        parser.add_argument('--clear', action='store_true', help='Delete all recorded slow queries')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            deleted, _ = SlowQuery.objects.all().delete()
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} slow queries'))
+            return
+
+        queries = SlowQuery.objects.annotate(
+            avg_ms=ExpressionWrapper(F('total_duration_ms') / F('calls'), output_field=FloatField())
+        ).order_by(self.ORDERINGS[options['order_by']])[:options['limit']]
+
+        if not queries:
+            self.stdout.write('No slow queries recorded.')
+            return
+
+        for rank, query in enumerate(queries, start=1):
+            self.stdout.write(self.style.WARNING(
+                f"#{rank}  max {query.max_duration_ms:.1f}ms  avg {query.avg_ms:.1f}ms  "
+                f"total {query.total_duration_ms:.1f}ms  calls {query.calls}"
+            ))
+            self.stdout.write(f"    view:   {query.view_name or '-'}")
+            self.stdout.write(f"    origin: {query.origin or '-'}")
+            self.stdout.write(f"    sql:    {query.normalized_sql}")
+            if options['plans'] and query.plan:
+                for line in query.plan.splitlines():
+                    self.stdout.write(f"      {line}")
+            self.stdout.write('')
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from crm import analytics
+
+
+class Command(BaseCommand):
+    help = 'Export the service item facts to a new columnar snapshot for /api/analytics/ (run nightly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--directory', default=None,
+                            help='Snapshot directory (default: ANALYTICS_SNAPSHOT_DIR)')
+
+    def handle(self, *args, **options):
+        manifest = analytics.take_snapshot(options['directory'])
+        self.stdout.write(f"Snapshot {manifest['name']}: {manifest['rows']} items, "
+                          f"{manifest['unconverted']} without a rate to {manifest['base_currency']}")
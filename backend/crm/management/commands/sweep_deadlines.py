@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from crm.deadlines import sweep_overdue
+
+
+class Command(BaseCommand):
+    help = 'Escalate open service items past their deadline (overdue flags and activity log)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep running, sweeping every INTERVAL seconds')
+        parser.add_argument('--batch-size', type=int, default=500, help='Items updated per transaction')
+
+    def handle(self, *args, **options):
+        while True:
+            swept = sweep_overdue(batch_size=options['batch_size'])
+            if swept or not options['interval']:
+                self.stdout.write(f'{swept} items escalated as overdue')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,106 @@
+import gzip
+import re
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+from .slow_queries import capture_slow_queries
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+
+class SlowQueryMiddleware:
+    """
+    Time every query issued while handling a request and record the slow ones
+    (see crm.slow_queries). Runs outside ATOMIC_REQUESTS so the records survive
+    a rolled back request.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with capture_slow_queries() as recorder:
+            response = self.get_response(request)
+            if recorder is not None:
+                match = getattr(request, 'resolver_match', None)
+                recorder.view_name = match.view_name if match else request.path[:100]
+        return response
+
+
+def parse_accept_encoding(header):
+    """{'br': 1.0, 'gzip': 0.8, ...} from an Accept-Encoding header"""
+    codings = {}
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        match = re.search(r'q=([0-9.]+)', params)
+        if match:
+            try:
+                quality = float(match.group(1))
+            except ValueError:
+                quality = 0.0
+        codings[name] = quality
+    return codings
+
+
+class CompressionMiddleware:
+    """
+    Brotli/gzip compression of API responses negotiated from Accept-Encoding.
+    Only compressible content types above RESPONSE_COMPRESSION_MIN_SIZE bytes are
+    compressed; brotli wins over gzip when the client accepts both equally.
+    """
+    COMPRESSIBLE_TYPES = ('application/json', 'application/msgpack', 'text/', 'application/javascript')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        content_type = response.get('Content-Type', '')
+        if not content_type.startswith(self.COMPRESSIBLE_TYPES):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if len(response.content) < getattr(settings, 'RESPONSE_COMPRESSION_MIN_SIZE', 1024):
+            return response
+
+        coding = self.choose_coding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if coding is None:
+            return response
+
+        if coding == 'br':
+            quality = getattr(settings, 'RESPONSE_COMPRESSION_BROTLI_QUALITY', 4)
+            compressed = brotli.compress(response.content, quality=quality)
+        else:
+            level = getattr(settings, 'RESPONSE_COMPRESSION_GZIP_LEVEL', 6)
+            compressed = gzip.compress(response.content, compresslevel=level, mtime=0)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(compressed))
+        response.headers['Content-Encoding'] = coding
+        # The compressed body is a different representation of the resource
+        if response.has_header('ETag'):
+            response.headers['ETag'] = re.sub(r'^"', 'W/"', response.headers['ETag'])
+        return response
+
+    def choose_coding(self, header):
+        codings = parse_accept_encoding(header)
+        wildcard = codings.get('*', 0.0)
+        candidates = ['br', 'gzip'] if brotli is not None else ['gzip']
+        best, best_quality = None, 0.0
+        for coding in candidates:
+            quality = codings.get(coding, wildcard)
+            if quality > best_quality:
+                best, best_quality = coding, quality
+        return best
@@ -0,0 +1,36 @@
+# Generated by Django 6.0 on 2026-10-19 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0008_serviceitem_delivery_destination_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=40, unique=True)),
+                ('normalized_sql', models.TextField()),
+                ('sample_sql', models.TextField(help_text='SQL de la ejecución más lenta')),
+                ('sample_params', models.JSONField(blank=True, default=list)),
+                ('plan', models.TextField(blank=True, help_text='Salida de EXPLAIN de la ejecución más lenta')),
+                ('origin', models.CharField(blank=True, help_text='Frame de la app que lanzó la consulta', max_length=255)),
+                ('view_name', models.CharField(blank=True, max_length=100)),
+                ('calls', models.PositiveIntegerField(default=0)),
+                ('total_duration_ms', models.FloatField(default=0)),
+                ('max_duration_ms', models.FloatField(default=0)),
+                ('first_seen', models.DateTimeField(auto_now_add=True)),
+                ('last_seen', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Consulta Lenta',
+                'verbose_name_plural': 'Consultas Lentas',
+                'ordering': ['-max_duration_ms'],
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 6.0 on 2026-10-19 15:14
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_urgency(apps, schema_editor):
+    ServiceItem = apps.get_model('crm', 'ServiceItem')
+    # The queue is paginated on (urgency, deadline, id): fill the deadlines
+    # ServiceItem.save() would have set
+    for item in ServiceItem.objects.filter(deadline__isnull=True).only('priority', 'created_at'):
+        days = 3 if item.priority == 'EXPRESS' else 15
+        ServiceItem.objects.filter(pk=item.pk).update(deadline=item.created_at + timezone.timedelta(days=days))
+    ServiceItem.objects.filter(priority='EXPRESS').update(urgency=2)
+    ServiceItem.objects.filter(deadline__lt=timezone.now()).update(urgency=3)
+    ServiceItem.objects.filter(status__in=['READY', 'DELIVERED']).update(urgency=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0009_slowquery'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='serviceitem',
+            name='urgency',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Cerrado'), (1, 'Normal'), (2, 'Express'), (3, 'Vencido')], default=1, editable=False),
+        ),
+        migrations.RunPython(backfill_urgency, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='serviceitem',
+            index=models.Index(condition=models.Q(('urgency__gt', 0)), fields=['-urgency', 'deadline', 'id'], name='crm_item_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='serviceitem',
+            index=models.Index(condition=models.Q(('urgency__gt', 0)), fields=['assigned_tramitador', '-urgency', 'deadline', 'id'], name='crm_item_queue_tram_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='serviceitem',
+            index=models.Index(condition=models.Q(('urgency__gt', 0)), fields=['current_location', '-urgency', 'deadline', 'id'], name='crm_item_queue_loc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='serviceitem',
+            index=models.Index(condition=models.Q(('urgency__in', [1, 2])), fields=['deadline'], name='crm_item_due_idx'),
+        ),
+    ]
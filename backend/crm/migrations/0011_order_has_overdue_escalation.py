@@ -0,0 +1,38 @@
+# Generated by Django 6.0 on 2026-10-19 15:19
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_overdue(apps, schema_editor):
+    ServiceItem = apps.get_model('crm', 'ServiceItem')
+    Order = apps.get_model('crm', 'Order')
+    ServiceItem.objects.filter(urgency__in=[1, 2], deadline__lt=timezone.now()).update(urgency=3)
+    Order.objects.filter(pk__in=ServiceItem.objects.filter(urgency=3).values('order_id')).update(has_overdue=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0010_serviceitem_urgency'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='has_overdue',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='activitylog',
+            name='action_type',
+            field=models.CharField(choices=[('STATUS_CHANGE', 'Cambio de Estado'), ('PAYMENT', 'Registro de Pago'), ('EMAIL', 'Email Enviado'), ('NOTE', 'Nota Añadida'), ('ASSIGNMENT', 'Asignación'), ('DOCUMENT_UPLOAD', 'Documento Subido'), ('SERVICE_ADDED', 'Servicio Añadido'), ('ESCALATION', 'Escalado por Vencimiento')], max_length=20),
+        ),
+        migrations.RunPython(backfill_overdue, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('has_overdue', True)), fields=['-created_at'], name='crm_order_overdue_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 6.0 on 2026-10-19 15:21
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0011_order_has_overdue_escalation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(help_text='Ruta de la función, p. ej. crm.tasks.send_payment_request', max_length=200)),
+                ('kwargs', models.JSONField(blank=True, default=dict)),
+                ('status', models.CharField(choices=[('QUEUED', 'En Cola'), ('RUNNING', 'En Ejecución'), ('DONE', 'Completada'), ('FAILED', 'Fallida'), ('CANCELLED', 'Cancelada')], default='QUEUED', max_length=10)),
+                ('priority', models.SmallIntegerField(default=0, help_text='Mayor primero')),
+                ('run_at', models.DateTimeField(default=django.utils.timezone.now, help_text='No antes de esta fecha (reintentos con espera)')),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('max_attempts', models.PositiveSmallIntegerField(default=3)),
+                ('dedupe_key', models.CharField(blank=True, help_text='Como mucho una tarea en cola con la misma clave', max_length=200, null=True)),
+                ('worker', models.CharField(blank=True, max_length=100)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Tarea en Segundo Plano',
+                'verbose_name_plural': 'Tareas en Segundo Plano',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(condition=models.Q(('status', 'QUEUED')), fields=['-priority', 'run_at', 'id'], name='crm_job_queue_idx'), models.Index(condition=models.Q(('status', 'RUNNING')), fields=['started_at'], name='crm_job_running_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status', 'QUEUED')), fields=('dedupe_key',), name='crm_job_queued_dedupe')],
+            },
+        ),
+    ]
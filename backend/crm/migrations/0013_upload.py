@@ -0,0 +1,40 @@
+# Generated by Django 6.0 on 2026-10-19 15:29
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0012_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Upload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('target', models.CharField(choices=[('FINAL_DOCUMENT', 'Documento Final'), ('PAYMENT_PROOF', 'Justificante de Pago')], max_length=20)),
+                ('object_id', models.PositiveBigIntegerField(help_text='Servicio o pago al que se adjunta')),
+                ('filename', models.CharField(max_length=255)),
+                ('size', models.PositiveBigIntegerField(help_text='Tamaño total en bytes')),
+                ('sha256', models.CharField(blank=True, help_text='Hash del archivo completo (opcional al crearla)', max_length=64)),
+                ('received', models.PositiveBigIntegerField(default=0, help_text='Bytes recibidos de forma contigua')),
+                ('status', models.CharField(choices=[('OPEN', 'En Curso'), ('COMPLETE', 'Completada'), ('ABORTED', 'Cancelada')], default='OPEN', max_length=10)),
+                ('stored_name', models.CharField(blank=True, help_text='Archivo almacenado al completarla', max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='uploads', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Subida por Partes',
+                'verbose_name_plural': 'Subidas por Partes',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(condition=models.Q(('status', 'OPEN')), fields=['updated_at'], name='crm_upload_open_idx')],
+            },
+        ),
+    ]
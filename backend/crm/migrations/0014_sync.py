@@ -0,0 +1,43 @@
+# Generated by Django 6.0 on 2026-10-19 16:02
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0013_upload'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='serviceitem',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.CreateModel(
+            name='SyncMutation',
+            fields=[
+                ('id', models.UUIDField(help_text='Generado por el cliente', primary_key=True, serialize=False)),
+                ('device', models.CharField(blank=True, max_length=100)),
+                ('kind', models.CharField(max_length=30)),
+                ('status', models.CharField(choices=[('APPLIED', 'Aplicada'), ('CONFLICT', 'Conflicto'), ('REJECTED', 'Rechazada')], max_length=10)),
+                ('result', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sync_mutations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Cambio Sincronizado',
+                'verbose_name_plural': 'Cambios Sincronizados',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
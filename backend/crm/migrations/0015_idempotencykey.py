@@ -0,0 +1,33 @@
+# Generated by Django 6.0 on 2026-10-19 16:40
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0014_sync'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255)),
+                ('scope', models.CharField(help_text='Usuario que envió la clave', max_length=50)),
+                ('fingerprint', models.CharField(help_text='SHA-256 del método, la ruta y el cuerpo', max_length=64)),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, help_text='Vacío mientras se procesa', null=True)),
+                ('response', models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, help_text='Cuerpo y cabeceras de la respuesta', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Clave de Idempotencia',
+                'verbose_name_plural': 'Claves de Idempotencia',
+                'indexes': [models.Index(fields=['expires_at'], name='crm_idempotency_expiry_idx')],
+                'constraints': [models.UniqueConstraint(fields=('scope', 'key'), name='crm_idempotency_key_unique')],
+            },
+        ),
+    ]
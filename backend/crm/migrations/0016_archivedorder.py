@@ -0,0 +1,37 @@
+# Generated by Django 6.0 on 2026-10-19 17:15
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0015_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(help_text='Id de la orden original', primary_key=True, serialize=False)),
+                ('order_friendly_id', models.CharField(max_length=100, unique=True)),
+                ('currency', models.CharField(choices=[('EUR', 'Euro'), ('USD', 'US Dollar'), ('CUP', 'Peso Cubano')], max_length=3)),
+                ('total_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('total_paid', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_at', models.DateTimeField()),
+                ('closed_at', models.DateTimeField(help_text='Última modificación antes de archivarla')),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('rows', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, help_text='Filas originales (orden, servicios, pagos y actividad) para restaurarla')),
+                ('detail', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, help_text='Detalle de la orden tal como lo devolvía la API')),
+                ('portal', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, help_text='La orden tal como la ve el portal del cliente')),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_orders', to='crm.client')),
+            ],
+            options={
+                'verbose_name': 'Orden Archivada',
+                'verbose_name_plural': 'Órdenes Archivadas',
+                'ordering': ['-closed_at'],
+            },
+        ),
+    ]
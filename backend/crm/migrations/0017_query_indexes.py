@@ -0,0 +1,42 @@
+# Generated by Django 6.0 on 2026-10-19 17:52
+
+from django.conf import settings
+from django.db import migrations, models
+
+import crm.indexes
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run in a transaction (crm.indexes)
+    atomic = False
+
+    dependencies = [
+        ('crm', '0016_archivedorder'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        crm.indexes.AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['global_status', '-created_at'], name='crm_order_board_idx'),
+        ),
+        crm.indexes.AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(condition=models.Q(('total_paid__lt', models.F('total_amount'))), fields=['-created_at'], name='crm_order_debt_idx'),
+        ),
+        crm.indexes.AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['status'], name='crm_order_status_idx'),
+        ),
+        crm.indexes.AddIndexConcurrently(
+            model_name='serviceitem',
+            index=models.Index(fields=['deadline', 'status'], name='crm_item_deadline_idx'),
+        ),
+        crm.indexes.AddIndexConcurrently(
+            model_name='serviceitem',
+            index=models.Index(condition=models.Q(('priority', 'EXPRESS')), fields=['order'], name='crm_item_express_idx'),
+        ),
+        crm.indexes.AddIndexConcurrently(
+            model_name='serviceitem',
+            index=models.Index(fields=['current_location', 'order'], name='crm_item_location_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 6.0 on 2026-10-19 18:27
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_balance_due(apps, schema_editor):
+    Order = apps.get_model('crm', 'Order')
+    Order.objects.exclude(total_paid=models.F('total_amount')).update(
+        balance_due=models.F('total_amount') - models.F('total_paid'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0017_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='balance_due',
+            field=models.DecimalField(decimal_places=2, default=0.0, editable=False, help_text='Saldo pendiente de cobro', max_digits=10),
+        ),
+        migrations.RunPython(backfill_balance_due, migrations.RunPython.noop),
+    ]
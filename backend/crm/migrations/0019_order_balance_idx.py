@@ -0,0 +1,25 @@
+# Generated by Django 6.0 on 2026-10-19 18:27
+
+from django.db import migrations, models
+
+import crm.indexes
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run in a transaction (crm.indexes)
+    atomic = False
+
+    dependencies = [
+        ('crm', '0018_order_balance_due'),
+    ]
+
+    operations = [
+        crm.indexes.AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(condition=models.Q(('balance_due__gt', 0)), fields=['-created_at'], name='crm_order_balance_idx'),
+        ),
+        crm.indexes.RemoveIndexConcurrently(
+            model_name='order',
+            name='crm_order_debt_idx',
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 6.0 on 2026-10-19 19:04
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_base_currency(apps, schema_editor):
+    # Other currencies wait for their rates (python manage.py rebase_amounts)
+    Order = apps.get_model('crm', 'Order')
+    Payment = apps.get_model('crm', 'Payment')
+    base = settings.FX_BASE_CURRENCY
+    Order.objects.filter(currency=base).update(
+        total_amount_base=models.F('total_amount'), total_margin_base=models.F('total_margin'),
+        balance_due_base=models.F('balance_due'))
+    Payment.objects.filter(currency=base).update(amount_base=models.F('amount'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0019_order_balance_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='balance_due_base',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_amount_base',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_margin_base',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='amount_base',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=12, null=True),
+        ),
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(choices=[('EUR', 'Euro'), ('USD', 'US Dollar'), ('CUP', 'Peso Cubano')], max_length=3)),
+                ('rate', models.DecimalField(decimal_places=8, help_text='Unidades de la moneda base por unidad', max_digits=18)),
+                ('effective_date', models.DateField(help_text='Vigente desde este día hasta el siguiente tipo de la moneda')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Tipo de Cambio',
+                'verbose_name_plural': 'Tipos de Cambio',
+                'ordering': ['currency', '-effective_date'],
+                'constraints': [models.UniqueConstraint(fields=('currency', 'effective_date'), name='crm_fx_rate_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_base_currency, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,83 @@
-from django.db import models
+from contextlib import contextmanager
+from decimal import Decimal
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, router
+from django.db.models.functions import Round
 from django.utils import timezone
+import logging
+import threading
 import uuid
 
+from . import fragments, fx
+
+logger = logging.getLogger(__name__)
+
+_deferred = threading.local()
+
+@contextmanager
+def deferred_totals():
+    """
+    Coalesce the order recalculations triggered by item and payment writes
+    (crm.batch): inside the block they only note the order, and on exit every
+    order noted is recalculated once, totals and payment status together.
+    Nested blocks join the outer one; nothing is recalculated if it raises.
+    """
+    if getattr(_deferred, 'orders', None) is not None:
+        yield _deferred.orders
+        return
+    _deferred.orders = pending = set()
+    try:
+        yield pending
+    finally:
+        _deferred.orders = None
+    for order in Order.objects.filter(pk__in=pending).prefetch_related('items', 'payments'):
+        order.update_financials()
+
+def _defer(order_id):
+    """Note the order for the enclosing deferred_totals() block, if any"""
+    pending = getattr(_deferred, 'orders', None)
+    if pending is None:
+        return False
+    pending.add(order_id)
+    return True
+
+class VersionConflict(Exception):
+    """save(expected_version=n) found the row at another version"""
+
+class OptimisticLocking:
+    """
+    For models with a `version` column incremented by every write:
+    save(expected_version=n, update_fields=[...]) writes with
+    UPDATE ... SET version = version + 1 WHERE id = ? AND version = n and
+    raises VersionConflict when another write got there first, without
+    locking the row meanwhile.
+    """
+
+    def save(self, *args, expected_version=None, **kwargs):
+        if expected_version is None or self._state.adding:
+            return super().save(*args, **kwargs)
+
+        model = type(self)
+        using = kwargs.get('using') or router.db_for_write(model, instance=self)
+        update_fields = kwargs.get('update_fields')
+        update_fields = None if update_fields is None else frozenset(update_fields)
+        fields = [field for field in self._meta.concrete_fields
+                  if not field.primary_key and field.name != 'version'
+                  and (update_fields is None or field.name in update_fields or field.attname in update_fields)]
+
+        models.signals.pre_save.send(sender=model, instance=self, raw=False, using=using,
+                                     update_fields=update_fields)
+        # pre_save() fills in the auto_now timestamps, as Model.save() does
+        values = {field.attname: field.pre_save(self, False) for field in fields}
+        updated = model._default_manager.using(using).filter(pk=self.pk, version=expected_version).update(
+            **values, version=models.F('version') + 1)
+        if not updated:
+            # The row is at another version (or gone)
+            raise VersionConflict(f'{model.__name__} {self.pk} is no longer at version {expected_version}')
+        self.version = expected_version + 1
+        models.signals.post_save.send(sender=model, instance=self, created=False, raw=False, using=using,
+                                      update_fields=update_fields)
+
 class Client(models.Model):
     full_name = models.CharField(max_length=255)
     email = models.EmailField(unique=True)
@@ -11,10 +87,15 @@ class Client(models.Model):
     is_collaborator = models.BooleanField(default=False, help_text="Es un socio comercial con precios preferenciales?")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Order fragments embed the client's name and details
+        fragments.bump(Order, *self.orders.values_list('pk', flat=True))
+
     def __str__(self):
         return f"{self.full_name} ({'Colaborador' if self.is_collaborator else 'Cliente'})"
 
-class Order(models.Model):
+class Order(OptimisticLocking, models.Model):
     STATUS_CHOICES = [
         ('PENDING', 'Pendiente'),
         ('PROCESSING', 'En Proceso'),
@@ -62,26 +143,120 @@ class Order(models.Model):
     total_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     total_margin = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     total_paid = models.DecimalField(max_digits=10, decimal_places=2, default=0.00, help_text="Total pagado por el cliente")
+    # total_amount - total_paid, written with them (?with_debt=, aging report in crm.receivables)
+    balance_due = models.DecimalField(max_digits=10, decimal_places=2, default=0.00, editable=False,
+                                      help_text="Saldo pendiente de cobro")
+    # The same in FX_BASE_CURRENCY at the rate of the order's day (crm.fx), NULL without a rate
+    total_amount_base = models.DecimalField(max_digits=12, decimal_places=2, null=True, editable=False)
+    total_margin_base = models.DecimalField(max_digits=12, decimal_places=2, null=True, editable=False)
+    balance_due_base = models.DecimalField(max_digits=12, decimal_places=2, null=True, editable=False)
+
+    # Some open item is overdue: kept by update_totals() and the deadline sweeper
+    has_overdue = models.BooleanField(default=False, editable=False)
+
+    # Incremented by every write to the row, totals included (sync conflicts, optimistic locking)
+    version = models.PositiveIntegerField(default=1, editable=False)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     notes = models.TextField(blank=True)
 
-    def update_totals(self):
+    class Meta:
+        indexes = [
+            # Kanban ?overdue= filter, newest first
+            models.Index(fields=['-created_at'], name='crm_order_overdue_idx', condition=models.Q(has_overdue=True)),
+            # Kanban columns, newest first
+            models.Index(fields=['global_status', '-created_at'], name='crm_order_board_idx'),
+            # Orders with a balance: kanban ?with_debt= and the aging report
+            models.Index(fields=['-created_at'], name='crm_order_balance_idx', condition=models.Q(balance_due__gt=0)),
+            # Dashboard counters
+            models.Index(fields=['status'], name='crm_order_status_idx'),
+        ]
+
+    @staticmethod
+    def payment_status_for(total_paid, total_amount):
+        if total_paid >= total_amount:
+            return 'PAID'
+        return 'PARTIAL' if total_paid > 0 else 'PENDING'
+
+    def paid_in_currency(self, payments):
         """
-        Recalculate totals based on child items.
+        Sum of `payments` in the order's currency, each converted at the rate
+        of its day (or the nearest one). A payment in a currency without any
+        rate counts its raw amount, as before crm.fx, and is logged.
+        """
+        total = Decimal('0.00')
+        for payment in payments:
+            try:
+                total += fx.convert_nearest(payment.amount, payment.currency, self.currency, payment.payment_date)
+            except fx.MissingRate as exc:
+                logger.warning('Payment #%s of order #%s counted unconverted: %s', payment.pk, self.pk, exc)
+                total += Decimal(str(payment.amount))
+        return total
+
+    def base_amounts(self, balance_due=None):
         """
-        items = self.items.all()
+        The *_base columns for the current totals (crm.fx). `balance_due` may
+        be an expression over the row, such as F('total_amount') - paid.
+        """
+        rate = fx.rate(self.currency, self.created_at)
+        if rate is None:
+            return dict.fromkeys(('total_amount_base', 'total_margin_base', 'balance_due_base'))
+        amounts = {'total_amount_base': self.total_amount, 'total_margin_base': self.total_margin,
+                   'balance_due_base': self.balance_due if balance_due is None else balance_due}
+        return {name: Round(value * rate, 2) if hasattr(value, 'resolve_expression') else
+                fx.to_base(value, self.currency, self.created_at) for name, value in amounts.items()}
+
+    def _set_totals(self, items):
         self.total_amount = sum(item.price for item in items)
         self.total_cost = sum(item.cost for item in items)
         self.total_margin = sum(item.margin for item in items)
+        self.has_overdue = any(item.urgency == ServiceItem.URGENCY_OVERDUE for item in items)
+        self.updated_at = timezone.now()
+
+    def update_totals(self):
+        """
+        Recalculate totals based on child items.
+        """
+        if _defer(self.pk):
+            return
+        self._set_totals(self.items.all())
+        self.version += 1
         # Use update to avoid triggering save signal recursion
+        balance_due = self.total_amount - models.F('total_paid')
         Order.objects.filter(pk=self.pk).update(
             total_amount=self.total_amount,
             total_cost=self.total_cost,
-            total_margin=self.total_margin
+            total_margin=self.total_margin,
+            balance_due=balance_due,
+            **self.base_amounts(balance_due),
+            has_overdue=self.has_overdue,
+            updated_at=self.updated_at,
+            version=models.F('version') + 1,
         )
+        fragments.bump(Order, self.pk)
+
+    def update_financials(self):
+        """update_totals() and the payment totals in one UPDATE (end of a deferred_totals() block)"""
+        self._set_totals(self.items.all())
+        self.total_paid = self.paid_in_currency(self.payments.all())
+        self.payment_status = self.payment_status_for(self.total_paid, self.total_amount)
+        self.balance_due = self.total_amount - self.total_paid
+        self.version += 1
+        Order.objects.filter(pk=self.pk).update(
+            total_amount=self.total_amount,
+            total_cost=self.total_cost,
+            total_margin=self.total_margin,
+            has_overdue=self.has_overdue,
+            total_paid=self.total_paid,
+            balance_due=self.balance_due,
+            **self.base_amounts(),
+            payment_status=self.payment_status,
+            updated_at=self.updated_at,
+            version=models.F('version') + 1,
+        )
+        fragments.bump(Order, self.pk)
 
     def save(self, *args, **kwargs):
         if not self.order_friendly_id:
@@ -90,14 +265,28 @@ class Order(models.Model):
             clean_name = self.client.full_name.replace(' ', '').upper()[:5]
             short_uuid = str(uuid.uuid4())[:4].upper()
             self.order_friendly_id = f"{clean_name}_{date_str}_{short_uuid}"
+        if not self._state.adding:
+            self.version += 1
+        # The amounts may still be float defaults or values assigned as such
+        self.balance_due = Decimal(str(self.total_amount)) - Decimal(str(self.total_paid))
+        base_amounts = self.base_amounts()
+        for name, value in base_amounts.items():
+            setattr(self, name, value)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            written = ['version', 'updated_at']
+            if {'currency', 'total_amount', 'total_margin', 'total_paid'} & set(update_fields):
+                written += ['balance_due', *base_amounts]
+            kwargs['update_fields'] = [*update_fields, *(name for name in written if name not in update_fields)]
         super().save(*args, **kwargs)
+        fragments.bump(Order, self.pk)
 
     def __str__(self):
         # Format: "Client Name - DD/MM/YYYY"
         date_str = self.created_at.strftime('%d/%m/%Y') if self.created_at else ''
         return f"{self.client.full_name} - {date_str}" if date_str else self.order_friendly_id
 
-class ServiceItem(models.Model):
+class ServiceItem(OptimisticLocking, models.Model):
     """
     Replaces the old 'Procedure' model. Represents a single line item in an Order.
     Example: 1 Legalization of Birth Certificate.
@@ -203,6 +392,32 @@ class ServiceItem(models.Model):
         ('DELIVERED', 'Entregado'),
     ]
 
+    # Workflow phases by legalization type AND delivery destination
+    WORKFLOW_PHASES = {
+        'MINJUS': {
+            'INTERNACIONAL': ['INIT', 'MINJUS_OUT', 'SENT_SPAIN', 'SENT_CLIENT', 'DELIVERED'],
+            'HABANA': ['INIT', 'MINJUS_OUT', 'READY_PICKUP', 'DELIVERED'],
+            'CAMAGUEY': ['INIT', 'MINJUS_OUT', 'SENT_CAMAGUEY', 'READY_PICKUP', 'DELIVERED'],
+        },
+        'CONSULADO': {
+            'INTERNACIONAL': ['PENDING_RECEIVE', 'RECEIVED', 'LEGALIZED', 'SENT_SPAIN', 'SENT_CLIENT', 'DELIVERED'],
+            'HABANA': ['PENDING_RECEIVE', 'RECEIVED', 'LEGALIZED', 'READY_PICKUP', 'DELIVERED'],
+            'CAMAGUEY': ['PENDING_RECEIVE', 'RECEIVED', 'LEGALIZED', 'SENT_CAMAGUEY', 'READY_PICKUP', 'DELIVERED'],
+        },
+        'MINJUS_CONSULADO': {
+            'INTERNACIONAL': ['INIT', 'MINJUS_OUT', 'CONSULATE_OUT', 'SENT_SPAIN', 'SENT_CLIENT', 'DELIVERED'],
+            'HABANA': ['INIT', 'MINJUS_OUT', 'CONSULATE_OUT', 'READY_PICKUP', 'DELIVERED'],
+            'CAMAGUEY': ['INIT', 'MINJUS_OUT', 'CONSULATE_OUT', 'SENT_CAMAGUEY', 'READY_PICKUP', 'DELIVERED'],
+        },
+    }
+    DEFAULT_WORKFLOW_PHASES = ['INIT', 'DELIVERED']
+
+    LEGALIZATION_DISPLAY = {
+        'MINJUS_CONSULADO': 'MINJUS + Consulado',
+        'MINJUS': 'MINJUS',
+        'CONSULADO': 'Consulado',
+    }
+
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
     service_type = models.CharField(max_length=20, choices=SERVICE_TYPES, default='LEGALIZATION')
     
@@ -256,6 +471,21 @@ class ServiceItem(models.Model):
     ]
     priority = models.CharField(max_length=10, choices=PRIORITY_CHOICES, default='NORMAL')
     deadline = models.DateTimeField(null=True, blank=True)
+
+    # Smart Queue key: kept up to date by save() and, for items whose
+    # deadline passes without a write, by the sweep_deadlines command
+    CLOSED_STATUSES = ('READY', 'DELIVERED')
+    URGENCY_CLOSED = 0
+    URGENCY_NORMAL = 1
+    URGENCY_EXPRESS = 2
+    URGENCY_OVERDUE = 3
+    URGENCY_CHOICES = [
+        (URGENCY_CLOSED, 'Cerrado'),
+        (URGENCY_NORMAL, 'Normal'),
+        (URGENCY_EXPRESS, 'Express'),
+        (URGENCY_OVERDUE, 'Vencido'),
+    ]
+    urgency = models.PositiveSmallIntegerField(choices=URGENCY_CHOICES, default=URGENCY_NORMAL, editable=False)
     
     # Phase tracking (JSON field for flexibility)
     phase_dates = models.JSONField(default=dict, blank=True, help_text="Fechas de cada fase del proceso")
@@ -263,38 +493,48 @@ class ServiceItem(models.Model):
     # Document management
     final_document = models.FileField(upload_to='final_documents/', null=True, blank=True, help_text="Documento final legalizado")
     notes = models.TextField(blank=True, help_text="Notas específicas del trámite")
+
+    # Incremented by every write to the row (sync conflicts, optimistic locking)
+    version = models.PositiveIntegerField(default=1, editable=False)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    
+
+    class Meta:
+        indexes = [
+            # Smart Queue over open items, globally and per tramitador / location
+            models.Index(fields=['-urgency', 'deadline', 'id'], name='crm_item_queue_idx',
+                         condition=models.Q(urgency__gt=0)),
+            models.Index(fields=['assigned_tramitador', '-urgency', 'deadline', 'id'], name='crm_item_queue_tram_idx',
+                         condition=models.Q(urgency__gt=0)),
+            models.Index(fields=['current_location', '-urgency', 'deadline', 'id'], name='crm_item_queue_loc_idx',
+                         condition=models.Q(urgency__gt=0)),
+            # Deadline sweeper: open items that are not overdue yet
+            models.Index(fields=['deadline'], name='crm_item_due_idx', condition=models.Q(urgency__in=[1, 2])),
+            # Dashboard upcoming deadlines (a range on deadline, so it leads)
+            models.Index(fields=['deadline', 'status'], name='crm_item_deadline_idx'),
+            # Kanban ?urgent= and ?location=, joined from the orders
+            models.Index(fields=['order'], name='crm_item_express_idx', condition=models.Q(priority='EXPRESS')),
+            models.Index(fields=['current_location', 'order'], name='crm_item_location_idx'),
+        ]
+
     @property
     def is_overdue(self):
-        """Check if item is past its deadline"""
-        if self.deadline and self.status not in ['READY', 'DELIVERED']:
-            return timezone.now() > self.deadline
-        return False
+        """Past its deadline and still open, as of the last save or deadline sweep"""
+        return self.urgency == self.URGENCY_OVERDUE
+
+    def compute_urgency(self, now=None):
+        """Overdue > Express > Normal for open items, 0 once READY/DELIVERED"""
+        if self.status in self.CLOSED_STATUSES:
+            return self.URGENCY_CLOSED
+        if self.deadline and self.deadline < (now or timezone.now()):
+            return self.URGENCY_OVERDUE
+        return self.URGENCY_EXPRESS if self.priority == 'EXPRESS' else self.URGENCY_NORMAL
     
     def get_workflow_phases(self):
         """Return workflow phases based on legalization type AND delivery destination"""
-        workflows = {
-            'MINJUS': {
-                'INTERNACIONAL': ['INIT', 'MINJUS_OUT', 'SENT_SPAIN', 'SENT_CLIENT', 'DELIVERED'],
-                'HABANA': ['INIT', 'MINJUS_OUT', 'READY_PICKUP', 'DELIVERED'],
-                'CAMAGUEY': ['INIT', 'MINJUS_OUT', 'SENT_CAMAGUEY', 'READY_PICKUP', 'DELIVERED'],
-            },
-            'CONSULADO': {
-                'INTERNACIONAL': ['PENDING_RECEIVE', 'RECEIVED', 'LEGALIZED', 'SENT_SPAIN', 'SENT_CLIENT', 'DELIVERED'],
-                'HABANA': ['PENDING_RECEIVE', 'RECEIVED', 'LEGALIZED', 'READY_PICKUP', 'DELIVERED'],
-                'CAMAGUEY': ['PENDING_RECEIVE', 'RECEIVED', 'LEGALIZED', 'SENT_CAMAGUEY', 'READY_PICKUP', 'DELIVERED'],
-            },
-            'MINJUS_CONSULADO': {
-                'INTERNACIONAL': ['INIT', 'MINJUS_OUT', 'CONSULATE_OUT', 'SENT_SPAIN', 'SENT_CLIENT', 'DELIVERED'],
-                'HABANA': ['INIT', 'MINJUS_OUT', 'CONSULATE_OUT', 'READY_PICKUP', 'DELIVERED'],
-                'CAMAGUEY': ['INIT', 'MINJUS_OUT', 'CONSULATE_OUT', 'SENT_CAMAGUEY', 'READY_PICKUP', 'DELIVERED'],
-            },
-        }
-        
-        return workflows.get(self.legalization_type, {}).get(self.delivery_destination, ['INIT', 'DELIVERED'])
+        phases = self.WORKFLOW_PHASES.get(self.legalization_type, {}).get(self.delivery_destination)
+        return list(phases or self.DEFAULT_WORKFLOW_PHASES)
     
     def get_document_abbreviation(self):
         """Get abbreviation for document type"""
@@ -306,12 +546,7 @@ class ServiceItem(models.Model):
     
     def get_legalization_display(self):
         """Format legalization type for display"""
-        leg_type_map = {
-            'MINJUS_CONSULADO': 'MINJUS + Consulado',
-            'MINJUS': 'MINJUS',
-            'CONSULADO': 'Consulado',
-        }
-        return leg_type_map.get(self.legalization_type, '')
+        return self.LEGALIZATION_DISPLAY.get(self.legalization_type, '')
 
     def save(self, *args, **kwargs):
         from decimal import Decimal
@@ -328,9 +563,26 @@ class ServiceItem(models.Model):
              days = 3 if self.priority == 'EXPRESS' else 15
              self.deadline = timezone.now() + timezone.timedelta(days=days)
 
+        self.urgency = self.compute_urgency()
+        if not self._state.adding:
+            self.version += 1
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = [*update_fields, *(
+                name for name in ('urgency', 'version', 'updated_at') if name not in update_fields)]
+
         super().save(*args, **kwargs)
-        # Trigger parent update
-        self.order.update_totals()
+        fragments.bump(ServiceItem, self.pk)
+        # Trigger parent update (bumps the order fragments too)
+        if not _defer(self.order_id):
+            self.order.update_totals()
+
+    def delete(self, *args, **kwargs):
+        order = self.order
+        result = super().delete(*args, **kwargs)
+        # Totals and has_overdue without this item (bumps the order fragments)
+        order.update_totals()
+        return result
 
     def __str__(self):
         return f"{self.get_service_type_display()} - {self.titular_name}"
@@ -357,28 +609,40 @@ class Payment(models.Model):
     proof_file = models.FileField(upload_to='payments/', blank=True, null=True)
     payment_date = models.DateTimeField(auto_now_add=True)
     notes = models.TextField(blank=True)
+    # amount in FX_BASE_CURRENCY at the rate of the payment's day (crm.fx), NULL without a rate
+    amount_base = models.DecimalField(max_digits=12, decimal_places=2, null=True, editable=False)
     
     def __str__(self):
         return f"{self.amount} {self.currency} - {self.order.order_friendly_id}"
     
     def save(self, *args, **kwargs):
+        self.amount_base = fx.to_base(self.amount, self.currency, self.payment_date)
         super().save(*args, **kwargs)
-        # Update order's total_paid
+        if _defer(self.order_id):
+            return
+        # Update order's total_paid, in the order's currency
         order = self.order
-        total_paid = sum(p.amount for p in order.payments.all())
+        total_paid = order.paid_in_currency(order.payments.all())
         
         # Update payment_status
-        if total_paid >= order.total_amount:
-            payment_status = 'PAID'
-        elif total_paid > 0:
-            payment_status = 'PARTIAL'
-        else:
-            payment_status = 'PENDING'
+        payment_status = Order.payment_status_for(total_paid, order.total_amount)
         
+        balance_due = models.F('total_amount') - total_paid
         Order.objects.filter(pk=order.pk).update(
             total_paid=total_paid,
-            payment_status=payment_status
+            balance_due=balance_due,
+            balance_due_base=order.base_amounts(balance_due)['balance_due_base'],
+            payment_status=payment_status,
+            updated_at=timezone.now(),
+            version=models.F('version') + 1,
         )
+        fragments.bump(Order, order.pk)
+
+    def delete(self, *args, **kwargs):
+        order_id = self.order_id
+        result = super().delete(*args, **kwargs)
+        fragments.bump(Order, order_id)
+        return result
 
 
 class ActivityLog(models.Model):
@@ -393,6 +657,7 @@ class ActivityLog(models.Model):
         ('ASSIGNMENT', 'Asignación'),
         ('DOCUMENT_UPLOAD', 'Documento Subido'),
         ('SERVICE_ADDED', 'Servicio Añadido'),
+        ('ESCALATION', 'Escalado por Vencimiento'),
     ]
     
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='activity_logs')
@@ -407,5 +672,250 @@ class ActivityLog(models.Model):
         verbose_name = 'Registro de Actividad'
         verbose_name_plural = 'Registros de Actividad'
     
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # The order detail embeds its activity log
+        fragments.bump(Order, self.order_id)
+
     def __str__(self):
         return f"{self.get_action_type_display()} - {self.order.order_friendly_id} - {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
+
+
+class SlowQuery(models.Model):
+    """
+    Consultas SQL lentas capturadas por el middleware de monitorización.
+    Una fila por huella (SQL normalizado); se conserva la muestra más lenta.
+    """
+    fingerprint = models.CharField(max_length=40, unique=True)
+    normalized_sql = models.TextField()
+    sample_sql = models.TextField(help_text="SQL de la ejecución más lenta")
+    sample_params = models.JSONField(default=list, blank=True)
+    plan = models.TextField(blank=True, help_text="Salida de EXPLAIN de la ejecución más lenta")
+    origin = models.CharField(max_length=255, blank=True, help_text="Frame de la app que lanzó la consulta")
+    view_name = models.CharField(max_length=100, blank=True)
+    calls = models.PositiveIntegerField(default=0)
+    total_duration_ms = models.FloatField(default=0)
+    max_duration_ms = models.FloatField(default=0)
+    first_seen = models.DateTimeField(auto_now_add=True)
+    last_seen = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-max_duration_ms']
+        verbose_name = 'Consulta Lenta'
+        verbose_name_plural = 'Consultas Lentas'
+
+    @property
+    def avg_duration_ms(self):
+        return self.total_duration_ms / self.calls if self.calls else 0
+
+    def __str__(self):
+        return f"{self.max_duration_ms:.0f}ms x{self.calls} - {self.normalized_sql[:80]}"
+
+class Job(models.Model):
+    """
+    Tarea en segundo plano (crm.jobs), ejecutada por `python manage.py run_workers`.
+    """
+    STATUS_CHOICES = [
+        ('QUEUED', 'En Cola'),
+        ('RUNNING', 'En Ejecución'),
+        ('DONE', 'Completada'),
+        ('FAILED', 'Fallida'),
+        ('CANCELLED', 'Cancelada'),
+    ]
+
+    task = models.CharField(max_length=200, help_text="Ruta de la función, p. ej. crm.tasks.send_payment_request")
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='QUEUED')
+    priority = models.SmallIntegerField(default=0, help_text="Mayor primero")
+    run_at = models.DateTimeField(default=timezone.now, help_text="No antes de esta fecha (reintentos con espera)")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    dedupe_key = models.CharField(max_length=200, null=True, blank=True,
+                                  help_text="Como mucho una tarea en cola con la misma clave")
+    worker = models.CharField(max_length=100, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Tarea en Segundo Plano'
+        verbose_name_plural = 'Tareas en Segundo Plano'
+        indexes = [
+            # Next job to claim
+            models.Index(fields=['-priority', 'run_at', 'id'], name='crm_job_queue_idx',
+                         condition=models.Q(status='QUEUED')),
+            # Jobs left running by a dead worker
+            models.Index(fields=['started_at'], name='crm_job_running_idx', condition=models.Q(status='RUNNING')),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['dedupe_key'], condition=models.Q(status='QUEUED'),
+                                    name='crm_job_queued_dedupe'),
+        ]
+
+    def __str__(self):
+        return f"{self.task} #{self.pk} ({self.get_status_display()})"
+
+
+class Upload(models.Model):
+    """
+    Resumable upload of a document in chunks (crm.files); the bytes received
+    so far live in MEDIA_ROOT/partial/<id>.part until it is completed.
+    """
+    TARGET_CHOICES = [
+        ('FINAL_DOCUMENT', 'Documento Final'),
+        ('PAYMENT_PROOF', 'Justificante de Pago'),
+    ]
+
+    STATUS_CHOICES = [
+        ('OPEN', 'En Curso'),
+        ('COMPLETE', 'Completada'),
+        ('ABORTED', 'Cancelada'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    target = models.CharField(max_length=20, choices=TARGET_CHOICES)
+    object_id = models.PositiveBigIntegerField(help_text="Servicio o pago al que se adjunta")
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField(help_text="Tamaño total en bytes")
+    sha256 = models.CharField(max_length=64, blank=True, help_text="Hash del archivo completo (opcional al crearla)")
+    received = models.PositiveBigIntegerField(default=0, help_text="Bytes recibidos de forma contigua")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='OPEN')
+    stored_name = models.CharField(max_length=255, blank=True, help_text="Archivo almacenado al completarla")
+    created_by = models.ForeignKey('auth.User', on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='uploads')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Subida por Partes'
+        verbose_name_plural = 'Subidas por Partes'
+        indexes = [
+            # Abandoned uploads to purge
+            models.Index(fields=['updated_at'], name='crm_upload_open_idx', condition=models.Q(status='OPEN')),
+        ]
+
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.size} bytes, {self.get_status_display()})"
+
+
+class SyncMutation(models.Model):
+    """
+    A change pushed by an offline client (crm.sync), stored under the id the
+    client gave it: pushing it again returns this result instead of applying
+    it twice.
+    """
+    STATUS_CHOICES = [
+        ('APPLIED', 'Aplicada'),
+        ('CONFLICT', 'Conflicto'),
+        ('REJECTED', 'Rechazada'),
+    ]
+
+    id = models.UUIDField(primary_key=True, help_text="Generado por el cliente")
+    device = models.CharField(max_length=100, blank=True)
+    kind = models.CharField(max_length=30)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+    result = models.JSONField(default=dict)
+    user = models.ForeignKey('auth.User', on_delete=models.SET_NULL, null=True, blank=True,
+                             related_name='sync_mutations')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Cambio Sincronizado'
+        verbose_name_plural = 'Cambios Sincronizados'
+
+    def __str__(self):
+        return f"{self.kind} {self.id} ({self.get_status_display()})"
+
+
+class IdempotencyKey(models.Model):
+    """
+    First response to a request sent with an Idempotency-Key header
+    (crm.idempotency), replayed to retries of that request until expires_at.
+    """
+    key = models.CharField(max_length=255)
+    scope = models.CharField(max_length=50, help_text="Usuario que envió la clave")
+    fingerprint = models.CharField(max_length=64, help_text="SHA-256 del método, la ruta y el cuerpo")
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True, help_text="Vacío mientras se procesa")
+    response = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder,
+                                help_text="Cuerpo y cabeceras de la respuesta")
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Clave de Idempotencia'
+        verbose_name_plural = 'Claves de Idempotencia'
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='crm_idempotency_key_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='crm_idempotency_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.scope}, {self.status_code})"
+
+
+class ArchivedOrder(models.Model):
+    """
+    Orden cerrada trasladada fuera de las tablas operativas (crm.archive) con
+    sus servicios, pagos y registro de actividad. Se sigue consultando por id
+    y desde el portal; `python manage.py restore_orders` la devuelve.
+    """
+    id = models.BigIntegerField(primary_key=True, help_text="Id de la orden original")
+    order_friendly_id = models.CharField(max_length=100, unique=True)
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='archived_orders')
+    currency = models.CharField(max_length=3, choices=Order.CURRENCY_CHOICES)
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    total_paid = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField()
+    closed_at = models.DateTimeField(help_text="Última modificación antes de archivarla")
+    archived_at = models.DateTimeField(auto_now_add=True)
+    rows = models.JSONField(encoder=DjangoJSONEncoder,
+                            help_text="Filas originales (orden, servicios, pagos y actividad) para restaurarla")
+    detail = models.JSONField(encoder=DjangoJSONEncoder, help_text="Detalle de la orden tal como lo devolvía la API")
+    portal = models.JSONField(encoder=DjangoJSONEncoder, help_text="La orden tal como la ve el portal del cliente")
+
+    class Meta:
+        ordering = ['-closed_at']
+        verbose_name = 'Orden Archivada'
+        verbose_name_plural = 'Órdenes Archivadas'
+
+    def __str__(self):
+        return f"{self.order_friendly_id} (archivada {self.archived_at:%d/%m/%Y})" if self.archived_at \
+            else self.order_friendly_id
+
+
+class ExchangeRate(models.Model):
+    """
+    Units of FX_BASE_CURRENCY per unit of a currency, from effective_date
+    until the next rate of that currency (crm.fx)
+    """
+    currency = models.CharField(max_length=3, choices=Order.CURRENCY_CHOICES)
+    rate = models.DecimalField(max_digits=18, decimal_places=8, help_text="Unidades de la moneda base por unidad")
+    effective_date = models.DateField(help_text="Vigente desde este día hasta el siguiente tipo de la moneda")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['currency', '-effective_date']
+        constraints = [
+            models.UniqueConstraint(fields=['currency', 'effective_date'], name='crm_fx_rate_unique'),
+        ]
+        verbose_name = 'Tipo de Cambio'
+        verbose_name_plural = 'Tipos de Cambio'
+
+    def __str__(self):
+        return f"{self.currency} {self.rate} ({self.effective_date})"
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        fx.invalidate()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        fx.invalidate()
+        return result
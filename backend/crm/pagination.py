@@ -0,0 +1,125 @@
+"""
+Keyset ("seek") pagination for lists ordered by an indexed key.
+
+The cursor holds the key of the last row of a page and the next page is
+`WHERE key > cursor ORDER BY key LIMIT n`: a range scan on the matching
+index that costs the same on the first page and on the last one, and that
+neither skips nor repeats rows when the list changes between requests
+(unlike OFFSET). The last ordering field must be unique (usually 'id').
+Nullable fields sort their NULLs last in both directions, on every
+database (SQLite and PostgreSQL disagree by default), and the cursor
+conditions account for them: `deadline > x` alone never matches a NULL.
+"""
+import base64
+import binascii
+import json
+from datetime import date, datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+
+
+class InvalidPage(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    values = [value.isoformat() if isinstance(value, (date, datetime)) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        raise InvalidPage('Invalid cursor')
+    if not isinstance(values, list):
+        raise InvalidPage('Invalid cursor')
+    return values
+
+
+class KeysetPage:
+    def __init__(self, pks, next_cursor):
+        self.pks = pks
+        self.next_cursor = next_cursor
+
+
+class KeysetPagination:
+    """
+    KeysetPagination(['-urgency', 'deadline', 'id']).paginate(queryset, request)
+    -> KeysetPage with the pks of the requested page and the cursor of the next one.
+    """
+    cursor_param = 'cursor'
+    limit_param = 'limit'
+
+    def __init__(self, ordering, page_size=100, max_page_size=500):
+        self.ordering = list(ordering)
+        self.fields = [name.lstrip('-') for name in self.ordering]
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+
+    def get_limit(self, request):
+        limit = request.query_params.get(self.limit_param)
+        if not limit:
+            return self.page_size
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise InvalidPage('Invalid limit')
+        if limit < 1:
+            raise InvalidPage('Invalid limit')
+        return min(limit, self.max_page_size)
+
+    def _nullable(self, model):
+        return [model._meta.get_field(field).null for field in self.fields]
+
+    def order_by(self, model):
+        """The ordering, with the NULLs of nullable fields last"""
+        return [(F(field).desc(nulls_last=True) if name.startswith('-') else F(field).asc(nulls_last=True))
+                if nullable else name
+                for name, field, nullable in zip(self.ordering, self.fields, self._nullable(model))]
+
+    def seek(self, queryset, cursor):
+        """Rows strictly after the cursor in key order"""
+        values = decode_cursor(cursor)
+        if len(values) != len(self.fields):
+            raise InvalidPage('Invalid cursor')
+        try:
+            values = [queryset.model._meta.get_field(field).to_python(value)
+                      for field, value in zip(self.fields, values)]
+        except (ValidationError, ValueError, TypeError):
+            raise InvalidPage('Invalid cursor')
+        nullable = self._nullable(queryset.model)
+        if None in (value for value, null in zip(values, nullable) if not null):
+            raise InvalidPage('Invalid cursor')
+
+        # (a, b, c) after (x, y, z): a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+        after = Q()
+        for position, name in enumerate(self.ordering):
+            field, value = self.fields[position], values[position]
+            if value is None:
+                # Nothing sorts after a NULL on this field
+                continue
+            condition = Q(**{f"{field}__{'lt' if name.startswith('-') else 'gt'}": value})
+            if nullable[position]:
+                condition |= Q(**{f'{field}__isnull': True})
+            for previous, previous_value in zip(self.fields[:position], values[:position]):
+                condition &= Q(**({f'{previous}__isnull': True} if previous_value is None
+                                  else {previous: previous_value}))
+            after |= condition
+        return queryset.filter(after)
+
+    def paginate(self, queryset, request):
+        limit = self.get_limit(request)
+        cursor = request.query_params.get(self.cursor_param)
+        if cursor:
+            queryset = self.seek(queryset, cursor)
+
+        rows = list(queryset.order_by(*self.order_by(queryset.model)).values_list(*self.fields)[:limit + 1])
+        next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return KeysetPage([row[-1] for row in rows[:limit]], next_cursor)
+
+    def next_link(self, request, next_cursor):
+        params = request.query_params.copy()
+        params[self.cursor_param] = next_cursor
+        return request.build_absolute_uri(f'{request.path}?{params.urlencode()}')
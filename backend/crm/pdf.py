@@ -0,0 +1,106 @@
+"""
+Minimal PDF writer for text documents such as invoices.
+
+Standard Helvetica fonts (no embedding), WinAnsi text, lines and shaded
+rectangles, FlateDecode content streams and no dependencies. The output
+carries no timestamps or random ids, so identical documents produce
+identical bytes.
+"""
+import zlib
+
+A4 = (595.28, 841.89)
+
+# Helvetica advance widths (1/1000 em) for ASCII 32..126, from the AFM
+_HELVETICA_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+
+
+def text_width(string, size):
+    """Approximate width in points (accented letters count as 556)"""
+    return sum(
+        _HELVETICA_WIDTHS[ord(char) - 32] if 32 <= ord(char) <= 126 else 556 for char in string
+    ) * size / 1000
+
+
+def _escape(string):
+    data = string.encode('cp1252', errors='replace')
+    return data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+def _number(value):
+    return ('%.2f' % value).rstrip('0').rstrip('.').encode()
+
+
+class PDFDocument:
+    """
+    doc = PDFDocument(); doc.add_page(); doc.text(50, 800, 'Hola', size=12)
+    doc.output() -> bytes. Coordinates in points from the bottom left corner.
+    """
+
+    def __init__(self, size=A4):
+        self.width, self.height = size
+        self.pages = []
+
+    def add_page(self):
+        self.pages.append([])
+
+    def _draw(self, *operations):
+        if not self.pages:
+            self.add_page()
+        self.pages[-1].extend(operations)
+
+    def text(self, x, y, string, size=10, bold=False, align='left'):
+        if align == 'right':
+            x -= text_width(string, size)
+        elif align == 'center':
+            x -= text_width(string, size) / 2
+        font = b'/F2' if bold else b'/F1'
+        self._draw(b'BT ' + font + b' ' + _number(size) + b' Tf ' + _number(x) + b' ' + _number(y)
+                   + b' Td (' + _escape(string) + b') Tj ET')
+
+    def line(self, x1, y1, x2, y2, width=0.5):
+        self._draw(_number(width) + b' w ' + _number(x1) + b' ' + _number(y1) + b' m '
+                   + _number(x2) + b' ' + _number(y2) + b' l S')
+
+    def rect(self, x, y, width, height, gray=0.9):
+        self._draw(b'q ' + _number(gray) + b' g ' + b' '.join(map(_number, (x, y, width, height)))
+                   + b' re f Q')
+
+    def output(self):
+        if not self.pages:
+            self.add_page()
+        page_ids = [5 + 2 * n for n in range(len(self.pages))]
+        objects = {
+            1: b'<< /Type /Catalog /Pages 2 0 R >>',
+            2: b'<< /Type /Pages /Kids [' + b' '.join(b'%d 0 R' % pk for pk in page_ids)
+               + b'] /Count %d >>' % len(page_ids),
+            3: b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+            4: b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>',
+        }
+        for page_id, operations in zip(page_ids, self.pages):
+            content = zlib.compress(b'\n'.join(operations), 6)
+            objects[page_id] = (
+                b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 ' + _number(self.width) + b' '
+                + _number(self.height) + b'] /Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> '
+                + b'/Contents %d 0 R >>' % (page_id + 1)
+            )
+            objects[page_id + 1] = (b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(content)
+                                    + content + b'\nendstream')
+
+        out = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        offsets = {}
+        for pk in sorted(objects):
+            offsets[pk] = len(out)
+            out += b'%d 0 obj\n' % pk + objects[pk] + b'\nendobj\n'
+        xref = len(out)
+        out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+        for pk in sorted(objects):
+            out += b'%010d 00000 n \n' % offsets[pk]
+        out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+        return bytes(out)
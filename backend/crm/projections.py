@@ -0,0 +1,158 @@
+"""
+values()-based read path for the large list endpoints.
+
+Builds exactly what ServiceItemSerializer and OrderListSerializer return
+(same keys, key order and value types) from values() rows and the lookup
+tables on the models, without instantiating models or running DRF field
+machinery. test_projections renders both paths and compares the bytes, so
+a field added to either serializer must be added here too.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import ServiceItem
+
+CENTS = Decimal('0.01')
+
+SERVICE_ITEM_VALUES = (
+    'id', 'order_id', 'service_type', 'document_type', 'legalization_type', 'titular_name', 'status',
+    'delivery_destination', 'assigned_tramitador_id', 'assigned_tramitador__username',
+    'responsible', 'logistics_status', 'current_location', 'cost', 'price', 'margin', 'priority',
+    'deadline', 'urgency', 'phase_dates', 'final_document', 'notes', 'version', 'created_at', 'updated_at',
+)
+
+ORDER_LIST_VALUES = (
+    'id', 'order_friendly_id', 'client_id', 'client__full_name', 'client__is_collaborator',
+    'global_status', 'payment_status', 'assigned_to_id', 'assigned_to__username',
+    'currency', 'total_amount', 'total_paid', 'total_margin', 'has_overdue', 'created_at', 'updated_at',
+)
+
+
+def decimal_string(value):
+    """DecimalField(decimal_places=2) representation"""
+    return None if value is None else '{:f}'.format(value.quantize(CENTS))
+
+
+def datetime_string(value, tz):
+    """DateTimeField representation: ISO 8601 in the current timezone, UTC as 'Z'"""
+    if not value:
+        return None
+    if tz is not None and timezone.is_aware(value):
+        value = value.astimezone(tz)
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+class _Context:
+    """Per-call constants shared by every row"""
+
+    def __init__(self, request=None, now=None):
+        self.now = now or timezone.now()
+        self.tz = timezone.get_current_timezone() if settings.USE_TZ else None
+        self.request = request
+        self.storage = ServiceItem._meta.get_field('final_document').storage
+
+    def file_url(self, name):
+        if not name:
+            return None
+        url = self.storage.url(name)
+        return self.request.build_absolute_uri(url) if self.request is not None else url
+
+
+def _service_item(row, ctx):
+    deadline = row['deadline']
+    phases = (ServiceItem.WORKFLOW_PHASES.get(row['legalization_type'], {})
+              .get(row['delivery_destination']) or ServiceItem.DEFAULT_WORKFLOW_PHASES)
+    # ServiceItem.document_type has no choices, so the serializer's
+    # document_type_display always fails and is left out of the output
+    return {
+        'id': row['id'],
+        'service_type': row['service_type'],
+        'document_type': row['document_type'],
+        'legalization_type': row['legalization_type'],
+        'titular_name': row['titular_name'],
+        'status': row['status'],
+        'delivery_destination': row['delivery_destination'],
+        'assigned_tramitador': row['assigned_tramitador_id'],
+        'assigned_tramitador_name': row['assigned_tramitador__username'],
+        'responsible': row['responsible'],
+        'logistics_status': row['logistics_status'],
+        'current_location': row['current_location'],
+        'cost': decimal_string(row['cost']),
+        'price': decimal_string(row['price']),
+        'margin': decimal_string(row['margin']),
+        'priority': row['priority'],
+        'deadline': datetime_string(deadline, ctx.tz),
+        'phase_dates': row['phase_dates'],
+        'final_document': ctx.file_url(row['final_document']),
+        'notes': row['notes'],
+        'is_overdue': row['urgency'] == ServiceItem.URGENCY_OVERDUE,
+        'version': row['version'],
+        'created_at': datetime_string(row['created_at'], ctx.tz),
+        'updated_at': datetime_string(row['updated_at'], ctx.tz),
+        'service_display_name': row['titular_name'],
+        'legalization_display': ServiceItem.LEGALIZATION_DISPLAY.get(row['legalization_type'], ''),
+        'workflow_phases': list(phases),
+        'days_until_deadline': (deadline - ctx.now).days if deadline else None,
+        'document_abbreviation': ServiceItem.DOCUMENT_ABBREVIATIONS.get(row['document_type'], 'DOC'),
+    }
+
+
+def service_item_rows(queryset, request=None, now=None):
+    """ServiceItemSerializer(queryset, many=True).data in a single query"""
+    ctx = _Context(request, now)
+    return [_service_item(row, ctx) for row in queryset.values(*SERVICE_ITEM_VALUES)]
+
+
+def order_list_rows(queryset, request=None, now=None):
+    """
+    OrderListSerializer(queryset, many=True).data in two queries: the orders
+    and all of their items.
+    """
+    ctx = _Context(request, now)
+    orders = list(queryset.values(*ORDER_LIST_VALUES))
+    if not orders:
+        return []
+
+    items_by_order = {}
+    item_rows = (ServiceItem.objects.filter(order__in=queryset.values('pk'))
+                 .order_by('pk').values(*SERVICE_ITEM_VALUES))
+    for row in item_rows:
+        items_by_order.setdefault(row['order_id'], []).append(_service_item(row, ctx))
+
+    data = []
+    for row in orders:
+        items = items_by_order.get(row['id'], [])
+        total_amount, total_paid = row['total_amount'], row['total_paid']
+        order = {
+            'id': row['id'],
+            'order_friendly_id': row['order_friendly_id'],
+            'client': row['client_id'],
+            'client_name': row['client__full_name'],
+            'client_is_collaborator': row['client__is_collaborator'],
+            'global_status': row['global_status'],
+            'payment_status': row['payment_status'],
+            'assigned_to': row['assigned_to_id'],
+        }
+        # Like the serializer, no key at all when the order is unassigned
+        if row['assigned_to__username'] is not None:
+            order['assigned_to_name'] = row['assigned_to__username']
+        order.update({
+            'currency': row['currency'],
+            'total_amount': decimal_string(total_amount),
+            'total_paid': decimal_string(total_paid),
+            'total_margin': decimal_string(row['total_margin']),
+            'items_count': len(items),
+            'has_express': any(item['priority'] == 'EXPRESS' for item in items),
+            'has_overdue': row['has_overdue'],
+            'payment_progress': round((total_paid / total_amount) * 100, 1) if total_amount > 0 else 0,
+            'created_at': datetime_string(row['created_at'], ctx.tz),
+            'updated_at': datetime_string(row['updated_at'], ctx.tz),
+            'items': items,
+        })
+        data.append(order)
+    return data
@@ -0,0 +1,117 @@
+"""
+Accounts receivable aging (/api/reports/aging/).
+
+Outstanding balances (Order.balance_due, total_amount - total_paid, written
+by the same saves and updates that write the totals) bucketed by the age
+of the order, 0-30, 31-60, 61-90 and over 90 days, per currency, client
+and gestor, and across currencies in FX_BASE_CURRENCY (balance_due_base,
+crm.fx). One grouped query over the orders with a balance, which the
+partial index crm_order_balance_idx keeps to the unpaid orders.
+
+Ages are counted in whole days as of the start of the current day, so a
+report stays valid for the day: it is cached for AGING_REPORT_CACHE_SECONDS
+under the fragment cache generation (crm.fragments), which every payment
+and item write bumps.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from . import fx
+from .fragments import current_generation
+from .models import Order
+from .projections import decimal_string
+
+# (key, label, oldest age in days, or None)
+BUCKETS = (
+    ('days_0_30', '0-30', 30),
+    ('days_31_60', '31-60', 60),
+    ('days_61_90', '61-90', 90),
+    ('days_90_plus', '90+', None),
+)
+GROUP_BY = ('currency', 'client_id', 'client__full_name', 'assigned_to_id', 'assigned_to__username')
+AMOUNTS = (*(key for key, _, _ in BUCKETS), 'total')
+
+
+def _buckets(today, field='balance_due', suffix=''):
+    """Sum of `field` per bucket, by created_at relative to the start of `today`"""
+    sums, newer = {}, None
+    for key, _, days in BUCKETS:
+        condition = Q(created_at__lt=newer) if newer else Q()
+        if days is not None:
+            newer = today - timedelta(days=days)
+            condition &= Q(created_at__gte=newer)
+        sums[key + suffix] = Sum(field, filter=condition, default=Decimal('0'))
+    return sums
+
+
+def _add(totals, row):
+    for key in ('orders', *AMOUNTS):
+        totals[key] = totals.get(key, 0) + row[key]
+    return totals
+
+
+def _amounts(row):
+    return {key: decimal_string(value) if key in AMOUNTS else value for key, value in row.items()}
+
+
+def compute_aging(now=None):
+    """
+    {'as_of', 'buckets', 'rows', 'by_currency', 'by_gestor', 'base'}: rows
+    per (currency, client, gestor), largest balance first, and their totals.
+    Amounts are only added across currencies in 'base', from the *_base
+    columns (orders without a rate for their day are left out of it).
+    """
+    now = timezone.localtime(now or timezone.now())
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    rows = (Order.objects.filter(balance_due__gt=0).values(*GROUP_BY)
+            .annotate(orders=Count('id'), total=Sum('balance_due'), **_buckets(today),
+                      total_base=Sum('balance_due_base', default=Decimal('0')),
+                      **_buckets(today, 'balance_due_base', '_base'))
+            .order_by('currency', '-total', 'client_id', 'assigned_to_id'))
+
+    report, by_currency, by_gestor = [], {}, {}
+    base = dict.fromkeys(AMOUNTS, Decimal('0'))
+    for row in rows:
+        for key in AMOUNTS:
+            base[key] += row[f'{key}_base']
+        by_currency.setdefault(row['currency'], {})
+        _add(by_currency[row['currency']], row)
+        gestor = by_gestor.setdefault((row['currency'], row['assigned_to_id']), {
+            'currency': row['currency'], 'assigned_to': row['assigned_to_id'],
+            'assigned_to_name': row['assigned_to__username']})
+        _add(gestor, row)
+        report.append({
+            'currency': row['currency'],
+            'client': row['client_id'],
+            'client_name': row['client__full_name'],
+            'assigned_to': row['assigned_to_id'],
+            'assigned_to_name': row['assigned_to__username'],
+            'orders': row['orders'],
+            **{key: row[key] for key in AMOUNTS},
+        })
+
+    return {
+        'as_of': today.date().isoformat(),
+        'buckets': [{'key': key, 'label': label} for key, label, _ in BUCKETS],
+        'rows': [_amounts(row) for row in report],
+        'by_currency': {currency: _amounts(totals) for currency, totals in sorted(by_currency.items())},
+        'by_gestor': [_amounts(totals) for totals in sorted(
+            by_gestor.values(), key=lambda totals: (totals['currency'], -totals['total']))],
+        'base': {'currency': fx.base_currency(), **_amounts(base)},
+    }
+
+
+def aging_report(now=None):
+    """compute_aging(), cached until the next write to an order, item or payment (or the next day)"""
+    now = timezone.localtime(now or timezone.now())
+    key = f'crm:aging:{now:%Y-%m-%d}:{current_generation()}'
+    report = cache.get(key)
+    if report is None:
+        report = compute_aging(now)
+        cache.set(key, report, settings.AGING_REPORT_CACHE_SECONDS)
+    return report
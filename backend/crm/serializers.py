@@ -1,6 +1,22 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import Client, Order, ServiceItem, Payment, ActivityLog
+from . import fx
+from .models import Client, Order, ServiceItem, Payment, ActivityLog, Upload
 from django.contrib.auth.models import User
+from django.db.models import Prefetch
+
+def items_prefetch(prefix=''):
+    """Prefetch order items with their tramitador (used by nested ServiceItemSerializer)"""
+    return Prefetch(f'{prefix}items', queryset=ServiceItem.objects.select_related('assigned_tramitador'))
+
+def order_detail_queryset(queryset=None):
+    """Everything OrderDetailSerializer reads, in a fixed number of queries"""
+    queryset = Order.objects.all() if queryset is None else queryset
+    return queryset.select_related('client', 'assigned_to').prefetch_related(
+        items_prefetch(),
+        'payments',
+        Prefetch('activity_logs', queryset=ActivityLog.objects.select_related('user')),
+    )
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -29,7 +45,7 @@ class ServiceItemSerializer(serializers.ModelSerializer):
             'delivery_destination', 'assigned_tramitador', 'assigned_tramitador_name', 
             'responsible', 'logistics_status', 'current_location',
             'cost', 'price', 'margin', 'priority', 'deadline', 'phase_dates',
-            'final_document', 'notes', 'is_overdue', 'created_at', 'updated_at',
+            'final_document', 'notes', 'is_overdue', 'version', 'created_at', 'updated_at',
             'service_display_name', 'legalization_display', 'document_type_display',
             'workflow_phases', 'days_until_deadline', 'document_abbreviation'
         ]
@@ -47,7 +63,43 @@ class ServiceItemSerializer(serializers.ModelSerializer):
 class PaymentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Payment
-        fields = '__all__'
+        # amount_base is for reports (crm.fx)
+        exclude = ['amount_base']
+
+    def validate(self, attrs):
+        order, currency = attrs.get('order'), attrs.get('currency', 'EUR')
+        if order is not None and currency != order.currency:
+            try:
+                fx.convert(attrs.get('amount', 0), currency, order.currency)
+            except fx.MissingRate:
+                raise serializers.ValidationError(
+                    {'currency': f"No hay tipo de cambio de {currency} a {order.currency} para hoy"})
+        return attrs
+
+class UploadSerializer(serializers.ModelSerializer):
+    """Resumable upload session (crm.files): `offset` is where the next chunk starts"""
+    offset = serializers.IntegerField(source='received', read_only=True)
+    chunk_size = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Upload
+        fields = ['id', 'target', 'object_id', 'filename', 'size', 'sha256', 'offset', 'chunk_size',
+                  'status', 'stored_name', 'created_at']
+        read_only_fields = ['status', 'stored_name', 'created_at']
+
+    def get_chunk_size(self, obj):
+        return settings.UPLOAD_CHUNK_SIZE
+
+    def validate_size(self, value):
+        if not 0 < value <= settings.UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(f"Debe estar entre 1 y {settings.UPLOAD_MAX_SIZE} bytes")
+        return value
+
+    def validate_sha256(self, value):
+        value = value.lower()
+        if value and (len(value) != 64 or any(c not in '0123456789abcdef' for c in value)):
+            raise serializers.ValidationError("SHA-256 en hexadecimal (64 caracteres)")
+        return value
 
 class ActivityLogSerializer(serializers.ModelSerializer):
     user_name = serializers.CharField(source='user.username', read_only=True)
@@ -64,7 +116,6 @@ class OrderListSerializer(serializers.ModelSerializer):
     assigned_to_name = serializers.CharField(source='assigned_to.username', read_only=True)
     items_count = serializers.SerializerMethodField()
     has_express = serializers.SerializerMethodField()
-    has_overdue = serializers.SerializerMethodField()
     payment_progress = serializers.SerializerMethodField()
     items = ServiceItemSerializer(many=True, read_only=True)
     
@@ -78,14 +129,12 @@ class OrderListSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at', 'items'
         ]
     
+    # Read from obj.items.all() so list views can prefetch the items once
     def get_items_count(self, obj):
-        return obj.items.count()
+        return len(obj.items.all())
     
     def get_has_express(self, obj):
-        return obj.items.filter(priority='EXPRESS').exists()
-    
-    def get_has_overdue(self, obj):
-        return any(item.is_overdue for item in obj.items.all())
+        return any(item.priority == 'EXPRESS' for item in obj.items.all())
     
     def get_payment_progress(self, obj):
         if obj.total_amount > 0:
@@ -108,7 +157,7 @@ class OrderDetailSerializer(serializers.ModelSerializer):
             'status', 'global_status', 'payment_status',
             'currency', 'total_amount', 'total_cost', 'total_margin', 'total_paid',
             'items', 'payments', 'activity_logs', 'notes',
-            'created_at', 'updated_at'
+            'version', 'created_at', 'updated_at'
         ]
         read_only_fields = ['order_friendly_id', 'total_amount', 'total_cost', 'total_margin', 'total_paid']
 
@@ -0,0 +1,237 @@
+"""
+Slow-query recorder.
+
+Every SQL statement executed while capture is active is timed through a
+Django execute wrapper. Statements slower than SLOW_QUERY_THRESHOLD_MS are
+kept together with the innermost crm frame that issued them (view,
+serializer, model...) and their EXPLAIN plan, then flushed into the
+SlowQuery table deduplicated by a fingerprint of the normalized SQL.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connections, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(APP_DIR)
+# Frames from the recorder plumbing itself are never reported as the origin
+_SKIPPED_FILES = {
+    os.path.join(APP_DIR, 'slow_queries.py'),
+    os.path.join(APP_DIR, 'middleware.py'),
+}
+
+_state = threading.local()
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'(?<![\w."])-?\d+(?:\.\d+)?\b')
+_PLACEHOLDER_RE = re.compile(r'%s|\?')
+_IN_LIST_RE = re.compile(r'\bIN \((?:\?, )*\?\)', re.IGNORECASE)
+_VALUES_RE = re.compile(r'\bVALUES (\((?:\?, )*\?\))(?:, \((?:\?, )*\?\))+', re.IGNORECASE)
+
+
+def normalize_sql(sql):
+    """Replace literals and placeholders so equivalent queries share one shape"""
+    sql = _WHITESPACE_RE.sub(' ', sql.strip())
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _PLACEHOLDER_RE.sub('?', sql)
+    sql = _IN_LIST_RE.sub('IN (...)', sql)
+    sql = _VALUES_RE.sub(r'VALUES \1, ...', sql)
+    return sql
+
+
+def fingerprint_sql(sql):
+    return hashlib.sha1(normalize_sql(sql).encode('utf-8')).hexdigest()
+
+
+_TRANSACTION_STATEMENTS = ('SAVEPOINT', 'RELEASE', 'ROLLBACK', 'BEGIN', 'COMMIT', 'SET')
+
+
+def _statement_head(sql):
+    return sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+
+
+def is_transaction_statement(sql):
+    return _statement_head(sql) in _TRANSACTION_STATEMENTS
+
+
+def _origin_frame():
+    """Innermost stack frame that belongs to the crm app (not this module)"""
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        if not filename.startswith(APP_DIR) or filename in _SKIPPED_FILES:
+            continue
+        if os.sep + 'migrations' + os.sep in filename:
+            continue
+        relative = os.path.relpath(filename, BASE_DIR)
+        return f"{relative}:{frame.lineno} in {frame.name}"[:255]
+    return ''
+
+
+def explain(connection, sql, params, analyze=False):
+    """
+    Return the EXPLAIN output for a statement, or '' when it cannot be explained.
+    Runs inside a savepoint so a failing EXPLAIN never breaks the outer transaction.
+    """
+    options = {'analyze': True} if analyze and connection.vendor == 'postgresql' else {}
+    prefix = connection.ops.explain_query_prefix(**options)
+    try:
+        with _suspended(), transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                cursor.execute(f"{prefix} {sql}", params)
+                rows = cursor.fetchall()
+    except (DatabaseError, NotImplementedError, ValueError, TypeError):
+        return ''
+    return '\n'.join(' '.join(str(col) for col in row) for row in rows)
+
+
+@contextmanager
+def _suspended():
+    previous = getattr(_state, 'suspended', False)
+    _state.suspended = True
+    try:
+        yield
+    finally:
+        _state.suspended = previous
+
+
+class SlowQueryRecorder:
+    """Execute wrapper that collects statements slower than the threshold"""
+
+    def __init__(self, connection, threshold_ms, analyze=False, view_name=''):
+        self.connection = connection
+        self.threshold_ms = threshold_ms
+        self.analyze = analyze
+        self.view_name = view_name
+        self.entries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if getattr(_state, 'suspended', False):
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration_ms = (time.perf_counter() - start) * 1000
+
+        if duration_ms >= self.threshold_ms and not is_transaction_statement(sql):
+            plan = ''
+            if not many and _statement_head(sql) in ('SELECT', 'WITH'):
+                plan = explain(self.connection, sql, params, analyze=self.analyze)
+            self.entries.append({
+                'sql': sql,
+                'params': [] if many else _jsonable_params(params),
+                'duration_ms': duration_ms,
+                'origin': _origin_frame(),
+                'plan': plan,
+            })
+        return result
+
+
+def _jsonable_params(params):
+    if params is None:
+        return []
+    if isinstance(params, dict):
+        return {key: str(value) for key, value in params.items()}
+    return [value if isinstance(value, (int, float, bool, type(None))) else str(value) for value in params]
+
+
+@contextmanager
+def capture_slow_queries(using='default', view_name=''):
+    """
+    Record slow statements on `using` for the duration of the block and store
+    them in the SlowQuery table on exit. No-op when the recorder is disabled.
+    """
+    if not getattr(settings, 'SLOW_QUERY_LOG_ENABLED', True) or getattr(_state, 'suspended', False):
+        yield None
+        return
+
+    connection = connections[using]
+    recorder = SlowQueryRecorder(
+        connection,
+        threshold_ms=getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', 1000),
+        analyze=getattr(settings, 'SLOW_QUERY_EXPLAIN_ANALYZE', False),
+        view_name=view_name,
+    )
+    with connection.execute_wrapper(recorder):
+        yield recorder
+    if recorder.entries:
+        store_entries(recorder.entries, view_name=recorder.view_name, using=using)
+
+
+def store_entries(entries, view_name='', using='default'):
+    """Upsert captured entries by fingerprint and trim the table to its bound"""
+    from .models import SlowQuery
+
+    created = False
+    with _suspended():
+        for entry in entries:
+            normalized = normalize_sql(entry['sql'])
+            fingerprint = hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+            duration = entry['duration_ms']
+            queryset = SlowQuery.objects.using(using).filter(fingerprint=fingerprint)
+
+            updated = queryset.update(
+                calls=F('calls') + 1,
+                total_duration_ms=F('total_duration_ms') + duration,
+                max_duration_ms=Greatest(F('max_duration_ms'), duration),
+            )
+            if not updated:
+                try:
+                    with transaction.atomic(using=using):
+                        SlowQuery.objects.using(using).create(
+                            fingerprint=fingerprint,
+                            normalized_sql=normalized,
+                            sample_sql=entry['sql'],
+                            sample_params=entry['params'],
+                            plan=entry['plan'],
+                            origin=entry['origin'],
+                            view_name=view_name,
+                            calls=1,
+                            total_duration_ms=duration,
+                            max_duration_ms=duration,
+                        )
+                    created = True
+                    continue
+                except IntegrityError:
+                    # Another worker inserted the same fingerprint meanwhile
+                    queryset.update(
+                        calls=F('calls') + 1,
+                        total_duration_ms=F('total_duration_ms') + duration,
+                        max_duration_ms=Greatest(F('max_duration_ms'), duration),
+                    )
+
+            # Keep the sample of the slowest execution (max was just raised to it)
+            queryset.filter(max_duration_ms=duration).update(
+                sample_sql=entry['sql'],
+                sample_params=entry['params'],
+                plan=entry['plan'],
+                origin=entry['origin'],
+                view_name=view_name,
+            )
+
+        if created:
+            prune(using=using)
+
+
+def prune(using='default'):
+    """Drop the fastest fingerprints beyond SLOW_QUERY_MAX_ENTRIES"""
+    from .models import SlowQuery
+
+    limit = getattr(settings, 'SLOW_QUERY_MAX_ENTRIES', 500)
+    with _suspended():
+        stale_ids = list(
+            SlowQuery.objects.using(using)
+            .order_by('-max_duration_ms', '-last_seen')
+            .values_list('id', flat=True)[limit:]
+        )
+        if stale_ids:
+            SlowQuery.objects.using(using).filter(id__in=stale_ids).delete()
@@ -0,0 +1,286 @@
+"""
+Offline-first sync for the branch offices (OFICINA_HABANA,
+VICECONSULADO_CAMAGUEY, ...), where every round trip is expensive.
+
+    GET  /api/sync/?location=OFICINA_HABANA&cursor=...
+    POST /api/sync/ {"location", "cursor", "device", "mutations": [...]}
+
+A pull sends what changed since the cursor among the orders in scope: those
+with an open item at the location. The response holds
+- cursor: to send back on the next sync;
+- full: true when the local copy must be replaced (first sync, another
+  location, or a cursor older than SYNC_MAX_CURSOR_AGE_DAYS);
+- scope: the ids of every order in scope (local orders not listed are dropped);
+- orders, items, payments: {"fields": [...], "rows": [[...], ...]}; an order
+  comes with all of its items and payments, which replace the local ones;
+- queue: the location's open items in Smart Queue order.
+The cursor overlaps the previous pull by SYNC_OVERLAP_SECONDS so rows
+committed late by a concurrent transaction are not missed; rows received
+twice carry the same version.
+
+A push applies the mutations queued offline, in order, then pulls, all in
+one request. Each mutation is applied in its own savepoint and recorded
+under its client-generated id (crm.models.SyncMutation), so resending a
+push after a dropped response never applies anything twice.
+
+Orders and items carry a version incremented by every write. A mutation
+names the version it was based on; if the row changed since, it is still
+applied as long as the fields it changes hold the values it saw (`base`),
+otherwise the result is a conflict with the current row. Without a
+base_version the change is applied whatever the row's version.
+
+    {"id": "<uuid>", "type": "item.update", "target": 12, "base_version": 4,
+     "base": {"status": "RECEIVED"}, "data": {"status": "MINJUS_IN"}}
+    {"id": "<uuid>", "type": "order.update", "target": 3, "base_version": 7, "data": {"global_status": "CLOSED"}}
+    {"id": "<uuid>", "type": "order.note", "target": 3, "data": {"text": "..."}}
+    {"id": "<uuid>", "type": "payment.create", "data": {"order": 3, "amount": "20.00", "currency": "EUR", ...}}
+"""
+import uuid
+from datetime import datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import ActivityLog, Order, Payment, ServiceItem, SyncMutation
+from .pagination import InvalidPage, decode_cursor, encode_cursor
+from .projections import datetime_string, decimal_string
+
+ORDER_FIELDS = (
+    'id', 'version', 'order_friendly_id', 'client_id', 'client__full_name', 'client__phone',
+    'global_status', 'payment_status', 'currency', 'total_amount', 'total_paid', 'has_overdue',
+    'notes', 'updated_at',
+)
+
+ITEM_FIELDS = (
+    'id', 'version', 'order_id', 'service_type', 'document_type', 'legalization_type', 'titular_name',
+    'status', 'delivery_destination', 'assigned_tramitador_id', 'responsible', 'logistics_status',
+    'current_location', 'price', 'priority', 'deadline', 'urgency', 'phase_dates', 'notes', 'updated_at',
+)
+
+PAYMENT_FIELDS = ('id', 'order_id', 'amount', 'currency', 'method', 'destination_account', 'payment_date')
+
+# Fields each mutation type may change
+ITEM_MUTABLE = ('status', 'current_location', 'logistics_status', 'responsible', 'notes', 'phase_dates')
+ORDER_MUTABLE = ('global_status', 'notes')
+
+LOCATIONS = dict(ServiceItem.LOCATION_CHOICES)
+
+
+class SyncError(ValueError):
+    pass
+
+
+def _encode(value, tz):
+    if isinstance(value, Decimal):
+        return decimal_string(value)
+    if isinstance(value, datetime):
+        return datetime_string(value, tz)
+    return value
+
+
+def _table(fields, rows, tz):
+    return {'fields': list(fields), 'rows': [[_encode(value, tz) for value in row] for row in rows]}
+
+
+def _since(cursor, location, now):
+    """Start of the delta for this cursor, or None for a full sync"""
+    if not cursor:
+        return None
+    values = decode_cursor(cursor)
+    if len(values) != 2 or not isinstance(values[0], str):
+        raise InvalidPage('Invalid cursor')
+    last = parse_datetime(values[0])
+    if last is None:
+        raise InvalidPage('Invalid cursor')
+    max_age = timezone.timedelta(days=getattr(settings, 'SYNC_MAX_CURSOR_AGE_DAYS', 30))
+    if values[1] != location or last < now - max_age:
+        return None
+    return last - timezone.timedelta(seconds=getattr(settings, 'SYNC_OVERLAP_SECONDS', 120))
+
+
+def pull(location, cursor=None, now=None):
+    """The delta for the location since `cursor` (see the module docstring)"""
+    if location not in LOCATIONS:
+        raise SyncError('Invalid location')
+    now = now or timezone.now()
+    since = _since(cursor, location, now)
+    tz = timezone.get_current_timezone() if settings.USE_TZ else None
+
+    open_here = ServiceItem.objects.filter(current_location=location, urgency__gt=ServiceItem.URGENCY_CLOSED)
+    scope = sorted(set(open_here.values_list('order_id', flat=True).order_by()))
+
+    orders = Order.objects.filter(pk__in=open_here.values('order_id'))
+    if since is not None:
+        # Item writes through update() (assignment, deadline sweep) leave the order untouched
+        orders = orders.filter(Q(updated_at__gte=since) | Exists(
+            ServiceItem.objects.filter(order_id=OuterRef('pk'), updated_at__gte=since)))
+    order_rows = list(orders.order_by('pk').values_list(*ORDER_FIELDS))
+    order_ids = [row[0] for row in order_rows]
+
+    item_rows = payment_rows = []
+    if order_ids:
+        item_rows = ServiceItem.objects.filter(order_id__in=order_ids).order_by('pk').values_list(*ITEM_FIELDS)
+        payment_rows = Payment.objects.filter(order_id__in=order_ids).order_by('pk').values_list(*PAYMENT_FIELDS)
+    queue = open_here.order_by('-urgency', 'deadline', 'id').values_list('pk', flat=True)
+
+    return {
+        'cursor': encode_cursor([now, location]),
+        'full': since is None,
+        'server_time': datetime_string(now, tz),
+        'scope': scope,
+        'orders': _table(ORDER_FIELDS, order_rows, tz),
+        'items': _table(ITEM_FIELDS, item_rows, tz),
+        'payments': _table(PAYMENT_FIELDS, payment_rows, tz),
+        'queue': list(queue[:getattr(settings, 'SYNC_QUEUE_SIZE', 200)]),
+    }
+
+
+def _clean(model, data, allowed):
+    """Validated field values (choices, lengths) for a mutation's data"""
+    if not isinstance(data, dict) or not data or set(data) - set(allowed):
+        raise SyncError(f"data may only change: {', '.join(allowed)}")
+    cleaned = {}
+    for name, value in data.items():
+        try:
+            cleaned[name] = model._meta.get_field(name).clean(value, None)
+        except ValidationError as exc:
+            raise SyncError(f"{name}: {' '.join(exc.messages)}")
+    return cleaned
+
+
+def _conflict(row, mutation, changes):
+    """The row changed since the client saw it, in a field this mutation changes"""
+    base_version = mutation.get('base_version')
+    if base_version is None or base_version == row.version:
+        return False
+    base = mutation.get('base') or {}
+    return any(name not in base or base[name] != getattr(row, name) for name in changes)
+
+
+def _snapshot(row, fields):
+    tz = timezone.get_current_timezone() if settings.USE_TZ else None
+    return {'version': row.version, **{name: _encode(getattr(row, name), tz) for name in fields}}
+
+
+def _update(model, mutation, allowed, user):
+    changes = _clean(model, mutation.get('data'), allowed)
+    if not isinstance(mutation.get('target'), int):
+        raise SyncError('target must be an id')
+    row = model.objects.select_for_update().filter(pk=mutation.get('target')).first()
+    if row is None:
+        raise SyncError(f'{model.__name__} not found')
+    if all(getattr(row, name) == value for name, value in changes.items()):
+        # Already in the requested state (e.g. done by someone else)
+        return 'APPLIED', {'version': row.version}
+    if _conflict(row, mutation, changes):
+        return 'CONFLICT', {'current': _snapshot(row, allowed)}
+
+    if model is ServiceItem:
+        old_status = row.get_status_display()
+        for name, value in changes.items():
+            setattr(row, name, value)
+        row.save(update_fields=list(changes))
+        if 'status' in changes:
+            ActivityLog.objects.create(
+                order_id=row.order_id,
+                user=user,
+                action_type='STATUS_CHANGE',
+                description=f"Servicio '{row.titular_name}': {old_status} → {row.get_status_display()}",
+                metadata={'sync': str(mutation['id'])},
+            )
+    else:
+        for name, value in changes.items():
+            setattr(row, name, value)
+        row.save(update_fields=list(changes))
+    return 'APPLIED', {'version': row.version}
+
+
+def _note(mutation, user):
+    text = (mutation.get('data') or {}).get('text')
+    if not isinstance(text, str) or not text.strip():
+        raise SyncError('data.text is required')
+    if not isinstance(mutation.get('target'), int) or not Order.objects.filter(pk=mutation['target']).exists():
+        raise SyncError('Order not found')
+    log = ActivityLog.objects.create(order_id=mutation['target'], user=user, action_type='NOTE',
+                                     description=text.strip(), metadata={'sync': str(mutation['id'])})
+    return 'APPLIED', {'object_id': log.pk}
+
+
+def _payment(mutation, user):
+    from .serializers import PaymentSerializer
+
+    serializer = PaymentSerializer(data=mutation.get('data') or {})
+    if not serializer.is_valid():
+        raise SyncError(serializer.errors)
+    payment = serializer.save()
+    ActivityLog.objects.create(
+        order_id=payment.order_id,
+        user=user,
+        action_type='PAYMENT',
+        description=f"Pago registrado: {payment.amount} {payment.currency}",
+        metadata={'payment_id': payment.id, 'method': payment.method, 'sync': str(mutation['id'])},
+    )
+    return 'APPLIED', {'object_id': payment.pk}
+
+
+HANDLERS = {
+    'item.update': lambda mutation, user: _update(ServiceItem, mutation, ITEM_MUTABLE, user),
+    'order.update': lambda mutation, user: _update(Order, mutation, ORDER_MUTABLE, user),
+    'order.note': _note,
+    'payment.create': _payment,
+}
+
+
+def push(mutations, user=None, device=''):
+    """Apply the mutations in order; returns one result per mutation"""
+    if not isinstance(mutations, list):
+        raise SyncError('mutations must be a list')
+    if len(mutations) > getattr(settings, 'SYNC_MAX_MUTATIONS', 500):
+        raise SyncError('Too many mutations in one push')
+    for mutation in mutations:
+        try:
+            mutation['id'] = uuid.UUID(str(mutation['id']))
+        except (TypeError, KeyError, ValueError):
+            raise SyncError('Every mutation needs a UUID id')
+
+    recorded = {m.id: m for m in SyncMutation.objects.filter(pk__in=[m['id'] for m in mutations])}
+    results = []
+    for mutation in mutations:
+        previous = recorded.get(mutation['id'])
+        if previous is not None:
+            results.append({**previous.result, 'replayed': True})
+            continue
+
+        kind = mutation.get('type')
+        try:
+            # Claim the id first: a concurrent push of the same mutation waits here
+            with transaction.atomic():
+                record = SyncMutation.objects.create(id=mutation['id'], device=device, kind=str(kind)[:30],
+                                                     status='REJECTED', user=user)
+        except IntegrityError:
+            results.append({**SyncMutation.objects.get(pk=mutation['id']).result, 'replayed': True})
+            continue
+
+        handler = HANDLERS.get(kind)
+        try:
+            with transaction.atomic():
+                if handler is None:
+                    raise SyncError(f'Unknown mutation type: {kind}')
+                outcome, detail = handler(mutation, user)
+                if outcome != 'APPLIED':
+                    # Nothing the handler wrote may stay
+                    transaction.set_rollback(True)
+        except SyncError as exc:
+            outcome, detail = 'REJECTED', {'error': exc.args[0]}
+
+        result = {'id': str(mutation['id']), 'status': outcome.lower(), **detail}
+        SyncMutation.objects.filter(pk=record.pk).update(status=outcome, result=result)
+        recorded[record.pk] = record
+        record.result = result
+        results.append(result)
+    return results
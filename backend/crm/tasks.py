@@ -0,0 +1,68 @@
+"""
+Background tasks (see crm.jobs). Queue them with crm.jobs.enqueue().
+"""
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.mail import send_mail
+
+from .invoices import fingerprint, invoice_documents, invoice_path, render_invoices, store
+from .jobs import task
+from .models import ActivityLog, Order
+
+
+@task(max_attempts=5, backoff=60)
+def send_payment_request(order_id, user_id=None):
+    """Email the client the pending amount of the order"""
+    order = Order.objects.select_related('client').get(pk=order_id)
+    pending = order.total_amount - order.total_paid
+    send_mail(
+        subject=f'Solicitud de pago - Pedido {order.order_friendly_id}',
+        message=(
+            f'Hola {order.client.full_name},\n\n'
+            f'El pedido {order.order_friendly_id} tiene un importe pendiente de {pending} {order.currency} '
+            f'(total {order.total_amount} {order.currency}, pagado {order.total_paid} {order.currency}).\n'
+        ),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        recipient_list=[order.client.email],
+    )
+    ActivityLog.objects.create(
+        order=order,
+        user_id=user_id,
+        action_type='EMAIL',
+        description=f"Solicitud de pago enviada a {order.client.email}",
+    )
+    return {'to': order.client.email, 'pending': str(pending)}
+
+
+@task(max_attempts=1)
+def sweep_deadlines():
+    """crm.deadlines.sweep_overdue() as a job"""
+    from .deadlines import sweep_overdue
+    return {'escalated': sweep_overdue()}
+
+
+@task(max_attempts=3, backoff=10, priority=5)
+def render_invoice(order_id, user_id=None):
+    """Store the invoice PDF of the order's current financial version"""
+    document = invoice_documents([order_id]).get(order_id)
+    if document is None:
+        return None  # Order deleted meanwhile
+    digest = fingerprint(document)
+    if default_storage.exists(invoice_path(digest)):
+        return {'path': invoice_path(digest), 'rendered': False}
+    path = store(document, digest)
+    ActivityLog.objects.create(
+        order_id=order_id,
+        user_id=user_id,
+        action_type='DOCUMENT_GENERATED',
+        description="Factura generada",
+        metadata={'path': path},
+    )
+    return {'path': path, 'rendered': True}
+
+
+@task(max_attempts=3, backoff=30)
+def render_invoice_batch(order_ids):
+    """Invoices of many orders (render_invoices --enqueue)"""
+    rendered, cached = render_invoices(order_ids)
+    return {'rendered': rendered, 'cached': cached}
@@ -0,0 +1,115 @@
+import datetime
+import shutil
+import tempfile
+import unittest
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from crm import analytics, archive
+from crm.models import Client, ExchangeRate, Order, Payment, ServiceItem
+from crm.slow_queries import is_transaction_statement
+
+
+@override_settings(COALESCE_ENABLED=False, FX_BASE_CURRENCY='EUR')
+class AnalyticsSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp(prefix='crm-analytics-')
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        settings = override_settings(ANALYTICS_SNAPSHOT_DIR=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.api = APIClient()
+        self.ana = User.objects.create_user(username='ana')
+        self.client_obj = Client.objects.create(email="bi@test.com", full_name="BI Client")
+        ExchangeRate.objects.create(currency='USD', rate=Decimal('0.50'), effective_date=datetime.date(2020, 1, 1))
+        self.create_order('2026-08', [('LEGALIZATION', 100, 40, self.ana)])
+        self.create_order('2026-09', [('LEGALIZATION', 50, 10, self.ana), ('VISA', 30, 30, None)])
+        self.create_order('2026-09', [('LEGALIZATION', 200, 100, None)], currency='USD')
+        self.create_order('2026-09', [('SHIPPING', 10, 5, None)], currency='CUP')
+
+    def create_order(self, month, items, currency='EUR'):
+        order = Order.objects.create(client=self.client_obj, currency=currency)
+        for service_type, price, cost, tramitador in items:
+            ServiceItem.objects.create(order=order, titular_name="Titular", service_type=service_type,
+                                       price=price, cost=cost, assigned_tramitador=tramitador)
+        year, number = map(int, month.split('-'))
+        created_at = timezone.make_aware(datetime.datetime(year, number, 15, 12))
+        Order.objects.filter(pk=order.pk).update(created_at=created_at)
+        return order
+
+    def test_snapshot_and_reports(self):
+        url = reverse('analytics')
+        response = self.api.get(url)
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('snapshot_analytics', response.data['error'])
+
+        # Archived orders stay in the facts
+        closed = self.create_order('2026-07', [('VISA', 20, 5, self.ana)])
+        Payment.objects.create(order=closed, amount=20)
+        Order.objects.filter(pk=closed.pk).update(global_status='CLOSED')
+        ServiceItem.objects.filter(order=closed).update(status='DELIVERED', urgency=ServiceItem.URGENCY_CLOSED)
+        self.assertEqual(archive.archive_orders(days=-1), 1)
+        call_command('snapshot_analytics', stdout=open('/dev/null', 'w'))
+
+        with CaptureQueriesContext(connection) as ctx:
+            totals = self.api.get(url).data
+        self.assertEqual([q for q in ctx.captured_queries if not is_transaction_statement(q['sql'])], [])
+        self.assertEqual(totals['snapshot']['rows'], 6)
+        self.assertEqual(totals['snapshot']['unconverted'], 1)
+        self.assertEqual(totals['rows'], [{'items': 6, 'price': '300.00', 'cost': '135.00', 'margin': '165.00'}])
+
+        series = self.api.get(url, {'group_by': 'month', 'service_type': 'LEGALIZATION'}).data['rows']
+        self.assertEqual([(row['month'], row['items'], row['margin']) for row in series],
+                         [('2026-08', 1, '60.00'), ('2026-09', 2, '90.00')])
+
+        pivot = self.api.get(url, {'group_by': 'tramitador', 'columns': 'month', 'measure': 'margin',
+                                   'from': '2026-08'}).data
+        self.assertEqual(pivot['columns'], ['2026-08', '2026-09'])
+        self.assertEqual([(row['tramitador'], row['tramitador_name'], row['values'], row['total'])
+                          for row in pivot['rows']],
+                         [(None, None, ['0.00', '50.00'], '50.00'),
+                          (self.ana.pk, 'ana', ['60.00', '40.00'], '100.00')])
+
+        by_currency = self.api.get(url, {'group_by': 'currency', 'columns': 'service_type',
+                                         'measure': 'items', 'tramitador': 'none'}).data
+        self.assertEqual(by_currency['columns'], ['LEGALIZATION', 'SHIPPING', 'VISA'])
+        self.assertEqual([(row['currency'], row['values']) for row in by_currency['rows']],
+                         [('CUP', [0, 1, 0]), ('EUR', [0, 0, 1]), ('USD', [1, 0, 0])])
+        self.assertEqual(self.api.get(url, {'document_type': 'PASAPORTE'}).data['rows'], [])
+
+        for params in ({'group_by': 'client'}, {'measure': 'profit', 'columns': 'month'},
+                       {'from': '2026-13'}, {'group_by': 'month', 'columns': 'month'}):
+            self.assertEqual(self.api.get(url, params).status_code, 400, params)
+
+        # A new snapshot replaces the published one
+        self.create_order('2026-10', [('OTHER', 5, 0, None)])
+        analytics.take_snapshot()
+        self.assertEqual(self.api.get(url).data['snapshot']['rows'], 7)
+
+    @unittest.skipUnless(analytics.np, 'numpy not installed')
+    def test_memory_mapped_columns(self):
+        analytics.take_snapshot()
+        snapshot = analytics.current()
+        self.assertIsInstance(snapshot.columns['margin'], analytics.np.memmap)
+        self.assertEqual(snapshot.columns['margin'].dtype, analytics.np.dtype('<i8'))
+
+        # Same groups as the pure Python fallback
+        group_by, filters = ['month', 'service_type'], [('currency', snapshot.code('currency', 'EUR'))]
+        vectorized = snapshot.aggregate(group_by, filters)
+        with mock.patch.object(analytics, 'np', None):
+            columns = {name: analytics._read_column(f'{self.directory}/{snapshot.manifest["name"]}/{name}.npy')
+                       for name in snapshot.columns}
+            with mock.patch.object(snapshot, 'columns', columns):
+                self.assertEqual(snapshot.aggregate(group_by, filters), vectorized)
@@ -0,0 +1,86 @@
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from crm import archive
+from crm.models import ActivityLog, ArchivedOrder, Client, Order, Payment, ServiceItem
+
+
+@override_settings(COALESCE_ENABLED=False)
+class ArchiveTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.api = APIClient()
+        self.client_obj = Client.objects.create(email="old@test.com", full_name="Old Client")
+        self.closed = [self.create_order('DELIVERED') for _ in range(3)]
+        self.open = self.create_order('MINJUS_IN')
+        self.recent = self.create_order('DELIVERED')
+        Order.objects.exclude(pk=self.recent.pk).update(updated_at=timezone.now() - timezone.timedelta(days=400))
+
+    def create_order(self, status):
+        order = Order.objects.create(client=self.client_obj, global_status='CLOSED')
+        ServiceItem.objects.create(order=order, titular_name="Titular", price=60, status=status)
+        Payment.objects.create(order=order, amount=60)
+        ActivityLog.objects.create(order=order, action_type='NOTE', description='Entregado')
+        return order
+
+    def test_archive_and_restore(self):
+        pk = self.closed[0].pk
+        before = self.api.get(reverse('order-detail', args=[pk])).json()
+        rows = {model: list(model.objects.filter(order_id=pk).order_by('pk').values())
+                for model in (ServiceItem, Payment, ActivityLog)}
+        order_row = Order.objects.filter(pk=pk).values().get()
+
+        self.assertEqual(archive.archive_orders(batch_size=2), 3)
+        self.assertEqual(set(ArchivedOrder.objects.values_list('pk', flat=True)), {o.pk for o in self.closed})
+        self.assertEqual(set(Order.objects.values_list('pk', flat=True)), {self.open.pk, self.recent.pk})
+        self.assertEqual(ServiceItem.objects.count(), 2)
+        self.assertEqual(Payment.objects.count(), 2)
+
+        # Still readable, and marked as archived
+        detail = self.api.get(reverse('order-detail', args=[pk]))
+        self.assertEqual((detail.status_code, detail['X-Archived']), (200, 'true'))
+        self.assertEqual(detail.json(), before)
+        self.assertEqual(self.api.get(reverse('order-detail', args=[pk]), HTTP_IF_NONE_MATCH=detail['ETag'])
+                         .status_code, 304)
+        self.assertEqual(self.api.patch(reverse('order-detail', args=[pk]), {'notes': 'x'}, format='json')
+                         .status_code, 404)
+
+        multi = self.api.get(reverse('order-multi'), {'ids': f'{pk},{self.open.pk},0', 'fields': 'id,total_paid'})
+        self.assertEqual(multi.data['results'][0], {'id': pk, 'status': 200, 'etag': multi.data['results'][0]['etag'],
+                                                    'data': {'id': pk, 'total_paid': '60.00'}, 'archived': True})
+        self.assertNotIn('archived', multi.data['results'][1])
+        self.assertEqual(multi.data['results'][2]['status'], 404)
+
+        portal = self.api.get(reverse('order-list'), {'client_email': 'old@test.com'}).data
+        self.assertEqual([order['id'] for order in portal],
+                         [self.open.pk, self.recent.pk] + [o.pk for o in self.closed])
+
+        call_command('restore_orders', str(pk), stdout=StringIO())
+        restored = Order.objects.filter(pk=pk).values().get()
+        self.assertGreater(restored.pop('updated_at'), order_row.pop('updated_at'))
+        self.assertEqual(restored, order_row)
+        for model, values in rows.items():
+            self.assertEqual(list(model.objects.filter(order_id=pk).order_by('pk').values()), values)
+        after = self.api.get(reverse('order-detail', args=[pk])).json()
+        self.assertEqual(dict(after, updated_at=before['updated_at']), before)
+        self.assertFalse(ArchivedOrder.objects.filter(pk=pk).exists())
+
+        # Not archived again by the next run
+        self.assertEqual(archive.archive_orders(), 0)
+        self.assertTrue(Order.objects.filter(pk=pk).exists())
+
+    def test_open_items_and_debts_stay(self):
+        unpaid = Order.objects.create(client=self.client_obj, global_status='CLOSED')
+        ServiceItem.objects.create(order=unpaid, titular_name="Titular", price=60, status='DELIVERED')
+        Payment.objects.create(order=unpaid, amount=20)
+        Order.objects.filter(pk=unpaid.pk).update(updated_at=timezone.now() - timezone.timedelta(days=400))
+
+        self.assertEqual(set(archive.archivable().values_list('pk', flat=True)), {o.pk for o in self.closed})
+        call_command('archive_orders', '--dry-run', stdout=StringIO())
+        self.assertEqual(ArchivedOrder.objects.count(), 0)
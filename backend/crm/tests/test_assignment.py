@@ -0,0 +1,94 @@
+from django.contrib.auth.models import Group, User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from crm.assignment import apply_plan, plan_assignments
+from crm.models import ActivityLog, Client, Order, ServiceItem
+
+
+@override_settings(COALESCE_ENABLED=False)
+class AutoAssignmentTests(TestCase):
+    def setUp(self):
+        group = Group.objects.create(name='Tramitadores')
+        self.ana = User.objects.create_user(username='ana')
+        self.beto = User.objects.create_user(username='beto')
+        group.user_set.add(self.ana, self.beto)
+        client = Client.objects.create(email="assign@test.com", full_name="Assign Client")
+        self.order = Order.objects.create(client=client)
+
+    def create_item(self, **fields):
+        fields.setdefault('deadline', timezone.now() + timezone.timedelta(days=10))
+        return ServiceItem.objects.create(order=self.order, titular_name="Titular", **fields)
+
+    def test_balances_weighted_workload(self):
+        # Ana already carries a MINJUS + Consulado legalization (effort 3)
+        self.create_item(legalization_type='MINJUS_CONSULADO', assigned_tramitador=self.ana, status='MINJUS_OUT')
+        new = [self.create_item(legalization_type='MINJUS') for _ in range(4)]
+
+        plan = plan_assignments()
+        targets = {a.item: a.tramitador for a in plan.assignments}
+        self.assertEqual(set(targets), {item.id for item in new})
+        self.assertEqual(sum(1 for t in targets.values() if t == self.beto.pk), 3)
+        workload = {row['tramitador']: row['after'] for row in plan.as_dict()['workload']}
+        self.assertEqual(workload, {self.ana.pk: 4.5, self.beto.pk: 4.5})
+
+    def test_urgent_items_go_to_the_least_loaded(self):
+        self.create_item(assigned_tramitador=self.ana, status='MINJUS_OUT')
+        normal = self.create_item(legalization_type='MINJUS_CONSULADO')
+        express = self.create_item(priority='EXPRESS', deadline=None)
+
+        plan = plan_assignments()
+        self.assertEqual([a.item for a in plan.assignments], [express.id, normal.id])
+        self.assertEqual(plan.assignments[0].tramitador, self.beto.pk)
+        self.assertTrue(plan.assignments[0].boosted)
+
+    def test_rebalance_moves_only_unstarted_items(self):
+        started = self.create_item(assigned_tramitador=self.ana, status='MINJUS_OUT')
+        for _ in range(3):
+            self.create_item(assigned_tramitador=self.ana)
+
+        plan = plan_assignments(mode='rebalance')
+        self.assertNotIn(started.id, [a.item for a in plan.assignments])
+        self.assertEqual(apply_plan(plan), 2)
+        self.assertEqual(ServiceItem.objects.filter(assigned_tramitador=self.beto).count(), 2)
+        self.assertEqual(ActivityLog.objects.filter(action_type='ASSIGNMENT').count(), 2)
+
+    def test_preview_then_commit(self):
+        api = APIClient()
+        url = reverse('auto-assign')
+        items = [self.create_item() for _ in range(3)]
+
+        preview = api.post(url, {}, format='json')
+        self.assertEqual(preview.status_code, 200)
+        self.assertFalse(preview.data['committed'])
+        self.assertFalse(ServiceItem.objects.filter(assigned_tramitador__isnull=False).exists())
+
+        # The plan changes once another item arrives
+        self.create_item()
+        stale = api.post(url, {'commit': True, 'plan_id': preview.data['plan_id']}, format='json')
+        self.assertEqual(stale.status_code, 409)
+
+        response = api.post(url, {'commit': True, 'plan_id': stale.data['plan_id']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['applied'], 4)
+        self.assertFalse(ServiceItem.objects.filter(pk__in=[i.pk for i in items], assigned_tramitador=None).exists())
+
+        self.assertEqual(api.post(url, {'mode': 'everything'}, format='json').status_code, 400)
+
+    def test_only_active_tramitadores(self):
+        api = APIClient()
+        url = reverse('auto-assign')
+        item = self.create_item()
+        outsider = User.objects.create_user(username='outsider')
+        User.objects.filter(pk=self.beto.pk).update(is_active=False)
+
+        for ids in ([self.ana.pk, 999999], [outsider.pk], [self.beto.pk]):
+            response = api.post(url, {'tramitadores': ids, 'commit': True}, format='json')
+            self.assertEqual(response.status_code, 400, ids)
+        item.refresh_from_db()
+        self.assertIsNone(item.assigned_tramitador)
+
+        response = api.post(url, {'tramitadores': [self.ana.pk], 'commit': True}, format='json')
+        self.assertEqual(response.data['applied'], 1)
@@ -0,0 +1,90 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from crm.models import ActivityLog, Client, Order, Payment, ServiceItem
+
+
+@override_settings(COALESCE_ENABLED=False)
+class BatchTests(TestCase):
+    def setUp(self):
+        self.client_obj = Client.objects.create(email="lote@test.com", full_name="Lote Client")
+        self.gestor = User.objects.create(username="gestor")
+        self.api = APIClient()
+        self.url = reverse('batch')
+
+    def desk_action(self):
+        return [
+            {'ref': 'cart', 'op': 'order.create', 'data': {
+                'client': self.client_obj.pk, 'currency': 'EUR',
+                'items': [{'service_type': 'LEGALIZATION', 'titular_name': name, 'price': '40.00', 'cost': '10.00'}
+                          for name in ('Ana', 'Luis', 'Marta')]}},
+            {'ref': 'deposit', 'op': 'payment.create',
+             'data': {'order': '$cart', 'amount': '50.00', 'currency': 'EUR', 'method': 'CASH'}},
+            {'op': 'order.update', 'target': '$cart',
+             'data': {'assigned_to': self.gestor.pk, 'global_status': 'IN_PROCESS_PARTIAL'}},
+            {'op': 'item.update', 'target': '$cart.items.0', 'data': {'status': 'RECEIVED'}},
+        ]
+
+    def test_desk_action_in_one_request(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.api.post(self.url, {'operations': self.desk_action()}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        results = response.data['results']
+        self.assertEqual([r['op'] for r in results], ['order.create', 'payment.create', 'order.update', 'item.update'])
+
+        order = Order.objects.get(pk=results[0]['id'])
+        self.assertEqual(order.assigned_to, self.gestor)
+        self.assertEqual(order.global_status, 'IN_PROCESS_PARTIAL')
+        self.assertEqual((order.total_amount, order.total_margin), (Decimal('120.00'), Decimal('90.00')))
+        self.assertEqual((order.total_paid, order.payment_status), (Decimal('50.00'), 'PARTIAL'))
+        self.assertEqual(ServiceItem.objects.get(pk=results[0]['items'][0]).status, 'RECEIVED')
+        self.assertEqual(Payment.objects.get(pk=results[1]['id']).order, order)
+        self.assertEqual(response.data['orders'], [{
+            'id': order.pk, 'version': order.version, 'global_status': 'IN_PROCESS_PARTIAL',
+            'payment_status': 'PARTIAL', 'total_amount': '120.00', 'total_paid': '50.00'}])
+        self.assertEqual(ActivityLog.objects.filter(order=order).count(), 4)
+
+        # Four item writes and a payment, yet the totals were computed once
+        order_updates = [q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "crm_order"')]
+        self.assertEqual(len(order_updates), 2)  # order.update's save() and the recalculation
+
+    def test_failure_rolls_back_everything(self):
+        operations = self.desk_action()
+        operations[3]['data'] = {'status': 'NOPE'}
+        response = self.api.post(self.url, {'operations': operations}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['index'], 3)
+        self.assertIn('status', response.data['details'])
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(Payment.objects.exists())
+        self.assertFalse(ActivityLog.objects.exists())
+
+        response = self.api.post(self.url, {'operations': [
+            {'op': 'order.note', 'target': '$missing', 'data': {'text': 'x'}}]}, format='json')
+        self.assertEqual((response.status_code, response.data['index']), (400, 0))
+        response = self.api.post(self.url, {'operations': [
+            {'op': 'item.update', 'target': 0, 'data': {'status': 'RECEIVED'}}]}, format='json')
+        self.assertEqual(response.status_code, 404)
+        response = self.api.post(self.url, {'operations': [{'op': 'order.delete', 'target': 1}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_operations_on_existing_orders(self):
+        order = Order.objects.create(client=self.client_obj)
+        ServiceItem.objects.create(order=order, titular_name="Ana", price=100)
+        other = Order.objects.create(client=self.client_obj)
+        response = self.api.post(self.url, {'operations': [
+            {'ref': 'extra', 'op': 'item.create', 'data': {'order': order.pk, 'titular_name': 'Luis', 'price': '60.00'}},
+            {'op': 'payment.create', 'data': {'order': order.pk, 'amount': '160.00', 'method': 'TRANSFER'}},
+            {'op': 'order.note', 'target': other.pk, 'data': {'text': 'Llamar mañana'}},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        order.refresh_from_db()
+        self.assertEqual((order.total_amount, order.payment_status), (Decimal('160.00'), 'PAID'))
+        self.assertEqual([o['id'] for o in response.data['orders']], [order.pk, other.pk])
+        self.assertEqual(ActivityLog.objects.get(order=other).description, 'Llamar mañana')
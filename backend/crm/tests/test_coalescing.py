@@ -0,0 +1,117 @@
+import hashlib
+import threading
+import time
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+from crm.coalescing import SingleFlight
+from crm.models import Order, ServiceItem, Client
+from crm.slow_queries import is_transaction_statement
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def run_concurrently(self, flight, compute, threads=8):
+        barrier = threading.Barrier(threads)
+        results, errors = [], []
+
+        def worker():
+            barrier.wait()
+            try:
+                results.append(flight.do('board', compute))
+            except Exception as exc:
+                errors.append(exc)
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return results, errors
+
+    def test_concurrent_callers_share_one_computation(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return True, {'orders': [1, 2, 3]}
+
+        results, errors = self.run_concurrently(SingleFlight(window=0), compute)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'orders': [1, 2, 3]}] * 8)
+        self.assertEqual(errors, [])
+
+    def test_errors_are_shared_and_error_responses_are_not(self):
+        def failing():
+            time.sleep(0.1)
+            raise ValueError('boom')
+
+        results, errors = self.run_concurrently(SingleFlight(window=0), failing)
+        self.assertEqual(len(errors), 8)
+
+        calls = []
+
+        def not_found():
+            calls.append(1)
+            time.sleep(0.1)
+            return False, 404
+
+        self.run_concurrently(SingleFlight(window=0), not_found)
+        self.assertEqual(len(calls), 8)
+
+    def test_result_reused_within_window_and_across_processes(self):
+        flight = SingleFlight(window=5)
+        self.assertEqual(flight.do('board', lambda: (True, 'first')), 'first')
+        self.assertEqual(flight.do('board', lambda: (True, 'second')), 'first')
+
+        # Another process holds the lock for 'queue' and publishes its result shortly
+        digest = hashlib.sha1(b'queue').hexdigest()
+        cache.add(f'crm:sf-lock:{digest}', 1)
+        threading.Timer(0.1, cache.set, args=(f'crm:sf:{digest}', 'theirs', 5)).start()
+        self.assertEqual(flight.do('queue', lambda: (True, 'ours')), 'theirs')
+
+class CoalescedViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client_api = APIClient()
+        crm_client = Client.objects.create(email="poll@test.com", full_name="Poll Client")
+        self.order = Order.objects.create(client=crm_client)
+        ServiceItem.objects.create(order=self.order, titular_name="Polled", price=10, cost=5)
+
+    def get(self, url, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client_api.get(url, params)
+        return response, [q for q in ctx.captured_queries if not is_transaction_statement(q['sql'])]
+
+    def test_identical_polls_reuse_the_board_until_a_write(self):
+        url = reverse('order-kanban')
+        first, queries = self.get(url, with_debt='')
+        self.assertTrue(queries)
+        # Same normalized query: empty values and cache busters are ignored
+        second, queries = self.get(url, _='123')
+        self.assertEqual(queries, [])
+        self.assertEqual(second.content, first.content)
+
+        self.order.notes = 'changed'
+        self.order.save()
+        _, queries = self.get(url)
+        self.assertTrue(queries)
+
+    def test_per_user_queries_are_not_shared(self):
+        url = reverse('order-kanban')
+        gestor = User.objects.create_user('gestor_poll')
+        Order.objects.filter(pk=self.order.pk).update(assigned_to=gestor)
+
+        self.client_api.force_authenticate(gestor)
+        mine = self.client_api.get(url, {'assigned_to_me': '1'}).json()
+        self.client_api.force_authenticate(User.objects.create_user('other_poll'))
+        theirs, queries = self.get(url, assigned_to_me='1')
+        self.assertTrue(queries)
+        self.assertEqual(len(mine['NEW_REQUEST']['orders']), 1)
+        self.assertEqual(len(theirs.json()['NEW_REQUEST']['orders']), 0)
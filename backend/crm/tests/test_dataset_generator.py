@@ -0,0 +1,60 @@
+from django.db.models import Sum
+from django.test import TestCase
+from django.utils import timezone
+from crm.datagen import DatasetGenerator
+from crm.models import Client, Order, ServiceItem, Payment, ActivityLog
+
+class DatasetGeneratorTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now().replace(microsecond=0)
+
+    def snapshot(self):
+        return list(ServiceItem.objects.order_by('id').values_list(
+            'order__order_friendly_id', 'status', 'legalization_type', 'price', 'deadline'
+        ))
+
+    def test_same_seed_same_data(self):
+        """
+        The generator is deterministic for a given seed and reference date.
+        """
+        DatasetGenerator(seed=7, now=self.now).generate(40, chunk_size=15)
+        first = self.snapshot()
+        Client.objects.all().delete()
+
+        DatasetGenerator(seed=7, now=self.now).generate(40, chunk_size=15)
+        self.assertEqual([row[1:] for row in self.snapshot()], [row[1:] for row in first])
+
+    def test_explicit_totals_match_children(self):
+        """
+        Totals and payment status written by bulk_create match what save() would compute.
+        """
+        counts = DatasetGenerator(seed=3, now=self.now).generate(60, chunk_size=25)
+        self.assertEqual(counts['orders'], 60)
+        self.assertEqual(Order.objects.count(), 60)
+        self.assertTrue(ActivityLog.objects.exists())
+
+        for order in Order.objects.all():
+            items = order.items.aggregate(price=Sum('price'), cost=Sum('cost'))
+            paid = order.payments.aggregate(total=Sum('amount'))['total'] or 0
+            self.assertEqual(order.total_amount, items['price'])
+            self.assertEqual(order.total_margin, items['price'] - items['cost'])
+            self.assertEqual(order.total_paid, paid)
+            if paid >= order.total_amount:
+                self.assertEqual(order.payment_status, 'PAID')
+            self.assertLessEqual(order.created_at, self.now)
+
+        self.assertTrue(Payment.objects.exists())
+        self.assertFalse(ServiceItem.objects.filter(deadline__isnull=True).exists())
+
+    def test_indexes_continue_after_deletes(self):
+        """
+        A later run numbers its orders and clients after the largest index stored, not the row count.
+        """
+        DatasetGenerator(seed=5, now=self.now).generate(10)
+        Order.objects.filter(pk__in=Order.objects.order_by('pk').values_list('pk', flat=True)[:4]).delete()
+        generator = DatasetGenerator(seed=5, now=self.now)
+        self.assertEqual(generator.next_index(), 10)
+
+        generator.generate(10)
+        suffixes = [friendly_id[-6:] for friendly_id in Order.objects.values_list('order_friendly_id', flat=True)]
+        self.assertEqual(sorted(suffixes), [f'{index:06X}' for index in range(4, 20)])
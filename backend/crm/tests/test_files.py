@@ -0,0 +1,211 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from crm.files import partial_path, purge_stale_uploads
+from crm.models import ActivityLog, Client, Order, Payment, ServiceItem, Upload
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class ResumableUploadTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        client = Client.objects.create(email="subidas@test.com", full_name="Subidas")
+        self.order = Order.objects.create(client=client)
+        self.item = ServiceItem.objects.create(order=self.order, titular_name="Titular", price=100)
+        self.api = APIClient()
+        self.data = os.urandom(300 * 1024)
+
+    def start(self, data=None, target='FINAL_DOCUMENT', object_id=None):
+        data = self.data if data is None else data
+        response = self.api.post(reverse('upload-create'), {
+            'target': target, 'object_id': object_id or self.item.pk, 'filename': 'Legalización.PDF',
+            'size': len(data), 'sha256': sha256(data),
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return reverse('upload-detail', args=[response.data['id']]), response.data
+
+    def put(self, url, chunk, offset, checksum=None):
+        return self.api.put(url, chunk, content_type='application/octet-stream', HTTP_UPLOAD_OFFSET=str(offset),
+                            HTTP_X_CHUNK_SHA256=checksum or sha256(chunk))
+
+    def upload(self, data):
+        url, created = self.start(data)
+        self.assertEqual(self.put(url, data, 0).status_code, 200)
+        return self.api.post(reverse('upload-complete', args=[created['id']]))
+
+    def test_resume_after_failed_chunks(self):
+        url, created = self.start()
+        self.assertEqual(created['offset'], 0)
+        first, second = self.data[:200 * 1024], self.data[200 * 1024:]
+
+        self.assertEqual(self.put(url, first, 0).data['offset'], len(first))
+        # Corrupted in transit: discarded, the offset does not move
+        response = self.put(url, second, len(first), checksum=sha256(b'other'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.api.get(url).data['offset'], len(first))
+        self.assertEqual(os.path.getsize(partial_path(Upload(pk=created['id']))), len(first))
+        # A retry of an acknowledged chunk gets the offset to resume from
+        response = self.put(url, first, 0)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['offset'], len(first))
+        # Nothing to complete yet
+        self.assertEqual(self.api.post(reverse('upload-complete', args=[created['id']])).status_code, 409)
+
+        self.assertEqual(self.put(url, second, len(first)).data['offset'], len(self.data))
+        with mock.patch.object(Order, 'update_totals') as update_totals:
+            response = self.api.post(reverse('upload-complete', args=[created['id']]))
+        self.assertEqual(response.status_code, 200, response.content)
+        update_totals.assert_not_called()
+
+        digest = sha256(self.data)
+        self.assertEqual(response.data['stored_name'], f'final_documents/{digest[:2]}/{digest}.pdf')
+        self.assertFalse(response.data['deduplicated'])
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.final_document.name, response.data['stored_name'])
+        self.assertEqual(self.item.final_document.read(), self.data)
+        self.assertFalse(os.path.exists(partial_path(Upload(pk=created['id']))))
+        log = ActivityLog.objects.get(order=self.order, action_type='DOCUMENT_UPLOAD')
+        self.assertEqual(log.metadata['sha256'], digest)
+
+        # Completed uploads take no more chunks
+        self.assertEqual(self.put(url, b'x', len(self.data)).status_code, 409)
+
+    def test_same_content_is_stored_once(self):
+        first = self.upload(self.data)
+        other = ServiceItem.objects.create(order=self.order, titular_name="Otro", price=100)
+        url, created = self.start(object_id=other.pk)
+        self.put(url, self.data, 0)
+        second = self.api.post(reverse('upload-complete', args=[created['id']]))
+        self.assertFalse(first.data['deduplicated'])
+        self.assertTrue(second.data['deduplicated'])
+        other.refresh_from_db()
+        self.assertEqual(other.final_document.name, first.data['stored_name'])
+        stored = [name for _, _, names in os.walk(os.path.join(self.media, 'final_documents')) for name in names]
+        self.assertEqual(len(stored), 1)
+
+        payment = Payment.objects.create(order=self.order, amount=10)
+        url, created = self.start(target='PAYMENT_PROOF', object_id=payment.pk)
+        self.put(url, self.data, 0)
+        self.assertEqual(self.api.post(reverse('upload-complete', args=[created['id']])).status_code, 200)
+        payment.refresh_from_db()
+        self.assertTrue(payment.proof_file.name.startswith('payments/'))
+
+    def test_whole_file_checksum_restarts_upload(self):
+        url, created = self.start()
+        self.put(url, self.data[:-1] + b'\0', 0)
+        response = self.api.post(reverse('upload-complete', args=[created['id']]))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.api.get(url).data['offset'], 0)
+
+    def test_validation(self):
+        response = self.api.post(reverse('upload-create'), {
+            'target': 'FINAL_DOCUMENT', 'object_id': 0, 'filename': 'a.pdf', 'size': 10}, format='json')
+        self.assertEqual(response.status_code, 404)
+        response = self.api.post(reverse('upload-create'), {
+            'target': 'FINAL_DOCUMENT', 'object_id': self.item.pk, 'filename': 'a.pdf', 'size': 0}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        url, _ = self.start()
+        self.assertEqual(self.put(url, self.data + b'more', 0).status_code, 400)
+        with override_settings(UPLOAD_MAX_CHUNK_SIZE=1024):
+            self.assertEqual(self.put(url, self.data, 0).status_code, 413)
+        self.assertEqual(self.api.delete(url).status_code, 204)
+        self.assertEqual(self.api.get(url).data['status'], 'ABORTED')
+
+    def test_purge_abandoned_uploads(self):
+        url, created = self.start()
+        self.put(url, self.data[:1024], 0)
+        self.assertEqual(purge_stale_uploads(), 0)
+        Upload.objects.filter(pk=created['id']).update(updated_at=timezone.now() - timezone.timedelta(hours=49))
+        self.assertEqual(purge_stale_uploads(), 1)
+        self.assertEqual(Upload.objects.get(pk=created['id']).status, 'ABORTED')
+        self.assertFalse(os.path.exists(partial_path(Upload(pk=created['id']))))
+
+
+@override_settings(FILE_DOWNLOAD_OFFLOAD='')
+class DocumentDownloadTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        client = Client.objects.create(email="descargas@test.com", full_name="Descargas")
+        self.order = Order.objects.create(client=client)
+        self.item = ServiceItem.objects.create(order=self.order, titular_name="Titular", price=100)
+        self.api = APIClient()
+        self.content = bytes(range(256)) * 4
+        response = self.api.post(reverse('service-item-upload-final', args=[self.item.pk]),
+                                 {'final_document': SimpleUploadedFile('doc.pdf', self.content)}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.url = reverse('service-item-final-document', args=[self.item.pk])
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_ranges(self):
+        response = self.api.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(self.body(response), self.content)
+        etag = response['ETag']
+        self.assertEqual(etag, f'"{sha256(self.content)}"')
+
+        response = self.api.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.content)}')
+        self.assertEqual(self.body(response), self.content[10:20])
+
+        response = self.api.get(self.url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(self.body(response), self.content[-5:])
+        response = self.api.get(self.url, HTTP_RANGE='bytes=1000-', HTTP_IF_RANGE=etag)
+        self.assertEqual(self.body(response), self.content[1000:])
+        # Changed since the first part was downloaded: the whole file
+        response = self.api.get(self.url, HTTP_RANGE='bytes=1000-', HTTP_IF_RANGE='"other"')
+        self.assertEqual(response.status_code, 200)
+
+        response = self.api.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+        self.assertEqual(self.api.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_offload(self):
+        self.item.refresh_from_db()
+        with override_settings(FILE_DOWNLOAD_OFFLOAD='nginx', FILE_DOWNLOAD_ACCEL_PREFIX='/protected-media/'):
+            response = self.api.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.item.final_document.name}')
+        self.assertEqual(response.content, b'')
+        with override_settings(FILE_DOWNLOAD_OFFLOAD='sendfile'):
+            response = self.api.get(self.url)
+        self.assertEqual(response['X-Sendfile'], self.item.final_document.path)
+
+    def test_payment_proof(self):
+        payment = Payment.objects.create(order=self.order, amount=10)
+        url = reverse('payment-proof', args=[payment.pk])
+        self.assertEqual(self.api.get(url).status_code, 404)
+        with mock.patch.object(Order, 'update_totals') as update_totals:
+            response = self.api.post(url, {'proof_file': SimpleUploadedFile('pago.jpg', b'jpeg')},
+                                     format='multipart')
+        self.assertEqual(response.status_code, 200)
+        update_totals.assert_not_called()
+        response = self.api.get(url)
+        self.assertEqual(self.body(response), b'jpeg')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
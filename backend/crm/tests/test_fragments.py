@@ -0,0 +1,84 @@
+from unittest import mock
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from crm.deadlines import sweep_overdue
+from crm.models import Order, ServiceItem, Client, Payment
+from crm.slow_queries import is_transaction_statement
+
+@override_settings(COALESCE_ENABLED=False)
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client_api = APIClient()
+        crm_client = Client.objects.create(email="cache@test.com", full_name="Cache Client")
+        self.order = Order.objects.create(client=crm_client)
+        self.item = ServiceItem.objects.create(order=self.order, titular_name="Cached Item", price=100, cost=40)
+
+    def get_counting_queries(self, url):
+        """GET url and return (response, SQL queries excluding the request savepoints)"""
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client_api.get(url)
+        return response, [q['sql'] for q in ctx.captured_queries if not is_transaction_statement(q['sql'])]
+
+    def kanban_card(self):
+        response = self.client_api.get(reverse('order-kanban'))
+        return response.json()['NEW_REQUEST']['orders'][0]
+
+    def test_warm_requests_only_list_primary_keys(self):
+        """
+        Once cached, kanban, queue and detail only query the primary keys.
+        """
+        urls = [reverse('order-kanban'), reverse('smart-queue'),
+                reverse('order-detail', kwargs={'pk': self.order.pk}), reverse('service-item-list')]
+        cold = [self.client_api.get(url).content for url in urls]
+        for url, content in zip(urls, cold):
+            response, queries = self.get_counting_queries(url)
+            self.assertEqual(len(queries), 1, queries)
+            self.assertEqual(response.content, content)
+
+    def test_save_paths_invalidate_fragments(self):
+        """
+        Saving an item, a payment or an activity log bumps the order version.
+        """
+        self.assertEqual(self.kanban_card()['total_paid'], '0.00')
+        detail_url = reverse('order-detail', kwargs={'pk': self.order.pk})
+        self.client_api.get(detail_url)
+
+        Payment.objects.create(order=self.order, amount=30)
+        self.assertEqual(self.kanban_card()['total_paid'], '30.00')
+
+        self.item.status = 'MINJUS_OUT'
+        self.item.save()
+        self.assertEqual(self.kanban_card()['items'][0]['status'], 'MINJUS_OUT')
+        queue = self.client_api.get(reverse('smart-queue')).json()
+        self.assertEqual(queue[0]['status'], 'MINJUS_OUT')
+
+        response = self.client_api.post(reverse('request-payment', kwargs={'order_id': self.order.pk}))
+        self.assertEqual(response.status_code, 200)
+        detail = self.client_api.get(detail_url).json()
+        self.assertEqual(detail['total_paid'], '30.00')
+        self.assertEqual(len(detail['activity_logs']), 1)
+
+    def test_deadline_fields_recomputed_on_cached_reads(self):
+        """
+        days_until_deadline moves on without a rebuild; the overdue flags
+        change when the sweeper escalates the item.
+        """
+        self.assertFalse(self.kanban_card()['has_overdue'])
+        later = self.item.deadline + timezone.timedelta(days=2)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            response, queries = self.get_counting_queries(reverse('order-kanban'))
+            self.assertEqual(len(queries), 1, queries)
+            card = response.json()['NEW_REQUEST']['orders'][0]
+            self.assertFalse(card['has_overdue'])
+            self.assertEqual(card['items'][0]['days_until_deadline'], -2)
+
+            sweep_overdue()
+            card = self.kanban_card()
+        self.assertTrue(card['has_overdue'])
+        self.assertTrue(card['items'][0]['is_overdue'])
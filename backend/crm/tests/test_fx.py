@@ -0,0 +1,118 @@
+import datetime
+import io
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from crm import fx
+from crm.models import Client, ExchangeRate, Order, Payment, ServiceItem, deferred_totals
+
+
+@override_settings(COALESCE_ENABLED=False, FX_BASE_CURRENCY='EUR')
+class ExchangeRateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.api = APIClient()
+        self.today = timezone.localdate()
+        ExchangeRate.objects.create(currency='USD', rate=Decimal('0.90'),
+                                    effective_date=self.today - datetime.timedelta(days=30))
+        self.client_obj = Client.objects.create(email="fx@test.com", full_name="FX Client")
+
+    def test_rates_by_effective_date_in_memory(self):
+        ExchangeRate.objects.create(currency='USD', rate=Decimal('0.95'), effective_date=self.today)
+        self.assertEqual(fx.rate('USD'), Decimal('0.95'))
+        with self.assertNumQueries(0):
+            self.assertEqual(fx.rate('USD', self.today - datetime.timedelta(days=1)), Decimal('0.90'))
+            self.assertIsNone(fx.rate('USD', self.today - datetime.timedelta(days=31)))
+            self.assertIsNone(fx.rate('CUP'))
+            self.assertEqual(fx.convert(100, 'USD', 'EUR'), Decimal('95.00'))
+        with self.assertRaises(fx.MissingRate):
+            fx.convert(100, 'CUP', 'EUR')
+
+    def test_amounts_in_base_currency(self):
+        order = Order.objects.create(client=self.client_obj, currency='USD')
+        ServiceItem.objects.create(order=order, titular_name="Titular", price=200, cost=50)
+        eur_order = Order.objects.create(client=self.client_obj, currency='EUR')
+        ServiceItem.objects.create(order=eur_order, titular_name="Titular", price=100, cost=40)
+
+        # 90 EUR paid against the USD order count as 100 USD
+        response = self.api.post(reverse('register-payment', args=[order.pk]),
+                                 {'amount': '90.00', 'currency': 'EUR', 'method': 'CASH'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('amount_base', response.data)
+        order.refresh_from_db()
+        self.assertEqual((order.total_paid, order.payment_status, order.balance_due), (100, 'PARTIAL', 100))
+        self.assertEqual((order.total_amount_base, order.total_margin_base, order.balance_due_base),
+                         (Decimal('180.00'), Decimal('135.00'), Decimal('90.00')))
+        self.assertEqual(Payment.objects.get(order=order).amount_base, Decimal('90.00'))
+
+        stats = self.api.get(reverse('dashboard-stats')).data
+        self.assertEqual((stats['total_revenue'], stats['total_revenue_base']), (100, Decimal('280.00')))
+        self.assertEqual((stats['total_margin_base'], stats['balance_due_base']), (Decimal('195.00'), Decimal('190.00')))
+        self.assertEqual(self.api.get(reverse('aging-report')).data['base']['total'], '190.00')
+
+        response = self.api.post(reverse('register-payment', args=[order.pk]),
+                                 {'amount': '10.00', 'currency': 'CUP', 'method': 'CASH'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('currency', response.data)
+
+    def test_payments_before_the_first_rate(self):
+        order = Order.objects.create(client=self.client_obj, currency='EUR')
+        ServiceItem.objects.create(order=order, titular_name="Titular", price=200)
+        old = Payment.objects.create(order=order, amount=50, currency='USD')
+        Payment.objects.filter(pk=old.pk).update(payment_date=timezone.make_aware(datetime.datetime(2018, 8, 2)))
+
+        # Counted at the first USD rate, and a payment in EUR doesn't depend on it
+        response = self.api.post(reverse('register-payment', args=[order.pk]),
+                                 {'amount': '55.00', 'currency': 'EUR', 'method': 'CASH'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        order.refresh_from_db()
+        self.assertEqual((order.total_paid, order.balance_due), (Decimal('100.00'), Decimal('100.00')))
+        Payment.objects.create(order=order, amount=10, currency='EUR')
+        order.refresh_from_db()
+        self.assertEqual(order.total_paid, Decimal('110.00'))
+        with deferred_totals():
+            Payment.objects.create(order=order, amount=10, currency='EUR')
+        order.refresh_from_db()
+        self.assertEqual(order.total_paid, Decimal('120.00'))
+
+    def test_legacy_payments_without_rates(self):
+        ExchangeRate.objects.all().delete()
+        order = Order.objects.create(client=self.client_obj, currency='EUR')
+        ServiceItem.objects.create(order=order, titular_name="Titular", price=100)
+        Payment.objects.bulk_create([Payment(order=order, amount=20, currency='USD')])
+
+        # Counted at face value, as before rates existed
+        with self.assertLogs('crm.models', 'WARNING'):
+            response = self.api.post(reverse('register-payment', args=[order.pk]),
+                                     {'amount': '10.00', 'currency': 'EUR', 'method': 'CASH'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        order.refresh_from_db()
+        self.assertEqual((order.total_paid, order.balance_due, order.payment_status),
+                         (Decimal('30.00'), Decimal('70.00'), 'PARTIAL'))
+
+    def test_rebase(self):
+        order = Order.objects.create(client=self.client_obj, currency='CUP')
+        ServiceItem.objects.create(order=order, titular_name="Titular", price=1000)
+        order.refresh_from_db()
+        self.assertIsNone(order.total_amount_base)
+
+        ExchangeRate.objects.create(currency='CUP', rate=Decimal('0.008'), effective_date=self.today)
+        call_command('rebase_amounts', stdout=io.StringIO())
+        order.refresh_from_db()
+        self.assertEqual((order.total_amount_base, order.balance_due_base), (Decimal('8.00'), Decimal('8.00')))
+
+        ExchangeRate.objects.filter(currency='CUP').update(rate=Decimal('0.01'))
+        fx.invalidate()
+        fx.rebase(only_missing=False)
+        order.refresh_from_db()
+        self.assertEqual(order.total_amount_base, Decimal('10.00'))
+        ExchangeRate.objects.get(currency='CUP').delete()
+        fx.rebase(only_missing=False)
+        order.refresh_from_db()
+        self.assertIsNone(order.total_amount_base)
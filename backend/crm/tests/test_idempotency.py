@@ -0,0 +1,75 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from crm.idempotency import purge_expired_keys
+from crm.models import Client, IdempotencyKey, Order, Payment
+from crm.slow_queries import is_transaction_statement
+
+
+@override_settings(COALESCE_ENABLED=False)
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        self.client_obj = Client.objects.create(email="idem@test.com", full_name="Idem Client")
+        self.order = Order.objects.create(client=self.client_obj)
+        self.api = APIClient()
+        self.payment_url = reverse('register-payment', args=[self.order.pk])
+
+    def pay(self, key, amount='25.00'):
+        return self.api.post(self.payment_url, {'amount': amount, 'currency': 'EUR', 'method': 'CASH'},
+                             format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_first_response(self):
+        first = self.pay('pay-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', first)
+
+        with CaptureQueriesContext(connection) as ctx:
+            retry = self.pay('pay-1')
+        # Replayed from the stored response: one SELECT, nothing written
+        self.assertEqual(len([q for q in ctx.captured_queries if not is_transaction_statement(q['sql'])]), 1)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Payment.objects.filter(order=self.order).count(), 1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_paid, 25)
+
+        # Another key is another payment
+        self.assertEqual(self.pay('pay-2').status_code, 201)
+        self.assertEqual(Payment.objects.filter(order=self.order).count(), 2)
+
+    def test_key_reused_for_another_request(self):
+        self.pay('pay-1')
+        self.assertEqual(self.pay('pay-1', amount='30.00').status_code, 422)
+        self.assertEqual(Payment.objects.filter(order=self.order).count(), 1)
+
+    def test_create_order_and_errors_are_replayed(self):
+        data = {'client': self.client_obj.pk, 'currency': 'EUR',
+                'items': [{'service_type': 'LEGALIZATION', 'titular_name': 'Ana', 'price': '40.00'}]}
+        url = reverse('create-order')
+        first = self.api.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY='cart-1')
+        retry = self.api.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY='cart-1')
+        self.assertEqual((first.status_code, retry.status_code), (201, 201))
+        self.assertEqual(retry.json()['id'], first.json()['id'])
+        self.assertEqual(Order.objects.filter(client=self.client_obj).count(), 2)
+
+        missing = reverse('register-payment', args=[0])
+        for _ in range(2):
+            response = self.api.post(missing, {'amount': '1.00'}, format='json', HTTP_IDEMPOTENCY_KEY='pay-x')
+            self.assertEqual(response.status_code, 404)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+
+    def test_expired_keys(self):
+        self.pay('pay-1')
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timezone.timedelta(seconds=1))
+        # Expired: the request runs again
+        self.assertNotIn('Idempotent-Replayed', self.pay('pay-1'))
+        self.assertEqual(Payment.objects.filter(order=self.order).count(), 2)
+
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timezone.timedelta(seconds=1))
+        self.assertEqual(purge_expired_keys(), 1)
+        self.assertFalse(IdempotencyKey.objects.exists())
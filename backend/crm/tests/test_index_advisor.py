@@ -0,0 +1,26 @@
+from django.test import TestCase
+
+from crm.index_advisor import advise, sequential_scans
+
+TABLES = {'crm_order', 'crm_serviceitem'}
+
+
+class IndexAdvisorTests(TestCase):
+    def test_sequential_scans_in_plans(self):
+        postgres = ('Sort  (cost=10.1..10.2 rows=3 width=8)\n'
+                    '  ->  Seq Scan on crm_order  (cost=0.00..10.0 rows=3 width=8)\n'
+                    '  ->  Index Scan using crm_item_location_idx on crm_serviceitem  (cost=0.29..8.3 rows=1)')
+        self.assertEqual(sequential_scans(postgres, TABLES), ['crm_order'])
+        sqlite = ('3 0 0 SCAN crm_serviceitem\n'
+                  '7 0 0 SCAN crm_order USING INDEX crm_order_board_idx\n'
+                  '9 0 0 SEARCH auth_user USING INTEGER PRIMARY KEY (rowid=?)')
+        self.assertEqual(sequential_scans(sqlite, TABLES), ['crm_serviceitem'])
+        self.assertEqual(sequential_scans('2 0 0 SCAN CONSTANT ROW', TABLES), [])
+
+    def test_view_filters_are_indexed(self):
+        # Below this SQLite prefers scanning the items to probing the order_id index
+        findings = advise(orders=1000)
+        filtered = [(f['route'], f['table']) for f in findings if '?' in f['route'] and f['table'] in TABLES]
+        self.assertEqual(filtered, [])
+        # Reported with where they come from
+        self.assertTrue(all(f['origin'].startswith('crm/') for f in findings))
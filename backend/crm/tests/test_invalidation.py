@@ -0,0 +1,120 @@
+import json
+import socket
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from crm import invalidation
+from crm.fragments import version_key
+from crm.invalidation import InvalidationBus, LocalTransport, UnixSocketTransport, MAX_PAYLOAD_BYTES
+from crm.models import Order, ServiceItem, Client
+
+TWO_WORKERS = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'worker-1'},
+    'worker2': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'worker-2'},
+}
+
+@override_settings(CACHES=TWO_WORKERS, INVALIDATION_BUS='local')
+class InvalidationBusTests(TestCase):
+    def setUp(self):
+        crm_client = Client.objects.create(email="bus@test.com", full_name="Bus Client")
+        self.order = Order.objects.create(client=crm_client)
+        self.item = ServiceItem.objects.create(order=self.order, titular_name="Bus Item", price=10, cost=5)
+        # A second worker: its own local cache, listening on the in-process transport
+        self.worker2 = InvalidationBus(LocalTransport(), cache_alias='worker2')
+        self.worker2.start()
+        self.remote = caches['worker2']
+
+    def tearDown(self):
+        LocalTransport.subscribers.clear()
+
+    def test_bumps_reach_other_workers(self):
+        """
+        A save in this worker replaces the older versions held by the others.
+        """
+        key = version_key('serviceitem', self.item.pk)
+        self.remote.set(key, 1)
+        self.item.status = 'MINJUS_OUT'
+        self.item.save()
+        self.assertGreater(self.remote.get(key), 1)
+        self.assertEqual(self.remote.get(key), caches['default'].get(key))
+        # The order embeds the item, so it was broadcast too (but never cached remotely)
+        self.assertIsNone(self.remote.get(version_key('order', self.order.pk)))
+
+    def test_events_from_a_slower_clock_still_invalidate(self):
+        """
+        A worker whose clock runs ahead holds larger tokens: a bump from this one must still replace them.
+        """
+        key = version_key('order', self.order.pk)
+        self.remote.set(key, 10 ** 20)
+        self.order.save()
+        self.assertEqual(self.remote.get(key), caches['default'].get(key))
+        self.assertLess(self.remote.get(key), 10 ** 20)
+
+    def test_large_events_are_split(self):
+        received = []
+        LocalTransport.subscribers.append(received.append)
+        pks = list(range(1, 5001))
+        invalidation.get_bus().publish('order', pks, 42)
+        self.assertGreater(len(received), 1)
+        self.assertTrue(all(len(payload) <= MAX_PAYLOAD_BYTES for payload in received))
+        self.assertEqual([pk for payload in received for pk in json.loads(payload)['p']], pks)
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'Unix sockets not available')
+class UnixSocketTransportTests(TestCase):
+    def test_datagrams_reach_every_listener(self):
+        directory = tempfile.mkdtemp(prefix='crm-bus-')
+        received, done = [], threading.Event()
+
+        def collect(payload):
+            received.append(payload)
+            if len(received) == 2:
+                done.set()
+
+        listeners = [UnixSocketTransport(directory), UnixSocketTransport(directory)]
+        for transport in listeners:
+            transport.listen(collect)
+        # Left behind by a worker that died without cleaning up
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        stale.bind(str(Path(directory) / 'dead.sock'))
+        stale.close()
+
+        UnixSocketTransport(directory).publish(b'{"m":"order"}')
+        self.assertTrue(done.wait(5))
+        self.assertEqual(received, [b'{"m":"order"}'] * 2)
+        self.assertFalse((Path(directory) / 'dead.sock').exists())
+        for transport in listeners:
+            transport.close()
+
+    @override_settings(CACHES=TWO_WORKERS)
+    def test_lost_datagrams_drop_the_local_cache(self):
+        directory = tempfile.mkdtemp(prefix='crm-bus-')
+        worker2 = InvalidationBus(UnixSocketTransport(directory), cache_alias='worker2')
+        worker2.start()
+        self.addCleanup(worker2.close)
+        remote, key = caches['worker2'], version_key('order', 1)
+        sender = InvalidationBus(UnixSocketTransport(directory))
+
+        def wait_for(condition):
+            for _ in range(500):
+                if condition():
+                    return True
+                threading.Event().wait(0.01)
+            return False
+
+        remote.set(key, 'old')
+        sender.publish('order', [1], 'a')
+        self.assertTrue(wait_for(lambda: remote.get(key) == 'a'))
+        remote.set('fragment', 'cached')
+        sender.publish('order', [1], 'b')
+        self.assertTrue(wait_for(lambda: remote.get(key) == 'b'))
+        self.assertEqual(remote.get('fragment'), 'cached')
+
+        # The next datagram never arrived (receiver queue full, send timed out)
+        sender.transport.sequence += 1
+        with self.assertLogs('crm.invalidation', 'WARNING'):
+            sender.publish('order', [1], 'c')
+            self.assertTrue(wait_for(lambda: remote.get('fragment') is None))
+        self.assertIsNone(remote.get(key))
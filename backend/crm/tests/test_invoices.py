@@ -0,0 +1,73 @@
+import re
+import shutil
+import tempfile
+import zlib
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from crm.invoices import invoice_documents, render, render_invoices
+from crm.jobs import Worker
+from crm.models import ActivityLog, Client, Order, Payment, ServiceItem
+
+
+class InvoiceTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        client = Client.objects.create(email="factura@test.com", full_name="Núñez (Facturas)")
+        self.order = Order.objects.create(client=client)
+        ServiceItem.objects.create(order=self.order, titular_name="Titular", document_type="Nacimiento",
+                                   legalization_type="MINJUS", price=120)
+        self.url = reverse('generate-invoice', kwargs={'order_id': self.order.pk})
+        self.api = APIClient()
+
+    def work_off(self):
+        with mock.patch('crm.jobs.close_old_connections'):
+            Worker(name='test', burst=True).run()
+
+    def test_pdf_structure(self):
+        pdf = render(invoice_documents([self.order.pk])[self.order.pk])
+        self.assertTrue(pdf.startswith(b'%PDF-1.4'))
+        xref = int(re.search(rb'startxref\n(\d+)', pdf).group(1))
+        self.assertTrue(pdf[xref:].startswith(b'xref'))
+        offsets = re.findall(rb'(\d{10}) 00000 n', pdf)
+        for number, offset in enumerate(offsets, start=1):
+            self.assertTrue(pdf[int(offset):].startswith(b'%d 0 obj' % number))
+        stream = re.search(rb'stream\n(.*?)\nendstream', pdf, re.S).group(1)
+        content = zlib.decompress(stream)
+        # WinAnsi text with PDF string escapes
+        self.assertIn('(Núñez \\(Facturas\\))'.encode('cp1252'), content)
+        self.assertIn(b'(120.00 EUR)', content)
+
+    def test_rendered_off_the_request_path_then_served_from_storage(self):
+        response = self.api.get(self.url)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.api.get(self.url).data['job'], response.data['job'])
+
+        self.work_off()
+        response = self.api.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+        etag = response['ETag']
+        self.assertEqual(self.api.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(ActivityLog.objects.filter(action_type='DOCUMENT_GENERATED').count(), 1)
+
+        # A payment changes the financial version: a new invoice is rendered
+        Payment.objects.create(order=self.order, amount=50)
+        self.assertEqual(self.api.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 202)
+        self.work_off()
+        self.assertNotEqual(self.api.get(self.url)['ETag'], etag)
+
+    def test_batch_skips_stored_invoices(self):
+        other = Order.objects.create(client=self.order.client)
+        self.assertEqual(render_invoices([self.order.pk, other.pk]), (2, 0))
+        self.assertEqual(render_invoices([self.order.pk, other.pk]), (0, 2))
+        self.assertEqual(self.api.get(self.url).status_code, 200)
@@ -0,0 +1,97 @@
+from unittest import mock
+
+from django.core import mail
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from crm import tasks
+from crm.jobs import Worker, enqueue, task
+from crm.models import ActivityLog, Client, Job, Order
+
+calls = []
+
+
+@task(max_attempts=2, backoff=10)
+def flaky(fail=True):
+    calls.append(fail)
+    if fail:
+        raise RuntimeError('service unavailable')
+    return 'ok'
+
+
+def run_burst():
+    worker = Worker(name='test', burst=True)
+    # The test transaction must not be closed between jobs
+    with mock.patch('crm.jobs.close_old_connections'):
+        worker.run()
+    return worker
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+        client = Client.objects.create(email="jobs@test.com", full_name="Jobs Client")
+        self.order = Order.objects.create(client=client, total_amount=100)
+
+    def test_payment_request_is_sent_by_a_worker(self):
+        api = APIClient()
+        url = reverse('request-payment', kwargs={'order_id': self.order.pk})
+        first = api.post(url).data['job']
+        # Requested twice before the worker ran: one email
+        self.assertEqual(api.post(url).data['job'], first)
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.assertEqual(run_burst().processed, 1)
+        self.assertEqual(Job.objects.get(pk=first).status, 'DONE')
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['jobs@test.com'])
+        self.assertTrue(ActivityLog.objects.filter(order=self.order, action_type='EMAIL').exists())
+
+        # Once sent, a new request queues a new email
+        self.assertNotEqual(api.post(url).data['job'], first)
+
+    def test_retries_with_backoff_then_fails(self):
+        job = enqueue(flaky)
+        with self.assertLogs('crm.jobs', 'WARNING'):
+            run_burst()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('QUEUED', 1))
+        self.assertIn('service unavailable', job.last_error)
+        self.assertGreater(job.run_at, timezone.now() + timezone.timedelta(seconds=7))
+
+        # Not due yet
+        self.assertEqual(run_burst().processed, 0)
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with self.assertLogs('crm.jobs', 'WARNING'):
+            run_burst()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('FAILED', 2))
+        self.assertEqual(calls, [True, True])
+
+    def test_priority_and_results(self):
+        low = enqueue(flaky, fail=False)
+        high = enqueue(flaky, fail=False, priority=5)
+        worker = Worker(name='test')
+        self.assertEqual(worker.claim().pk, high.pk)
+        self.assertEqual(worker.claim().pk, low.pk)
+        self.assertIsNone(worker.claim())
+
+        worker.run_job(Job.objects.get(pk=low.pk))
+        self.assertEqual(Job.objects.get(pk=low.pk).result, 'ok')
+
+    def test_jobs_of_dead_workers_are_requeued(self):
+        job = enqueue(tasks.send_payment_request, order_id=self.order.pk)
+        Worker(name='dead').claim()
+        Job.objects.filter(pk=job.pk).update(started_at=timezone.now() - timezone.timedelta(hours=1))
+
+        with self.assertLogs('crm.jobs', 'WARNING'):
+            Worker(name='test').maintenance()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('QUEUED', 1))
+        self.assertIn('dead', job.last_error)
+
+    def test_only_tasks_can_be_queued(self):
+        with self.assertRaises(ValueError):
+            enqueue(print)
@@ -0,0 +1,47 @@
+import random
+
+from django.test import SimpleTestCase
+from crm.loadtest import LoadTest, Stats, percentile
+
+class LoadTestStatsTests(SimpleTestCase):
+    def test_percentiles_per_endpoint(self):
+        """
+        Latencies are summarised per endpoint with nearest-rank percentiles.
+        """
+        self.assertEqual(percentile(list(range(1, 101)), 95), 95)
+        self.assertEqual(percentile([7], 99), 7)
+
+        stats = Stats()
+        for latency in range(1, 11):
+            stats.record('GET /orders/kanban/', latency, ok=True, size=1024)
+        stats.record('POST /orders/create/', 50, ok=False, size=0)
+
+        summary = stats.summary(elapsed=2)
+        kanban = summary['endpoints']['GET /orders/kanban/']
+        self.assertEqual(summary['requests'], 11)
+        self.assertEqual(summary['errors'], 1)
+        self.assertEqual(kanban['rps'], 5)
+        self.assertEqual(kanban['p50_ms'], 5)
+        self.assertEqual(kanban['p90_ms'], 9)
+        self.assertEqual(kanban['max_ms'], 10)
+        self.assertEqual(kanban['avg_kb'], 1)
+
+    def test_items_advance_from_the_version_read(self):
+        """
+        Tramitadores send the next phase of the status they read, conditional on its version.
+        """
+        phases = ['RECEIVED', 'MINJUS_IN', 'MINJUS_OUT', 'DELIVERED']
+        test = LoadTest('http://testserver/api', {'orders': [], 'clients': [], 'items': [{'id': 1, 'phases': phases}]})
+        sent = []
+
+        def request(method, path, endpoint, payload=None):
+            sent.append((method, endpoint, payload))
+            return {'id': 1, 'status': 'DELIVERED', 'version': 7} if endpoint == '/service-items/<id>/' else None
+
+        test.request = request
+        test.tramitador(random.Random(1))
+        self.assertEqual(sent[1:], [
+            ('GET', '/service-items/<id>/', None),
+            ('PATCH', '/service-items/<id>/update_status/',
+             {'status': 'RECEIVED', 'current_location': 'OFICINA_HABANA', 'version': 7}),
+        ])
@@ -0,0 +1,103 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from crm.models import Client, Order, Payment, ServiceItem
+from crm.slow_queries import is_transaction_statement
+
+
+@override_settings(COALESCE_ENABLED=False)
+class MultiGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.api = APIClient()
+        client = Client.objects.create(email="multi@test.com", full_name="Multi Client")
+        self.orders = [Order.objects.create(client=client) for _ in range(6)]
+        for order in self.orders:
+            ServiceItem.objects.create(order=order, titular_name="Titular", price=50)
+            Payment.objects.create(order=order, amount=10)
+        self.url = reverse('order-multi')
+
+    def get(self, ids, **extra):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.api.get(self.url, {'ids': ','.join(map(str, ids)), **extra.pop('params', {})}, **extra)
+        return response, [q for q in ctx.captured_queries if not is_transaction_statement(q['sql'])]
+
+    def test_same_details_in_fixed_queries(self):
+        ids = [order.pk for order in self.orders]
+        two, two_queries = self.get([*ids[:2], 0])
+        cache.clear()
+        six, six_queries = self.get([*ids, 0])
+        self.assertEqual(six.status_code, 200)
+        self.assertEqual(len(six_queries), len(two_queries))
+
+        results = six.data['results']
+        self.assertEqual([r['id'] for r in results], [*ids, 0])
+        self.assertEqual(results[-1], {'id': 0, 'status': 404})
+        detail = self.api.get(reverse('order-detail', args=[ids[0]]))
+        self.assertEqual(results[0]['data'], detail.json())
+        self.assertEqual(results[0]['etag'], detail['ETag'])
+        self.assertEqual(len(results[0]['data']['payments']), 1)
+
+        # Warm: only the primary keys are queried
+        self.assertEqual(len(self.get(ids)[1]), 1)
+
+    def test_fields_and_etags(self):
+        ids = [order.pk for order in self.orders[:3]]
+        response, _ = self.get(ids, params={'fields': 'id,total_paid,items'})
+        first = response.data['results']
+        self.assertEqual(list(first[0]['data']), ['id', 'total_paid', 'items'])
+
+        Payment.objects.create(order=self.orders[1], amount=5)
+        held = ', '.join(result['etag'] for result in first)
+        response, _ = self.get(ids, params={'fields': 'id,total_paid,items'}, HTTP_IF_NONE_MATCH=held)
+        results = response.data['results']
+        self.assertEqual([r['status'] for r in results], [304, 200, 304])
+        self.assertNotIn('data', results[0])
+        self.assertEqual(results[1]['data']['total_paid'], '15.00')
+
+        # Another selection is another representation
+        response, _ = self.get(ids, params={'fields': 'id'}, HTTP_IF_NONE_MATCH=held)
+        self.assertEqual([r['status'] for r in response.data['results']], [200, 200, 200])
+
+        detail_url = reverse('order-detail', args=[ids[0]])
+        etag = self.api.get(detail_url)['ETag']
+        self.assertEqual(self.api.get(detail_url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.assertEqual(self.get(ids, params={'fields': 'id,secret'})[0].status_code, 400)
+        self.assertEqual(self.api.get(self.url, {'ids': 'a,b'}).status_code, 400)
+        with override_settings(MULTI_GET_MAX_IDS=2):
+            self.assertEqual(self.get(ids)[0].status_code, 400)
+
+    def test_service_items(self):
+        items = list(ServiceItem.objects.order_by('pk').values_list('pk', flat=True))
+        response = self.api.get(reverse('service-item-multi'), {'ids': ','.join(map(str, items)), 'fields': 'id,status'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['data'] for r in response.data['results']],
+                         [{'id': pk, 'status': 'INIT'} for pk in items])
+
+        detail = self.api.get(reverse('service-item-detail', args=[items[0]]))
+        self.assertEqual(detail.data['titular_name'], 'Titular')
+        self.assertEqual(self.api.get(reverse('service-item-detail', args=[items[0]]),
+                                      HTTP_IF_NONE_MATCH=detail['ETag']).status_code, 304)
+        self.assertEqual(self.api.get(reverse('service-item-detail', args=[0])).status_code, 404)
+
+    def test_etags_follow_the_days_until_deadline(self):
+        url = reverse('order-detail', args=[self.orders[0].pk])
+        detail = self.api.get(url)
+        self.assertEqual(self.api.get(url, HTTP_IF_NONE_MATCH=detail['ETag']).status_code, 304)
+
+        # A day later, without any write, the deadline is a day closer
+        tomorrow = timezone.now() + timezone.timedelta(days=1)
+        with mock.patch('django.utils.timezone.now', return_value=tomorrow):
+            later = self.api.get(url, HTTP_IF_NONE_MATCH=detail['ETag'])
+        self.assertEqual(later.status_code, 200)
+        self.assertEqual(later.data['items'][0]['days_until_deadline'],
+                         detail.data['items'][0]['days_until_deadline'] - 1)
+        self.assertNotEqual(later['ETag'], detail['ETag'])
@@ -0,0 +1,85 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from crm.models import ActivityLog, Client, Order, ServiceItem, VersionConflict
+
+
+@override_settings(COALESCE_ENABLED=False)
+class OptimisticLockingTests(TestCase):
+    def setUp(self):
+        client = Client.objects.create(email="lock@test.com", full_name="Lock Client")
+        self.order = Order.objects.create(client=client)
+        self.item = ServiceItem.objects.create(order=self.order, titular_name="Titular", price=80, status='INIT')
+        self.order.refresh_from_db()
+        self.api = APIClient()
+        self.order_url = reverse('order-detail', args=[self.order.pk])
+        self.item_url = reverse('service-item-update-status', args=[self.item.pk])
+
+    def test_patch_writes_only_the_fields_sent(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.api.patch(self.order_url, {'notes': 'Urgente', 'version': self.order.version},
+                                      format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['version'], self.order.version + 1)
+        update = next(q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE "crm_order"'))
+        self.assertNotIn('total_amount', update)
+        self.assertIn('"crm_order"."version" =', update.split('WHERE')[1])
+
+    def test_stale_order_version(self):
+        read = self.api.get(self.order_url).data
+        # Another gestor changes the order, then a payment changes the totals
+        self.api.patch(self.order_url, {'global_status': 'PENDING_PAYMENT', 'version': read['version']}, format='json')
+        ServiceItem.objects.create(order=self.order, titular_name="Otro", price=20)
+
+        response = self.api.patch(self.order_url, {'global_status': 'IN_PROCESS_PAID', 'version': read['version']},
+                                  format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['current']['global_status'], 'PENDING_PAYMENT')
+        self.assertEqual(response.data['current']['total_amount'], '100.00')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.global_status, 'PENDING_PAYMENT')
+        self.assertEqual(ActivityLog.objects.filter(order=self.order, action_type='STATUS_CHANGE').count(), 1)
+
+        # Retried from the current state
+        response = self.api.patch(self.order_url, {'global_status': 'IN_PROCESS_PAID',
+                                                   'version': response.data['current']['version']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.api.patch(self.order_url, {'notes': 'x', 'version': 'v1'}, format='json').status_code,
+                         400)
+        # Without a version there is nothing to check against
+        self.assertEqual(self.api.patch(self.order_url, {'notes': 'x'}, format='json').status_code, 428)
+        self.assertEqual(self.api.patch(self.item_url, {'status': 'MINJUS_IN'}, format='json').status_code, 428)
+
+    def test_stale_item_version(self):
+        version = self.item.version
+        response = self.api.patch(self.item_url, {'status': 'MINJUS_IN', 'version': version}, format='json')
+        self.assertEqual((response.status_code, response.data['version']), (200, version + 1))
+
+        response = self.api.patch(self.item_url, {'status': 'MINJUS_OUT', 'version': version}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['current']['status'], 'MINJUS_IN')
+        self.assertEqual(ServiceItem.objects.get(pk=self.item.pk).status, 'MINJUS_IN')
+
+    def test_save_with_expected_version(self):
+        stale = Order.objects.get(pk=self.order.pk)
+        Order.objects.filter(pk=self.order.pk).update(version=stale.version + 1)
+        stale.notes = 'Perdida'
+        with self.assertRaises(VersionConflict):
+            stale.save(update_fields=['notes'], expected_version=stale.version)
+        self.assertEqual(Order.objects.get(pk=self.order.pk).notes, '')
+
+        fresh = Order.objects.get(pk=self.order.pk)
+        loaded = fresh.version
+        fresh.notes, fresh.total_paid = 'Guardada', 999
+        fresh.save(update_fields=['notes'], expected_version=loaded)
+        self.assertEqual(fresh.version, loaded + 1)
+        stored = Order.objects.get(pk=self.order.pk)
+        self.assertEqual((stored.notes, stored.version, stored.total_paid), ('Guardada', fresh.version, 0))
+        self.assertGreater(stored.updated_at, stale.updated_at)
+
+        Order.objects.filter(pk=self.order.pk).delete()
+        with self.assertRaises(VersionConflict):
+            fresh.save(update_fields=['notes'], expected_version=fresh.version)
@@ -0,0 +1,66 @@
+from unittest import mock
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory
+from crm.datagen import DatasetGenerator
+from crm.models import Order, ServiceItem
+from crm.projections import order_list_rows, service_item_rows
+from crm.serializers import OrderListSerializer, ServiceItemSerializer
+
+class ProjectionEquivalenceTests(TestCase):
+    """
+    The values()-based read path must render to exactly the same bytes as the
+    serializers it replaces on the list endpoints.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        DatasetGenerator(seed=7).generate(40)
+        # Cover the optional branches: unassigned order/item, stored file, unknown types
+        order = Order.objects.order_by('id').first()
+        Order.objects.filter(pk=order.pk).update(assigned_to=None, total_amount=0)
+        ServiceItem.objects.filter(pk=order.items.order_by('id').first().pk).update(
+            assigned_tramitador=None, final_document='final_documents/acta.pdf',
+            legalization_type='', document_type='OTRO_TIPO', deadline=None,
+        )
+        User.objects.filter(username='tramitador1').update(username='tramitador_ñ')
+
+    def setUp(self):
+        self.client_api = APIClient()
+        self.now = timezone.now()
+
+    def render(self, data):
+        return JSONRenderer().render(data)
+
+    def test_order_list_rows_match_serializer(self):
+        orders = Order.objects.order_by('-created_at')
+        with mock.patch('django.utils.timezone.now', return_value=self.now):
+            expected = OrderListSerializer(orders, many=True).data
+        self.assertEqual(self.render(order_list_rows(orders, now=self.now)), self.render(expected))
+
+    def test_service_item_rows_match_serializer(self):
+        request = APIRequestFactory().get('/api/service-items/')
+        items = ServiceItem.objects.order_by('id')
+        with mock.patch('django.utils.timezone.now', return_value=self.now):
+            expected = ServiceItemSerializer(items, many=True, context={'request': request}).data
+        self.assertEqual(self.render(service_item_rows(items, request=request, now=self.now)),
+                         self.render(expected))
+
+    def test_endpoints_match_serializers(self):
+        with mock.patch('django.utils.timezone.now', return_value=self.now):
+            kanban = self.client_api.get(reverse('order-kanban'))
+            queue = self.client_api.get(reverse('smart-queue'))
+
+            expected_kanban = {value: {'label': label, 'orders': []} for value, label in Order.GLOBAL_STATUS_CHOICES}
+            orders = Order.objects.order_by('-created_at')
+            for order, data in zip(orders, OrderListSerializer(orders, many=True).data):
+                expected_kanban[order.global_status]['orders'].append(data)
+            # Same items, in the order the queue returned them
+            queue_ids = [item['id'] for item in queue.json()]
+            items = ServiceItem.objects.in_bulk(queue_ids)
+            expected_queue = ServiceItemSerializer([items[pk] for pk in queue_ids], many=True).data
+
+        self.assertEqual(kanban.content, self.render(expected_kanban))
+        self.assertEqual(queue.content, self.render(expected_queue))
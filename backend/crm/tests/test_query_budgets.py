@@ -0,0 +1,25 @@
+from django.test import TestCase
+from crm.benchmarks import QUERY_BUDGETS, route_names, run_benchmark, check_results
+
+class QueryBudgetTests(TestCase):
+    def test_every_route_has_a_budget(self):
+        """
+        New routes in crm/urls.py must be added to the benchmark.
+        """
+        self.assertEqual(sorted(route_names()), sorted(QUERY_BUDGETS))
+
+    def test_endpoints_within_budget_and_constant(self):
+        """
+        Query counts stay within budget and do not grow with the number of orders.
+        """
+        report = run_benchmark(sizes=(3, 15))
+        self.assertEqual(report['failures'], [])
+
+    def test_growth_is_reported(self):
+        results = {'order-kanban': {
+            10: {'status': 200, 'queries': 2, 'wall_ms': 1, 'peak_kb': 1},
+            100: {'status': 200, 'queries': 40, 'wall_ms': 1, 'peak_kb': 1},
+        }}
+        failures = check_results(results, {'order-kanban': 50})
+        self.assertEqual(len(failures), 1)
+        self.assertIn('N+1', failures[0])
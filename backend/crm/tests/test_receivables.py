@@ -0,0 +1,71 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from crm.models import Client, Order, Payment, ServiceItem, deferred_totals
+from crm.receivables import aging_report
+from crm.slow_queries import is_transaction_statement
+
+
+@override_settings(COALESCE_ENABLED=False)
+class AgingReportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.api = APIClient()
+        self.ana = Client.objects.create(email="ana@test.com", full_name="Ana")
+        self.luis = Client.objects.create(email="luis@test.com", full_name="Luis")
+
+    def create_order(self, client, price, paid=0, days=0, currency='EUR'):
+        order = Order.objects.create(client=client, currency=currency)
+        ServiceItem.objects.create(order=order, titular_name="Titular", price=price)
+        if paid:
+            Payment.objects.create(order=order, amount=paid)
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timezone.timedelta(days=days))
+        return order
+
+    def test_balance_due_follows_the_totals(self):
+        order = self.create_order(self.ana, 100, paid=30)
+        order.refresh_from_db()
+        self.assertEqual(order.balance_due, 70)
+
+        ServiceItem.objects.create(order=order, titular_name="Otro", price=50)
+        Payment.objects.create(order=order, amount=120)
+        order.refresh_from_db()
+        self.assertEqual(order.balance_due, 0)
+        with deferred_totals():
+            ServiceItem.objects.create(order=order, titular_name="Tercero", price=15)
+        order.refresh_from_db()
+        self.assertEqual(order.balance_due, 15)
+
+        kanban = self.api.get(reverse('order-kanban'), {'with_debt': '1'}).data
+        self.assertEqual([o['id'] for column in kanban.values() for o in column['orders']], [order.pk])
+
+    def test_buckets(self):
+        self.create_order(self.ana, 100, paid=40, days=5)
+        self.create_order(self.ana, 80, days=45)
+        self.create_order(self.ana, 50, days=200)
+        self.create_order(self.luis, 30, days=75)
+        self.create_order(self.luis, 90, paid=90, days=120)
+        self.create_order(self.luis, 25, days=10, currency='USD')
+
+        with CaptureQueriesContext(connection) as ctx:
+            report = self.api.get(reverse('aging-report')).data
+        self.assertEqual(len([q for q in ctx.captured_queries if not is_transaction_statement(q['sql'])]), 1)
+        self.assertEqual([b['label'] for b in report['buckets']], ['0-30', '31-60', '61-90', '90+'])
+        ana = report['rows'][0]
+        self.assertEqual((ana['client_name'], ana['orders'], ana['total']), ('Ana', 3, '190.00'))
+        self.assertEqual([ana[b['key']] for b in report['buckets']], ['60.00', '80.00', '0.00', '50.00'])
+        self.assertEqual(report['by_currency']['EUR']['days_61_90'], '30.00')
+        self.assertEqual(report['by_currency']['EUR']['total'], '220.00')
+        self.assertEqual(report['by_currency']['USD']['days_0_30'], '25.00')
+        self.assertEqual([r['currency'] for r in report['rows']], ['EUR', 'EUR', 'USD'])
+
+        # Cached until a payment or item changes a balance
+        with self.assertNumQueries(0):
+            self.assertEqual(aging_report(), report)
+        Payment.objects.create(order=Order.objects.get(total_amount=80), amount=80)
+        self.assertEqual(aging_report()['by_currency']['EUR']['days_31_60'], '0.00')
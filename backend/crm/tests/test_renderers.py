@@ -0,0 +1,81 @@
+import gzip
+import unittest
+from decimal import Decimal
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from crm.models import Order, ServiceItem, Client, Payment
+from crm import middleware, renderers
+from crm.renderers import ORJSONRenderer, MessagePackRenderer
+
+class RendererTests(TestCase):
+    def setUp(self):
+        self.client_api = APIClient()
+        crm_client = Client.objects.create(email="render@test.com", full_name="José Ñuñez  ")
+        self.order = Order.objects.create(client=crm_client, notes="línea\u2028fin\u2029")
+        ServiceItem.objects.create(order=self.order, titular_name="María", price=Decimal('120.50'),
+                                   cost=Decimal('40.10'), deadline=timezone.now())
+        Payment.objects.create(order=self.order, amount=Decimal('20.25'))
+        self.order.refresh_from_db()
+
+    @unittest.skipUnless(renderers.orjson, 'orjson not installed')
+    def test_orjson_output_matches_drf_renderer(self):
+        """
+        The orjson renderer produces the exact same bytes as DRF's JSONRenderer
+        (Decimals, datetimes, non-ASCII and U+2028/2029 included).
+        """
+        for name, kwargs in [('order-kanban', {}), ('order-detail', {'pk': self.order.pk}),
+                             ('smart-queue', {})]:
+            data = self.client_api.get(reverse(name, kwargs=kwargs)).data
+            self.assertEqual(ORJSONRenderer().render(data, 'application/json'),
+                             JSONRenderer().render(data, 'application/json'), name)
+
+        data = {'amount': Decimal('1.10'), 'when': timezone.now(), 1: None, 'nested': [{'x': 1.5}]}
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    @unittest.skipUnless(renderers.msgpack, 'msgpack not installed')
+    def test_messagepack_negotiation_round_trip(self):
+        """
+        `Accept: application/msgpack` returns MessagePack that decodes to the JSON payload,
+        and MessagePack request bodies are accepted.
+        """
+        url = reverse('order-detail', kwargs={'pk': self.order.pk})
+        as_json = self.client_api.get(url, HTTP_ACCEPT='application/json').json()
+        response = self.client_api.get(url, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(renderers.msgpack.unpackb(response.content), as_json)
+
+        body = MessagePackRenderer().render({'notes': 'desde msgpack', 'version': as_json['version']})
+        response = self.client_api.patch(url, body, content_type='application/msgpack')
+        self.assertEqual(response.status_code, 200)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.notes, 'desde msgpack')
+
+    @override_settings(RESPONSE_COMPRESSION_MIN_SIZE=200)
+    def test_compression_negotiation(self):
+        """
+        Large JSON responses are compressed according to Accept-Encoding
+        (brotli preferred), small ones are left alone.
+        """
+        url = reverse('order-detail', kwargs={'pk': self.order.pk})
+        plain = self.client_api.get(url)
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertIn('Accept-Encoding', plain['Vary'])
+
+        response = self.client_api.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+
+        if middleware.brotli is not None:
+            response = self.client_api.get(url, HTTP_ACCEPT_ENCODING='gzip, br')
+            self.assertEqual(response['Content-Encoding'], 'br')
+            self.assertEqual(middleware.brotli.decompress(response.content), plain.content)
+
+        response = self.client_api.get(url, HTTP_ACCEPT_ENCODING='gzip;q=0, br;q=0')
+        self.assertNotIn('Content-Encoding', response)
+
+        with override_settings(RESPONSE_COMPRESSION_MIN_SIZE=10 ** 6):
+            response = self.client_api.get(url, HTTP_ACCEPT_ENCODING='gzip')
+            self.assertNotIn('Content-Encoding', response)
@@ -0,0 +1,54 @@
+from io import StringIO
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from crm.models import Order, ServiceItem, Client, SlowQuery
+from crm.slow_queries import normalize_sql, fingerprint_sql
+
+class SlowQueryTests(TestCase):
+    def setUp(self):
+        self.client_api = APIClient()
+        crm_client = Client.objects.create(email="slow@test.com", full_name="Slow Client")
+        order = Order.objects.create(client=crm_client)
+        ServiceItem.objects.create(order=order, titular_name="Slow Item", price=10, cost=5)
+
+    def test_fingerprint_ignores_literals(self):
+        """
+        Queries that only differ in literals or IN-list length share a fingerprint.
+        """
+        a = 'SELECT * FROM "crm_order" WHERE "crm_order"."id" IN (1, 2, 3) AND "currency" = \'EUR\''
+        b = 'SELECT *  FROM "crm_order" WHERE "crm_order"."id" IN (7) AND "currency" = \'USD\''
+        self.assertEqual(normalize_sql(a), 'SELECT * FROM "crm_order" WHERE "crm_order"."id" IN (...) AND "currency" = ?')
+        self.assertEqual(fingerprint_sql(a), fingerprint_sql(b))
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=0, FRAGMENT_CACHE_ENABLED=False, COALESCE_ENABLED=False)
+    def test_request_queries_are_recorded_with_plan(self):
+        """
+        With a zero threshold every query of a request is recorded, deduplicated,
+        with its origin frame and EXPLAIN plan.
+        """
+        url = reverse('order-kanban')
+        self.client_api.get(url)
+        recorded = SlowQuery.objects.count()
+        self.assertGreater(recorded, 0)
+        board_query = SlowQuery.objects.filter(normalized_sql__contains='FROM "crm_order"').first()
+
+        # Same request again: same fingerprints, more calls
+        self.client_api.get(url)
+        self.assertEqual(SlowQuery.objects.count(), recorded)
+
+        query = SlowQuery.objects.get(pk=board_query.pk)
+        self.assertEqual(query.calls, 2 * board_query.calls)
+        self.assertEqual(query.view_name, 'order-kanban')
+        self.assertTrue(query.origin.startswith('crm/'))
+        self.assertNotEqual(query.plan, '')
+
+        out = StringIO()
+        call_command('slow_queries', '--limit', '1', '--plans', stdout=out)
+        self.assertIn('#1', out.getvalue())
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_MAX_ENTRIES=2)
+    def test_table_is_bounded(self):
+        self.client_api.get(reverse('order-kanban'))
+        self.assertLessEqual(SlowQuery.objects.count(), 2)
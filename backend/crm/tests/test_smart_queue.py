@@ -1,9 +1,12 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework.test import APIClient
 from rest_framework import status
-from crm.models import Order, ServiceItem, Client
+from crm.models import Order, ServiceItem, Client, ActivityLog
+from crm.deadlines import sweep_overdue
+from crm.pagination import encode_cursor
 
 class SmartQueueTests(TestCase):
     def setUp(self):
@@ -59,3 +62,106 @@ class SmartQueueTests(TestCase):
         self.assertEqual(results[0]['id'], overdue_item.id) # Overdue first
         self.assertEqual(results[1]['id'], express_item.id) # Express second
         self.assertEqual(results[2]['id'], normal_item.id) # Normal last
+
+
+@override_settings(COALESCE_ENABLED=False)
+class SmartQueuePaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.crm_client = Client.objects.create(email="pages@test.com", full_name="Pages Client")
+        self.order = Order.objects.create(client=self.crm_client)
+        self.url = reverse('smart-queue')
+        self.tramitador = User.objects.create_user(username='tramitador')
+
+    def create_item(self, **fields):
+        return ServiceItem.objects.create(order=self.order, service_type="LEGALIZATION", **fields)
+
+    def test_keyset_pages_cover_the_queue_once(self):
+        deadline = timezone.now() + timezone.timedelta(days=5)
+        # Same urgency and deadline: only the id breaks the tie
+        items = [self.create_item(titular_name=f"Item {n}", deadline=deadline) for n in range(5)]
+        items += [self.create_item(titular_name=f"Express {n}", priority="EXPRESS") for n in range(2)]
+        self.create_item(titular_name="Closed", status="DELIVERED")
+
+        seen, params = [], {'limit': 3}
+        while True:
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen += [item['id'] for item in response.data]
+            if 'X-Next-Cursor' not in response:
+                break
+            self.assertIn('rel="next"', response['Link'])
+            params = {'limit': 3, 'cursor': response['X-Next-Cursor']}
+
+        expected = [item.id for item in items[5:]] + [item.id for item in items[:5]]
+        self.assertEqual(seen, expected)
+
+    def test_pages_across_items_without_deadline(self):
+        deadline = timezone.now() + timezone.timedelta(days=5)
+        dated = [self.create_item(titular_name=f"Dated {n}", deadline=deadline) for n in range(2)]
+        undated = [self.create_item(titular_name=f"Undated {n}") for n in range(3)]
+        ServiceItem.objects.filter(pk__in=[item.pk for item in undated]).update(deadline=None)
+
+        seen, params = [], {'limit': 1}
+        while True:
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen += [item['id'] for item in response.data]
+            if 'X-Next-Cursor' not in response:
+                break
+            params = {'limit': 1, 'cursor': response['X-Next-Cursor']}
+        # Without a deadline after every dated item of the same urgency, each once
+        self.assertEqual(seen, [item.id for item in dated + undated])
+
+    def test_filters(self):
+        mine = self.create_item(titular_name="Mine", assigned_tramitador=self.tramitador)
+        unassigned = self.create_item(titular_name="Unassigned", current_location='CONSULADO')
+
+        response = self.client.get(self.url, {'tramitador': self.tramitador.pk})
+        self.assertEqual([item['id'] for item in response.data], [mine.id])
+        response = self.client.get(self.url, {'tramitador': 'none'})
+        self.assertEqual([item['id'] for item in response.data], [unassigned.id])
+        response = self.client.get(self.url, {'location': 'CONSULADO'})
+        self.assertEqual([item['id'] for item in response.data], [unassigned.id])
+
+    def test_invalid_parameters(self):
+        for params in ({'cursor': 'not-a-cursor'}, {'cursor': encode_cursor([1, None, None])},
+                       {'cursor': encode_cursor([[1], {}, 2])}, {'limit': 'x'}, {'tramitador': 'x'},
+                       {'location': 'MARS'}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+    def test_sweeper_marks_items_overdue(self):
+        item = self.create_item(titular_name="Late soon", priority="EXPRESS")
+        closed = self.create_item(titular_name="Done", status="DELIVERED")
+        self.assertEqual(item.urgency, ServiceItem.URGENCY_EXPRESS)
+
+        later = item.deadline + timezone.timedelta(hours=1)
+        self.assertEqual(sweep_overdue(now=later), 1)
+        item.refresh_from_db()
+        closed.refresh_from_db()
+        self.assertEqual(item.urgency, ServiceItem.URGENCY_OVERDUE)
+        self.assertEqual(closed.urgency, ServiceItem.URGENCY_CLOSED)
+        self.assertEqual(sweep_overdue(now=later), 0)
+
+    def test_sweeper_flags_orders_and_logs_escalations(self):
+        late = [self.create_item(titular_name=f"Late {n}", deadline=timezone.now() + timezone.timedelta(hours=1))
+                for n in range(2)]
+        self.create_item(titular_name="On time")
+        self.assertFalse(Order.objects.get(pk=self.order.pk).has_overdue)
+
+        sweep_overdue(now=timezone.now() + timezone.timedelta(hours=2))
+        self.assertTrue(Order.objects.get(pk=self.order.pk).has_overdue)
+        escalations = ActivityLog.objects.filter(order=self.order, action_type='ESCALATION')
+        self.assertEqual(sorted(log.metadata['item'] for log in escalations), [item.pk for item in late])
+        response = self.client.get(reverse('order-kanban'), {'overdue': 'true'})
+        self.assertEqual(len(response.data['NEW_REQUEST']['orders']), 1)
+
+        # Closing the overdue items clears the order flag
+        for item in late:
+            item.refresh_from_db()
+            item.status = 'DELIVERED'
+            item.save()
+        self.assertFalse(Order.objects.get(pk=self.order.pk).has_overdue)
+        response = self.client.get(reverse('order-kanban'), {'overdue': 'true'})
+        self.assertEqual(response.data['NEW_REQUEST']['orders'], [])
@@ -31,7 +31,8 @@ class StateMachineTests(TestCase):
         url = reverse('service-item-update-status', kwargs={'pk': self.item.id})
         payload = {
             "status": "MINJUS_IN",
-            "current_location": "Oficina Habana"
+            "current_location": "Oficina Habana",
+            "version": self.item.version
         }
 
         response = self.client_api.patch(url, payload, format='json')
@@ -48,7 +49,8 @@ class StateMachineTests(TestCase):
         """
         url = reverse('service-item-update-status', kwargs={'pk': self.item.id})
         payload = {
-            "status": "INVALID_STATUS"
+            "status": "INVALID_STATUS",
+            "version": self.item.version
         }
 
         response = self.client_api.patch(url, payload, format='json')
@@ -0,0 +1,113 @@
+import uuid
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from crm.models import ActivityLog, Client, Order, Payment, ServiceItem, SyncMutation
+
+
+def rows(table):
+    return [dict(zip(table['fields'], row)) for row in table['rows']]
+
+
+@override_settings(COALESCE_ENABLED=False, SYNC_OVERLAP_SECONDS=0)
+class SyncTests(TestCase):
+    def setUp(self):
+        client = Client.objects.create(email="sync@test.com", full_name="Sync Client")
+        self.order = Order.objects.create(client=client)
+        self.item = ServiceItem.objects.create(order=self.order, titular_name="Habana", current_location='OFICINA_HABANA',
+                                               status='RECEIVED', price=50)
+        self.other = ServiceItem.objects.create(order=self.order, titular_name="Madrid", current_location='OFICINA_ESPANA')
+        elsewhere = Order.objects.create(client=client)
+        ServiceItem.objects.create(order=elsewhere, titular_name="Camagüey", current_location='VICECONSULADO_CAMAGUEY')
+        self.api = APIClient()
+        self.url = reverse('sync')
+
+    def pull(self, cursor=None):
+        params = {'location': 'OFICINA_HABANA', **({'cursor': cursor} if cursor else {})}
+        response = self.api.get(self.url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data
+
+    def push(self, mutations, cursor=None):
+        response = self.api.post(self.url, {'location': 'OFICINA_HABANA', 'cursor': cursor, 'device': 'tablet',
+                                            'mutations': mutations}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data
+
+    def test_full_then_delta(self):
+        first = self.pull()
+        self.assertTrue(first['full'])
+        self.assertEqual(first['scope'], [self.order.pk])
+        self.assertEqual({row['id'] for row in rows(first['items'])}, {self.item.pk, self.other.pk})
+        self.assertEqual(first['queue'], [self.item.pk])
+
+        second = self.pull(first['cursor'])
+        self.assertFalse(second['full'])
+        self.assertEqual(second['orders']['rows'], [])
+
+        # An update() that leaves the order untouched still reaches the client
+        ServiceItem.objects.filter(pk=self.other.pk).update(notes='x', updated_at=timezone.now())
+        third = self.pull(second['cursor'])
+        self.assertEqual([row['id'] for row in rows(third['orders'])], [self.order.pk])
+
+        # Leaving the location takes the order out of scope
+        self.item.current_location = 'MINJUS'
+        self.item.save()
+        self.assertEqual(self.pull(third['cursor'])['scope'], [])
+
+    def test_push_is_idempotent(self):
+        cursor = self.pull()['cursor']
+        version = ServiceItem.objects.get(pk=self.item.pk).version
+        mutations = [
+            {'id': str(uuid.uuid4()), 'type': 'item.update', 'target': self.item.pk, 'base_version': version,
+             'data': {'status': 'MINJUS_IN'}},
+            {'id': str(uuid.uuid4()), 'type': 'payment.create',
+             'data': {'order': self.order.pk, 'amount': '20.00', 'currency': 'EUR', 'method': 'CASH'}},
+            {'id': str(uuid.uuid4()), 'type': 'order.note', 'target': self.order.pk, 'data': {'text': 'Llamar'}},
+        ]
+        data = self.push(mutations, cursor)
+        self.assertEqual([r['status'] for r in data['results']], ['applied'] * 3)
+        # The pull in the same response already carries the changes
+        items = {row['id']: row for row in rows(data['items'])}
+        self.assertEqual(items[self.item.pk]['status'], 'MINJUS_IN')
+        self.assertEqual(items[self.item.pk]['version'], data['results'][0]['version'])
+        self.assertEqual(len(data['payments']['rows']), 1)
+
+        # The response was lost: the client pushes the same mutations again
+        again = self.push(mutations, cursor)
+        self.assertTrue(all(r['replayed'] for r in again['results']))
+        self.assertEqual(Payment.objects.filter(order=self.order).count(), 1)
+        self.assertEqual(ActivityLog.objects.filter(order=self.order, action_type='NOTE').count(), 1)
+        self.assertEqual(SyncMutation.objects.count(), 3)
+
+    def test_conflicts(self):
+        version = self.item.version
+        # Someone else moved the item on meanwhile
+        self.item.status = 'MINJUS_OUT'
+        self.item.save()
+
+        stale = {'id': str(uuid.uuid4()), 'type': 'item.update', 'target': self.item.pk,
+                 'base_version': version, 'base': {'status': 'RECEIVED'}, 'data': {'status': 'MINJUS_IN'}}
+        result = self.push([stale])['results'][0]
+        self.assertEqual(result['status'], 'conflict')
+        self.assertEqual(result['current']['status'], 'MINJUS_OUT')
+        self.assertEqual(ServiceItem.objects.get(pk=self.item.pk).status, 'MINJUS_OUT')
+
+        # Another field, unchanged since the client saw it: no conflict
+        notes = {'id': str(uuid.uuid4()), 'type': 'item.update', 'target': self.item.pk,
+                 'base_version': version, 'base': {'notes': ''}, 'data': {'notes': 'Sello pendiente'}}
+        self.assertEqual(self.push([notes])['results'][0]['status'], 'applied')
+
+        invalid = {'id': str(uuid.uuid4()), 'type': 'item.update', 'target': self.item.pk, 'data': {'status': 'NOPE'}}
+        result = self.push([invalid])['results'][0]
+        self.assertEqual(result['status'], 'rejected')
+
+    def test_bad_requests(self):
+        self.assertEqual(self.api.get(self.url, {'location': 'LUNA'}).status_code, 400)
+        self.assertEqual(self.api.get(self.url, {'location': 'OFICINA_HABANA', 'cursor': '!!'}).status_code, 400)
+        response = self.api.post(self.url, {'location': 'OFICINA_HABANA', 'mutations': [{'type': 'order.note'}]},
+                                 format='json')
+        self.assertEqual(response.status_code, 400)
@@ -4,7 +4,9 @@ from .views import (
     CreateOrderView, OrderListView, OrderKanbanView, OrderDetailView,
     AddServiceToOrderView, RegisterPaymentView, ActivityLogView,
     DashboardStatsView, ServiceItemViewSet, SmartQueueView,
-    RequestPaymentView, GenerateInvoiceView
+    RequestPaymentView, GenerateInvoiceView, AutoAssignView,
+    PaymentProofView, UploadCreateView, UploadDetailView, UploadCompleteView, SyncView,
+    BatchView, OrderMultiView, AgingReportView, AnalyticsView
 )
 
 router = DefaultRouter()
@@ -15,14 +17,28 @@ urlpatterns = [
     path('orders/create/', CreateOrderView.as_view(), name='create-order'),
     path('orders/', OrderListView.as_view(), name='order-list'),
     path('orders/kanban/', OrderKanbanView.as_view(), name='order-kanban'),
+    path('orders/multi/', OrderMultiView.as_view(), name='order-multi'),
     path('orders/<int:pk>/', OrderDetailView.as_view(), name='order-detail'),
     path('orders/<int:order_id>/add-service/', AddServiceToOrderView.as_view(), name='add-service'),
     path('orders/<int:order_id>/payments/', RegisterPaymentView.as_view(), name='register-payment'),
     path('orders/<int:order_id>/request-payment/', RequestPaymentView.as_view(), name='request-payment'),
     path('orders/<int:order_id>/invoice/', GenerateInvoiceView.as_view(), name='generate-invoice'),
     path('orders/<int:order_id>/activity-log/', ActivityLogView.as_view(), name='activity-log'),
+    path('batch/', BatchView.as_view(), name='batch'),
+    path('payments/<int:pk>/proof/', PaymentProofView.as_view(), name='payment-proof'),
+
+    # Resumable uploads (crm.files)
+    path('uploads/', UploadCreateView.as_view(), name='upload-create'),
+    path('uploads/<uuid:pk>/', UploadDetailView.as_view(), name='upload-detail'),
+    path('uploads/<uuid:pk>/complete/', UploadCompleteView.as_view(), name='upload-complete'),
     
     # Dashboard & Queue
     path('dashboard-stats/', DashboardStatsView.as_view(), name='dashboard-stats'),
     path('smart-queue/', SmartQueueView.as_view(), name='smart-queue'),
+    path('assignments/', AutoAssignView.as_view(), name='auto-assign'),
+    path('reports/aging/', AgingReportView.as_view(), name='aging-report'),
+    path('analytics/', AnalyticsView.as_view(), name='analytics'),
+
+    # Offline-first sync for branch offices (crm.sync)
+    path('sync/', SyncView.as_view(), name='sync'),
 ] + router.urls
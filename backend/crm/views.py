@@ -1,23 +1,210 @@
+import hashlib
+
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from django.db.models import Sum, Count, Q, F, ExpressionWrapper, fields, Case, When, Value, IntegerField
+from django.db.models import Sum, Count, Q, F, ExpressionWrapper, fields
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils.decorators import method_decorator
 from django.utils import timezone
-from .models import Client, Order, ServiceItem, Payment, ActivityLog
+from .models import Client, Order, ServiceItem, Payment, ActivityLog, Upload, VersionConflict
 from .serializers import (
     ClientSerializer, OrderSerializer, OrderListSerializer, OrderDetailSerializer,
-    ServiceItemSerializer, PaymentSerializer, ActivityLogSerializer
+    ServiceItemSerializer, PaymentSerializer, ActivityLogSerializer, UploadSerializer,
+    items_prefetch, order_detail_queryset
 )
+from .projections import order_list_rows, service_item_rows
+from .fragments import FragmentCache, get_versions, refresh_item, refresh_order
+from . import analytics, archive, assignment, batch, files, fx, receivables, sync, tasks
+from .coalescing import coalesce_get
+from .idempotency import idempotent
+from .jobs import enqueue
+from .invoices import fingerprint, invoice_documents, invoice_path
+from .pagination import KeysetPagination, InvalidPage
+
+def serialize_by_pk(serializer_class, queryset):
+    objects = list(queryset)
+    return {obj.pk: data for obj, data in zip(objects, serializer_class(objects, many=True).data)}
+
+# Cached serialized fragments (see crm.fragments), invalidated by the model save paths
+ORDER_CARDS = FragmentCache(
+    'order-card', Order, lambda qs: {row['id']: row for row in order_list_rows(qs)}, refresh_order)
+ORDER_DETAILS = FragmentCache(
+    'order-detail', Order, lambda qs: serialize_by_pk(OrderDetailSerializer, order_detail_queryset(qs)),
+    refresh_order)
+PORTAL_ORDERS = FragmentCache(
+    'order', Order, lambda qs: serialize_by_pk(
+        OrderSerializer, qs.select_related('client').prefetch_related(items_prefetch(), 'payments')),
+    refresh_order)
+SERVICE_ITEMS = FragmentCache(
+    'service-item', ServiceItem, lambda qs: {row['id']: row for row in service_item_rows(qs)}, refresh_item)
+
+def requested_fields(request, allowed):
+    """?fields=a,b: the top-level keys to return (None: all of them); ValueError on unknown ones"""
+    raw = request.query_params.get('fields')
+    if not raw:
+        return None
+    fields = list(dict.fromkeys(name.strip() for name in raw.split(',') if name.strip()))
+    unknown = [name for name in fields if name not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+def fragment_etag(kind, pk, version, fields=None, refreshed=None):
+    """
+    Changes with the fragment version (every write to the row), the fields
+    selected and the values recomputed from the current time on every read
+    (`refreshed`, e.g. days_until_deadline: the deadline comes closer without a write)
+    """
+    tag = f'{kind}-{pk}-{version}'
+    if fields is not None:
+        tag += '-' + hashlib.sha1(','.join(fields).encode()).hexdigest()[:8]
+    if refreshed is not None:
+        tag += '-' + hashlib.sha1(repr(refreshed).encode()).hexdigest()[:8]
+    return f'"{tag}"'
+
+def fragment_objects(request, cache, queryset, ids, allowed, prepare=None, archived=None):
+    """
+    {pk: (etag, data, is_archived)} for the rows of `queryset` among `ids`:
+    data is None when the client already holds that ETag (If-None-Match),
+    otherwise the fragment restricted to ?fields=. Rows that don't exist are
+    looked up with `archived(pks) -> {pk: data}` (crm.archive), if given, or
+    left out. One query for the pks, plus the builds of the cache misses.
+    """
+    fields = requested_fields(request, allowed)
+    found = set(queryset.filter(pk__in=ids).values_list('pk', flat=True))
+    pks = [pk for pk in ids if pk in found]
+    versions = get_versions(cache.model, pks)
+    known = request.headers.get('If-None-Match', '')
+    if cache.refresh:
+        # The time dependent values are part of the ETag: read every fragment (from the cache when warm)
+        now = timezone.now()
+        fragments = {data['id']: data for data in cache.get_many(pks, queryset, now=now, versions=versions)}
+        pks = [pk for pk in pks if pk in fragments]
+        etags = {pk: fragment_etag(cache.kind, pk, versions[pk], fields, cache.refresh(fragments[pk], now))
+                 for pk in pks}
+        stale = [pk for pk in pks if etags[pk] not in known]
+        built = {pk: (fragments[pk], False) for pk in stale}
+    else:
+        etags = {pk: fragment_etag(cache.kind, pk, versions[pk], fields) for pk in pks}
+        stale = [pk for pk in pks if etags[pk] not in known]
+        built = {data['id']: (data, False) for data in cache.get_many(stale, queryset, versions=versions)}
+
+    missing = [pk for pk in ids if pk not in found]
+    if archived is not None and missing:
+        now = timezone.now()
+        for pk, data in archived(missing).items():
+            # Archived orders don't change until restored, only their time dependent values
+            etags[pk] = fragment_etag('archived', pk, 0, fields, refresh_order(data, now))
+            if etags[pk] not in known:
+                built[pk] = (data, True)
+            pks.append(pk)
+
+    objects = {}
+    for pk in pks:
+        data, is_archived = built.get(pk, (None, pk not in found))
+        if data is not None:
+            if prepare:
+                prepare(request, data)
+            if fields is not None:
+                data = {name: data[name] for name in fields}
+        elif pk in stale:
+            continue  # deleted meanwhile
+        objects[pk] = (etags[pk], data, is_archived)
+    return objects
+
+def detail_response(request, cache, queryset, pk, allowed, prepare=None, not_found='Not found', archived=None):
+    """One fragment with an ETag, 304 when the client holds it"""
+    try:
+        objects = fragment_objects(request, cache, queryset, [pk], allowed, prepare, archived)
+    except ValueError as exc:
+        return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    if pk not in objects:
+        return Response({'error': not_found}, status=status.HTTP_404_NOT_FOUND)
+    etag, data, is_archived = objects[pk]
+    headers = {'ETag': etag, **({'X-Archived': 'true'} if is_archived else {})}
+    if data is None:
+        return HttpResponseNotModified(headers=headers)
+    return Response(data, headers=headers)
+
+def multi_response(request, cache, queryset, allowed, prepare=None, archived=None):
+    """
+    ?ids=1,2,3 (up to MULTI_GET_MAX_IDS): one result per id, in that order,
+    {"id", "status": 200, "etag", "data"}, {"id", "status": 304, "etag"} for
+    the ETags sent in If-None-Match, or {"id", "status": 404}. Results
+    found in the archive carry "archived": true.
+    """
+    try:
+        ids = list(dict.fromkeys(int(value) for value in request.query_params.get('ids', '').split(',') if value))
+    except ValueError:
+        return Response({'error': 'ids must be a comma separated list of ids'}, status=status.HTTP_400_BAD_REQUEST)
+    if not ids:
+        return Response({'error': 'ids is required'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(ids) > settings.MULTI_GET_MAX_IDS:
+        return Response({'error': f'Up to {settings.MULTI_GET_MAX_IDS} ids per request'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    try:
+        objects = fragment_objects(request, cache, queryset, ids, allowed, prepare, archived)
+    except ValueError as exc:
+        return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+    results = []
+    for pk in ids:
+        if pk not in objects:
+            results.append({'id': pk, 'status': 404})
+            continue
+        etag, data, is_archived = objects[pk]
+        result = {'id': pk, 'status': 304, 'etag': etag} if data is None else \
+            {'id': pk, 'status': 200, 'etag': etag, 'data': data}
+        if is_archived:
+            result['archived'] = True
+        results.append(result)
+    return Response({'results': results})
+
+def absolute_document_url(request, item):
+    if item['final_document']:
+        item['final_document'] = request.build_absolute_uri(item['final_document'])
+
+def expected_version(request):
+    """
+    (version the write is conditional on, None) or (None, error response):
+    `version` in the body, the one the client read. Required, so that an
+    edit from a stale screen gets a 409 instead of overwriting.
+    """
+    if request.data.get('version') is None:
+        return None, Response({'error': 'version is required'}, status=status.HTTP_428_PRECONDITION_REQUIRED)
+    try:
+        return int(request.data['version']), None
+    except (TypeError, ValueError):
+        return None, Response({'error': 'version must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+def version_conflict(label, current):
+    """409 for a write based on an outdated version, with the current state to merge or retry from"""
+    return Response({'error': f'The {label} was modified by someone else', 'current': current},
+                    status=status.HTTP_409_CONFLICT)
+
+ORDER_DETAIL_FIELDS = OrderDetailSerializer.Meta.fields
+SERVICE_ITEM_FIELDS = ServiceItemSerializer.Meta.fields
 
 class ClientViewSet(viewsets.ModelViewSet):
     queryset = Client.objects.all()
     serializer_class = ClientSerializer
 
+    create = idempotent(viewsets.ModelViewSet.create)
+    update = idempotent(viewsets.ModelViewSet.update)
+    partial_update = idempotent(viewsets.ModelViewSet.partial_update)
+    destroy = idempotent(viewsets.ModelViewSet.destroy)
+
 class CreateOrderView(APIView):
     """
     Smart Cart: Create an Order with multiple ServiceItems in one request
     """
+    @idempotent
     def post(self, request):
         serializer = OrderSerializer(data=request.data)
         if serializer.is_valid():
@@ -38,12 +225,14 @@ class OrderKanbanView(APIView):
     """
     Get orders grouped by global_status for Kanban view
     """
+    @coalesce_get(per_user_params=['assigned_to_me'])
     def get(self, request):
         # Get filter parameters
         assigned_to_me = request.query_params.get('assigned_to_me', None)
         with_debt = request.query_params.get('with_debt', None)
         urgent = request.query_params.get('urgent', None)
         location = request.query_params.get('location', None)
+        overdue = request.query_params.get('overdue', None)
         
         queryset = Order.objects.all()
         
@@ -52,22 +241,26 @@ class OrderKanbanView(APIView):
             queryset = queryset.filter(assigned_to=request.user)
         
         if with_debt:
-            queryset = queryset.filter(total_paid__lt=F('total_amount'))
+            queryset = queryset.filter(balance_due__gt=0)
         
         if urgent:
             queryset = queryset.filter(items__priority='EXPRESS').distinct()
         
         if location:
             queryset = queryset.filter(items__current_location=location).distinct()
+
+        if overdue:
+            queryset = queryset.filter(has_overdue=True)
         
-        # Group by global_status
-        kanban_data = {}
-        for choice_value, choice_label in Order.GLOBAL_STATUS_CHOICES:
-            orders = queryset.filter(global_status=choice_value).order_by('-created_at')
-            kanban_data[choice_value] = {
-                'label': choice_label,
-                'orders': OrderListSerializer(orders, many=True).data
-            }
+        # Group by global_status (single query, grouped in Python)
+        kanban_data = {
+            choice_value: {'label': choice_label, 'orders': []}
+            for choice_value, choice_label in Order.GLOBAL_STATUS_CHOICES
+        }
+        orders = queryset.filter(global_status__in=kanban_data).order_by('-created_at')
+        # Cached OrderListSerializer cards, misses built from values() rows
+        for data in ORDER_CARDS.get_list(orders):
+            kanban_data[data['global_status']]['orders'].append(data)
         
         return Response(kanban_data)
 
@@ -76,50 +269,74 @@ class OrderDetailView(APIView):
     Get complete order details including items, payments, and activity log
     """
     def get(self, request, pk):
-        try:
-            order = Order.objects.get(pk=pk)
-            serializer = OrderDetailSerializer(order)
-            return Response(serializer.data)
-        except Order.DoesNotExist:
-            return Response({'error': 'Order not found'}, status=status.HTTP_404_NOT_FOUND)
+        # ?fields= and If-None-Match as in OrderMultiView
+        return detail_response(request, ORDER_DETAILS, Order.objects.all(), pk, ORDER_DETAIL_FIELDS,
+                               not_found='Order not found', archived=archive.archived_details)
     
+    @idempotent
     def patch(self, request, pk):
-        """Update order fields"""
+        """
+        Update order fields. Only the fields sent are written, and only while
+        the order is at `version` (required, the one the client read):
+        otherwise 409 with the current order.
+        """
         try:
             order = Order.objects.get(pk=pk)
-            
-            # Track changes for activity log
-            changes = []
-            if 'global_status' in request.data and request.data['global_status'] != order.global_status:
-                old_status = order.get_global_status_display()
-                order.global_status = request.data['global_status']
-                new_status = order.get_global_status_display()
-                changes.append(f"Estado cambiado de '{old_status}' a '{new_status}'")
-            
-            if 'assigned_to' in request.data:
-                order.assigned_to_id = request.data['assigned_to']
-                changes.append(f"Asignado a gestor")
-            
-            if 'notes' in request.data:
-                order.notes = request.data['notes']
-            
-            order.save()
-            
-            # Log activity
-            if changes:
-                ActivityLog.objects.create(
-                    order=order,
-                    user=request.user if request.user.is_authenticated else None,
-                    action_type='STATUS_CHANGE',
-                    description='; '.join(changes)
-                )
-            
-            return Response(OrderDetailSerializer(order).data)
         except Order.DoesNotExist:
             return Response({'error': 'Order not found'}, status=status.HTTP_404_NOT_FOUND)
+        expected, error = expected_version(request)
+        if error:
+            return error
+
+        # Track changes for activity log
+        changes = []
+        fields = []
+        if 'global_status' in request.data and request.data['global_status'] != order.global_status:
+            old_status = order.get_global_status_display()
+            order.global_status = request.data['global_status']
+            new_status = order.get_global_status_display()
+            changes.append(f"Estado cambiado de '{old_status}' a '{new_status}'")
+            fields.append('global_status')
+
+        if 'assigned_to' in request.data:
+            order.assigned_to_id = request.data['assigned_to']
+            changes.append(f"Asignado a gestor")
+            fields.append('assigned_to')
+
+        if 'notes' in request.data:
+            order.notes = request.data['notes']
+            fields.append('notes')
+
+        if fields:
+            try:
+                order.save(update_fields=fields, expected_version=expected)
+            except VersionConflict:
+                return version_conflict('order', OrderDetailSerializer(order_detail_queryset().get(pk=pk)).data)
+
+        # Log activity
+        if changes:
+            ActivityLog.objects.create(
+                order=order,
+                user=request.user if request.user.is_authenticated else None,
+                action_type='STATUS_CHANGE',
+                description='; '.join(changes)
+            )
+
+        return Response(OrderDetailSerializer(order_detail_queryset().get(pk=order.pk)).data)
+
+class OrderMultiView(APIView):
+    """
+    Several order details in one request: ?ids=1,2,3, optionally ?fields=
+    (top-level keys of the detail). Each result carries its ETag; send the
+    ETags already held in If-None-Match to get 304 results without data.
+    """
+    def get(self, request):
+        return multi_response(request, ORDER_DETAILS, Order.objects.all(), ORDER_DETAIL_FIELDS,
+                              archived=archive.archived_details)
 
 class AddServiceToOrderView(APIView):
     """Add a new service item to an existing order"""
+    @idempotent
     def post(self, request, order_id):
         try:
             order = Order.objects.get(pk=order_id)
@@ -143,6 +360,7 @@ class AddServiceToOrderView(APIView):
 
 class RegisterPaymentView(APIView):
     """Register a payment for an order"""
+    @idempotent
     def post(self, request, order_id):
         try:
             order = Order.objects.get(pk=order_id)
@@ -168,75 +386,119 @@ class RegisterPaymentView(APIView):
             return Response({'error': 'Order not found'}, status=status.HTTP_404_NOT_FOUND)
 
 class RequestPaymentView(APIView):
-    """(Mock) Send payment request email"""
+    """Queue the payment request email (sent by the job workers)"""
+    @idempotent
     def post(self, request, order_id):
         try:
             order = Order.objects.get(pk=order_id)
-            # Here we would integrate with an email service
-            
+            user = request.user if request.user.is_authenticated else None
+            # One pending email per order, however many times it is requested
+            job = enqueue(tasks.send_payment_request, order_id=order.pk, user_id=user and user.pk,
+                          dedupe_key=f'payment-request:{order.pk}')
+
             ActivityLog.objects.create(
                 order=order,
-                user=request.user if request.user.is_authenticated else None,
+                user=user,
                 action_type='EMAIL_SENT',
-                description="Solicitud de pago enviada al cliente"
+                description="Solicitud de pago en cola de envío al cliente",
+                metadata={'job': job.pk},
             )
-            return Response({'message': 'Payment request sent'}, status=status.HTTP_200_OK)
+            return Response({'message': 'Payment request queued', 'job': job.pk}, status=status.HTTP_200_OK)
         except Order.DoesNotExist:
             return Response({'error': 'Order not found'}, status=status.HTTP_404_NOT_FOUND)
 
 class GenerateInvoiceView(APIView):
-    """(Mock) Generate invoice PDF"""
+    """
+    The invoice PDF of the order (crm.invoices). Served from storage once
+    the order's current financial version has been rendered; until then the
+    rendering is queued and the response is 202 with Retry-After: poll the
+    same URL.
+    """
     def get(self, request, order_id):
-        try:
-            order = Order.objects.get(pk=order_id)
-            # Here we would generate a real PDF
-            
-            ActivityLog.objects.create(
-                order=order,
-                user=request.user if request.user.is_authenticated else None,
-                action_type='DOCUMENT_GENERATED',
-                description="Factura generada"
-            )
-            
-            # Mock file response
-            response = Response("PDF CONTENT MOCK", content_type='text/plain')
-            response['Content-Disposition'] = f'attachment; filename="invoice_{order.order_friendly_id}.txt"'
-            return response
-        except Order.DoesNotExist:
+        document = invoice_documents([order_id]).get(order_id)
+        if document is None:
             return Response({'error': 'Order not found'}, status=status.HTTP_404_NOT_FOUND)
 
+        digest = fingerprint(document)
+        etag = f'"{digest}"'
+        if etag in request.headers.get('If-None-Match', ''):
+            return HttpResponseNotModified(headers={'ETag': etag})
+
+        path = invoice_path(digest)
+        if default_storage.exists(path):
+            response = FileResponse(default_storage.open(path, 'rb'), as_attachment=True,
+                                    filename=f"invoice_{document['number']}.pdf", content_type='application/pdf')
+            response['ETag'] = etag
+            response['Cache-Control'] = 'private, no-cache'
+            return response
+
+        user = request.user if request.user.is_authenticated else None
+        job = enqueue(tasks.render_invoice, order_id=order_id, user_id=user and user.pk,
+                      dedupe_key=f'invoice:{digest}')
+        return Response({'status': 'pending', 'job': job.pk}, status=status.HTTP_202_ACCEPTED,
+                        headers={'Retry-After': '2'})
+
 class ActivityLogView(APIView):
     """Get activity log for an order"""
     def get(self, request, order_id):
         try:
             order = Order.objects.get(pk=order_id)
-            logs = order.activity_logs.all()
+            logs = order.activity_logs.select_related('user')
             serializer = ActivityLogSerializer(logs, many=True)
             return Response(serializer.data)
         except Order.DoesNotExist:
             return Response({'error': 'Order not found'}, status=status.HTTP_404_NOT_FOUND)
 
 class ServiceItemViewSet(viewsets.ModelViewSet):
-    queryset = ServiceItem.objects.all()
+    queryset = ServiceItem.objects.select_related('assigned_tramitador')
     serializer_class = ServiceItemSerializer
 
+    create = idempotent(viewsets.ModelViewSet.create)
+    update = idempotent(viewsets.ModelViewSet.update)
+    partial_update = idempotent(viewsets.ModelViewSet.partial_update)
+    destroy = idempotent(viewsets.ModelViewSet.destroy)
+
+    def list(self, request, *args, **kwargs):
+        # Cached ServiceItemSerializer output, misses built from values() rows
+        items = SERVICE_ITEMS.get_list(self.filter_queryset(self.get_queryset()))
+        for item in items:
+            absolute_document_url(request, item)
+        return Response(items)
+
+    def retrieve(self, request, pk=None):
+        # Cached like the list, with ?fields= and If-None-Match as in multi
+        if not str(pk).isdigit():
+            return Response({'error': 'Service item not found'}, status=status.HTTP_404_NOT_FOUND)
+        return detail_response(request, SERVICE_ITEMS, ServiceItem.objects.all(), int(pk), SERVICE_ITEM_FIELDS,
+                               absolute_document_url, not_found='Service item not found')
+
+    @action(detail=False, methods=['get'])
+    def multi(self, request):
+        """Several service items in one request: ?ids=, ?fields= and If-None-Match as for orders"""
+        return multi_response(request, SERVICE_ITEMS, ServiceItem.objects.all(), SERVICE_ITEM_FIELDS,
+                              absolute_document_url)
+
     @action(detail=True, methods=['patch'])
+    @idempotent
     def update_status(self, request, pk=None):
-        """Update service item status and location"""
+        """Update service item status and location (optimistic locking as in OrderDetailView.patch)"""
         item = self.get_object()
+        expected, error = expected_version(request)
+        if error:
+            return error
         old_status = item.get_status_display()
-        
-        if 'status' in request.data:
-            item.status = request.data['status']
-        if 'current_location' in request.data:
-            item.current_location = request.data['current_location']
-        if 'assigned_tramitador' in request.data:
-            item.assigned_tramitador_id = request.data['assigned_tramitador']
-        if 'phase_dates' in request.data:
-            item.phase_dates = request.data['phase_dates']
-        
-        item.save()
-        
+
+        fields = [name for name in ('status', 'current_location', 'assigned_tramitador', 'phase_dates')
+                  if name in request.data]
+        for name in fields:
+            setattr(item, 'assigned_tramitador_id' if name == 'assigned_tramitador' else name, request.data[name])
+
+        if fields:
+            try:
+                item.save(update_fields=fields, expected_version=expected)
+            except VersionConflict:
+                return version_conflict('service item', ServiceItemSerializer(self.get_queryset().get(pk=item.pk)).data)
+
         # Log activity
         new_status = item.get_status_display()
         ActivityLog.objects.create(
@@ -245,40 +507,156 @@ class ServiceItemViewSet(viewsets.ModelViewSet):
             action_type='STATUS_CHANGE',
             description=f"Servicio '{item.titular_name}': {old_status} → {new_status}"
         )
-        
+
         return Response(ServiceItemSerializer(item).data)
-    
+
     @action(detail=True, methods=['post'])
+    @idempotent
     def upload_final(self, request, pk=None):
-        """Upload final document for service item"""
+        """Upload final document for service item (large files: /api/uploads/)"""
         item = self.get_object()
         
         if 'final_document' in request.FILES:
-            item.final_document = request.FILES['final_document']
-            item.save()
-            
-            # Log activity
-            ActivityLog.objects.create(
-                order=item.order,
-                user=request.user if request.user.is_authenticated else None,
-                action_type='DOCUMENT_UPLOAD',
-                description=f"Documento final subido para '{item.titular_name}'"
-            )
-            
-            return Response({'message': 'Document uploaded successfully'}, status=status.HTTP_200_OK)
+            path, digest, _ = files.store_uploaded_file(request.FILES['final_document'],
+                                                         files.upload_to('FINAL_DOCUMENT'))
+            files.attach(item, path, request.user if request.user.is_authenticated else None, {'sha256': digest})
+            return Response({'message': 'Document uploaded successfully', 'file': path}, status=status.HTTP_200_OK)
         
         return Response({'error': 'No file provided'}, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=True, methods=['get'], url_path='final-document')
+    def final_document(self, request, pk=None):
+        """Download the final document (Range, offloaded per FILE_DOWNLOAD_OFFLOAD)"""
+        name = ServiceItem.objects.filter(pk=pk).values_list('final_document', flat=True).first()
+        if not name:
+            return Response({'error': 'No final document'}, status=status.HTTP_404_NOT_FOUND)
+        return files.serve(request, name)
+
+class PaymentProofView(APIView):
+    """GET downloads the payment proof, POST (multipart `proof_file`) uploads it"""
+    def get(self, request, pk):
+        name = Payment.objects.filter(pk=pk).values_list('proof_file', flat=True).first()
+        if not name:
+            return Response({'error': 'No payment proof'}, status=status.HTTP_404_NOT_FOUND)
+        return files.serve(request, name)
+
+    @idempotent
+    def post(self, request, pk):
+        try:
+            payment = files.target_object('PAYMENT_PROOF', pk)
+        except Payment.DoesNotExist:
+            return Response({'error': 'Payment not found'}, status=status.HTTP_404_NOT_FOUND)
+        if 'proof_file' not in request.FILES:
+            return Response({'error': 'No file provided'}, status=status.HTTP_400_BAD_REQUEST)
+        path, digest, _ = files.store_uploaded_file(request.FILES['proof_file'], files.upload_to('PAYMENT_PROOF'))
+        files.attach(payment, path, request.user if request.user.is_authenticated else None, {'sha256': digest})
+        return Response({'message': 'Payment proof uploaded successfully', 'file': path}, status=status.HTTP_200_OK)
+
+class UploadCreateView(APIView):
+    """
+    Start a resumable upload (crm.files):
+    POST {"target": "FINAL_DOCUMENT" | "PAYMENT_PROOF", "object_id", "filename", "size", "sha256"}
+    """
+    @idempotent
+    def post(self, request):
+        serializer = UploadSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+        model, _ = files.TARGETS[data['target']]
+        if not model.objects.filter(pk=data['object_id']).exists():
+            return Response({'error': f'{model.__name__} not found'}, status=status.HTTP_404_NOT_FOUND)
+        upload = serializer.save(created_by=request.user if request.user.is_authenticated else None)
+        return Response(UploadSerializer(upload).data, status=status.HTTP_201_CREATED)
+
+def _open_upload(pk):
+    upload = Upload.objects.filter(pk=pk).first()
+    if upload is None:
+        return None, Response({'error': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+    if upload.status != 'OPEN':
+        return None, Response({'error': f'Upload is {upload.get_status_display()}', **UploadSerializer(upload).data},
+                              status=status.HTTP_409_CONFLICT)
+    return upload, None
+
+def _upload_error(upload, exc):
+    if isinstance(exc, files.OffsetMismatch):
+        upload.received = exc.expected
+    code = status.HTTP_409_CONFLICT if isinstance(exc, (files.OffsetMismatch, files.UploadBusy)) else \
+        status.HTTP_400_BAD_REQUEST
+    return Response({'error': str(exc), 'offset': upload.received}, status=code)
+
+# Chunks stream from slow links: no transaction held open while they arrive
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
+class UploadDetailView(APIView):
+    """
+    GET: the upload and its offset (resume from there).
+    PUT: the next chunk, raw bytes starting at the Upload-Offset header,
+    with its SHA-256 in X-Chunk-SHA256; 409 with the expected offset when
+    it does not start there. DELETE: abort.
+    """
+    def get(self, request, pk):
+        upload = Upload.objects.filter(pk=pk).first()
+        if upload is None:
+            return Response({'error': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(UploadSerializer(upload).data, headers={'Upload-Offset': str(upload.received)})
+
+    def put(self, request, pk):
+        upload, error = _open_upload(pk)
+        if error:
+            return error
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+            length = int(request.META.get('CONTENT_LENGTH') or '')
+        except ValueError:
+            return Response({'error': 'Upload-Offset and Content-Length are required'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if length > settings.UPLOAD_MAX_CHUNK_SIZE:
+            return Response({'error': f'Chunks are limited to {settings.UPLOAD_MAX_CHUNK_SIZE} bytes'},
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        try:
+            # The body is read block by block, never parsed nor buffered
+            received = files.write_chunk(upload, request._request, offset, length,
+                                         request.headers.get('X-Chunk-SHA256', ''))
+        except files.UploadError as exc:
+            return _upload_error(upload, exc)
+        return Response({'offset': received, 'size': upload.size}, headers={'Upload-Offset': str(received)})
+
+    def delete(self, request, pk):
+        upload, error = _open_upload(pk)
+        if error:
+            return error
+        files.abort_upload(upload)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
+class UploadCompleteView(APIView):
+    """Verify the whole file, store it by content and attach it to its service item or payment"""
+    def post(self, request, pk):
+        upload, error = _open_upload(pk)
+        if error:
+            return error
+        try:
+            obj = files.target_object(upload.target, upload.object_id)
+        except ObjectDoesNotExist:
+            return Response({'error': 'The service item or payment no longer exists'},
+                            status=status.HTTP_404_NOT_FOUND)
+        try:
+            _, deduplicated = files.complete_upload(
+                upload, obj, request.user if request.user.is_authenticated else None)
+        except files.UploadError as exc:
+            return _upload_error(upload, exc)
+        return Response({**UploadSerializer(upload).data, 'deduplicated': deduplicated})
+
 # Existing views
 class OrderListView(APIView):
     def get(self, request):
         email = request.query_params.get('client_email', None)
+        orders = Order.objects.all()
         if email:
-            orders = Order.objects.filter(client__email=email)
-        else:
-            orders = Order.objects.all()
-        serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data)
+            orders = orders.filter(client__email=email)
+            # The client's archived orders too (crm.archive), after the active ones
+            return Response(PORTAL_ORDERS.get_list(orders) + archive.archived_portal_orders(email))
+        return Response(PORTAL_ORDERS.get_list(orders))
 
 class DashboardStatsView(APIView):
     def get(self, request):
@@ -289,23 +667,156 @@ class DashboardStatsView(APIView):
                 deadline__lte=timezone.now() + timezone.timedelta(days=7),
                 deadline__gte=timezone.now()
             ).count(),
-            'total_revenue': Order.objects.filter(currency='EUR').aggregate(Sum('total_amount'))['total_amount__sum'] or 0,
-            'total_margin': Order.objects.filter(currency='EUR').aggregate(Sum('total_margin'))['total_margin__sum'] or 0,
         }
+        # EUR orders only, as before, and every currency in FX_BASE_CURRENCY (crm.fx), in one query
+        eur = Q(currency='EUR')
+        stats.update(Order.objects.aggregate(
+            total_revenue=Sum('total_amount', filter=eur, default=0),
+            total_margin=Sum('total_margin', filter=eur, default=0),
+            total_revenue_base=Sum('total_amount_base', default=0),
+            total_margin_base=Sum('total_margin_base', default=0),
+            balance_due_base=Sum('balance_due_base', default=0),
+        ))
+        stats['base_currency'] = fx.base_currency()
         return Response(stats)
 
+class AgingReportView(APIView):
+    """Outstanding balances by age (0-30, 31-60, 61-90, 90+ days) per currency, client and gestor"""
+    def get(self, request):
+        return Response(receivables.aging_report())
+
+class AnalyticsView(APIView):
+    """
+    Margin and volume pivots and time series from the nightly columnar
+    snapshot (crm.analytics), without querying the database, e.g.
+    ?group_by=month&service_type=LEGALIZATION or
+    ?group_by=tramitador&columns=month&measure=margin&from=2026-01
+    """
+    def get(self, request):
+        try:
+            return Response(analytics.report(request.query_params))
+        except analytics.NoSnapshot as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
 class SmartQueueView(APIView):
+    """
+    Open items by urgency (overdue, express, normal), then deadline.
+
+    A range scan over the persisted urgency index, one page at a time:
+    ?limit= (default SMART_QUEUE_PAGE_SIZE) and ?cursor= taken from the
+    X-Next-Cursor header (also sent as a Link rel="next"), which is absent
+    on the last page. Filters: ?tramitador=<user id> or 'none', ?location=.
+    """
+    ordering = ['-urgency', 'deadline', 'id']
+
+    @coalesce_get()
     def get(self, request):
         now = timezone.now()
-        
-        items = ServiceItem.objects.exclude(status__in=['READY', 'DELIVERED']).annotate(
-            urgency_score=Case(
-                When(deadline__lt=now, then=Value(3)),  # Overdue
-                When(priority='EXPRESS', then=Value(2)),  # Express
-                default=Value(1),  # Normal
-                output_field=IntegerField()
-            )
-        ).order_by('-urgency_score', 'deadline')
-        
-        serializer = ServiceItemSerializer(items, many=True)
-        return Response(serializer.data)
+        items = ServiceItem.objects.filter(urgency__gt=ServiceItem.URGENCY_CLOSED)
+
+        tramitador = request.query_params.get('tramitador')
+        if tramitador == 'none':
+            items = items.filter(assigned_tramitador__isnull=True)
+        elif tramitador:
+            if not tramitador.isdigit():
+                return Response({'error': 'Invalid tramitador'}, status=status.HTTP_400_BAD_REQUEST)
+            items = items.filter(assigned_tramitador_id=int(tramitador))
+
+        location = request.query_params.get('location')
+        if location:
+            if location not in dict(ServiceItem.LOCATION_CHOICES):
+                return Response({'error': 'Invalid location'}, status=status.HTTP_400_BAD_REQUEST)
+            items = items.filter(current_location=location)
+
+        pagination = KeysetPagination(self.ordering, settings.SMART_QUEUE_PAGE_SIZE, settings.SMART_QUEUE_MAX_PAGE_SIZE)
+        try:
+            page = pagination.paginate(items, request)
+        except InvalidPage as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = Response(SERVICE_ITEMS.get_many(page.pks, now=now))
+        if page.next_cursor:
+            response['X-Next-Cursor'] = page.next_cursor
+            response['Link'] = f'<{pagination.next_link(request, page.next_cursor)}>; rel="next"'
+        return response
+
+class AutoAssignView(APIView):
+    """
+    Workload-balanced assignment of service items to tramitadores (crm.assignment).
+
+    POST {"mode": "unassigned" | "rebalance", "tramitadores": [ids], "limit": n}
+    returns the plan without applying it; add "commit": true to apply it,
+    with the previewed "plan_id" to make sure exactly that plan is applied
+    (409 if the items changed meanwhile).
+    """
+    @idempotent
+    def post(self, request):
+        mode = request.data.get('mode', 'unassigned')
+        if mode not in assignment.MODES:
+            return Response({'error': 'Invalid mode'}, status=status.HTTP_400_BAD_REQUEST)
+        tramitadores = request.data.get('tramitadores')
+        limit = request.data.get('limit')
+        if tramitadores is not None and (
+                not isinstance(tramitadores, list) or not all(isinstance(pk, int) for pk in tramitadores)):
+            return Response({'error': 'tramitadores must be a list of user ids'}, status=status.HTTP_400_BAD_REQUEST)
+        if limit is not None and (not isinstance(limit, int) or limit < 1):
+            return Response({'error': 'Invalid limit'}, status=status.HTTP_400_BAD_REQUEST)
+        if tramitadores is not None:
+            # Only active members of the group can be given work (unknown ids would fail on the foreign key)
+            unknown = sorted(set(tramitadores) - set(assignment.tramitador_ids()))
+            if unknown:
+                return Response({'error': f"Not active tramitadores: {', '.join(map(str, unknown))}"},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+        plan = assignment.plan_assignments(tramitadores, mode=mode, limit=limit)
+        data = plan.as_dict()
+        data['committed'] = False
+        if request.data.get('commit'):
+            expected = request.data.get('plan_id')
+            if expected and expected != plan.plan_id:
+                return Response({'error': 'The plan changed since the preview', **data},
+                                status=status.HTTP_409_CONFLICT)
+            data['applied'] = assignment.apply_plan(plan, user=request.user if request.user.is_authenticated else None)
+            data['committed'] = True
+        return Response(data)
+
+class BatchView(APIView):
+    """
+    Run an ordered list of operations in one transaction (crm.batch):
+    POST {"operations": [{"op", "ref", "target", "data"}, ...]}. Later
+    operations refer to the ids created by earlier ones as "$ref".
+    """
+    @idempotent
+    def post(self, request):
+        try:
+            data = batch.execute(request.data.get('operations'),
+                                 user=request.user if request.user.is_authenticated else None)
+        except batch.BatchError as exc:
+            return Response(exc.as_dict(), status=exc.status_code)
+        return Response(data)
+
+class SyncView(APIView):
+    """
+    Offline-first sync for branch offices (crm.sync). GET pulls the delta
+    for ?location= since ?cursor=; POST {"location", "cursor", "device",
+    "mutations"} applies the queued mutations, then pulls, in one round trip.
+    """
+    def get(self, request):
+        try:
+            return Response(sync.pull(request.query_params.get('location'), request.query_params.get('cursor')))
+        except (sync.SyncError, InvalidPage) as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+    def post(self, request):
+        user = request.user if request.user.is_authenticated else None
+        device = str(request.data.get('device') or '')[:100]
+        try:
+            if request.data.get('location') not in sync.LOCATIONS:
+                raise sync.SyncError('Invalid location')
+            results = sync.push(request.data.get('mutations') or [], user=user, device=device)
+            data = sync.pull(request.data['location'], request.data.get('cursor'))
+        except (sync.SyncError, InvalidPage) as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'results': results, **data})
@@ -5,3 +5,9 @@ timeout = 120
 accesslog = "/var/log/gunicorn/access.log"
 errorlog = "/var/log/gunicorn/error.log"
 loglevel = "info"
+
+
+def post_worker_init(worker):
+    # Receive fragment cache invalidations from the other workers (crm.invalidation)
+    from crm import invalidation
+    invalidation.start()